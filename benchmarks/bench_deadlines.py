@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""
+Behaviour of the camera control with simulated cameras that answer some requests very late (stalls) and with a camera
+that stops answering altogether for a while (blackhole), as an overheating camera or a roaming hotspot would.
+
+While recording, the duration of every state read is measured, i.e. how long a worker was blocked by its camera, along
+with the number of hedged or retried reads and of calls that ran into their deadline. Then one camera is blackholed,
+and the time until it is shown as disconnected, the time until it is controlled again once it answers, and whether the
+other cameras kept recording are reported.
+
+    python benchmarks/bench_deadlines.py --cameras 4 --stall 0.05 --duration 30
+    python benchmarks/bench_deadlines.py --no-hedge
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from camera_control import metrics, worker
+from camera_control.lumix_control import LumixCameraControl
+from camera_control.simulator import SimulatedLumix
+
+
+def wait_for(condition, timeout, what):
+    start = time.monotonic()
+    while not condition():
+        if time.monotonic() - start > timeout:
+            raise RuntimeError(f"{what} within {timeout} s")
+        time.sleep(0.01)
+    return time.monotonic() - start
+
+
+def wait_for_connected(workers):
+    start = time.monotonic()
+    while time.monotonic() - start < worker.MAX_RECONNECT_DELAY + 10:
+        for w in workers:
+            if w.connected:
+                return w
+        time.sleep(0.01)
+    raise RuntimeError("no camera is connected")
+
+
+def counter_total(counter):
+    return sum(counter._values.values())
+
+
+def main():
+    if args.no_hedge:
+        worker.READ_ATTEMPTS = 1
+    from video_time_webui import App
+
+    cameras = [SimulatedLumix(latency=args.latency, jitter=args.jitter, stall_time=args.stall_time, save_time=0.5)
+               for _ in range(args.cameras)]
+    app = App(engine=args.engine, interfaces=[], state_file="")
+    if app._engine is not None:
+        app._engine.start(discover=False)
+    for camera in cameras:
+        app.add_camera(camera.address, LumixCameraControl)
+    workers = app._registry.workers()
+    wait_for(lambda: all(w.connected and w.cam_state is not None for w in workers), 30, "cameras did not connect")
+
+    # measure every state read of the workers
+    reads = []
+    original = worker.CameraWorker._read_state
+
+    def timed_read_state(self):
+        start = time.monotonic()
+        try:
+            return original(self)
+        finally:
+            reads.append(time.monotonic() - start)
+
+    worker.CameraWorker._read_state = timed_read_state
+    app._set_should_record(True)
+    wait_for(lambda: all(camera.camera.recording for camera in cameras), 10, "not all cameras started recording")
+    # the cameras only start to stall once all of them are recording
+    for camera in cameras:
+        camera.camera.stall = args.stall
+    time.sleep(args.duration)
+    reads.sort()
+    print(f"{len(reads)} state reads: median {1000 * reads[len(reads) // 2]:.0f} ms, "
+          f"p99 {1000 * reads[int(len(reads) * 0.99)]:.0f} ms, max {1000 * reads[-1]:.0f} ms")
+    print(f"hedged or retried reads: {counter_total(metrics.camera_read_attempts_total)}, "
+          f"deadlines exceeded: {counter_total(metrics.camera_deadline_exceeded_total)}, "
+          f"unconfirmed commands: {counter_total(metrics.camera_unconfirmed_commands_total)}")
+
+    for camera in cameras:
+        camera.camera.stall = 0
+    blackholed_worker = wait_for_connected(workers)
+    blackholed = next(camera for camera in cameras if camera.address == blackholed_worker.ip)
+    blackholed.camera.blackhole = True
+    disconnected = wait_for(lambda: not blackholed_worker.connected, 60, "the blackholed camera was not disconnected")
+    print(f"blackholed camera shown as disconnected after {disconnected:.2f} s")
+    time.sleep(args.blackhole_time)
+    others = [camera for camera in cameras if camera is not blackholed]
+    print(f"other cameras recording during the blackhole: "
+          f"{sum(camera.camera.recording for camera in others)}/{len(others)}")
+    blackholed.camera.blackhole = False
+    reconnected = wait_for(lambda: blackholed_worker.connected and blackholed_worker.cam_state is not None,
+                           worker.MAX_RECONNECT_DELAY + 10, "the camera was not reconnected")
+    print(f"controlled again {reconnected:.2f} s after it answered again")
+    # don't wait for the camera workers, which would keep polling during interpreter shutdown
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Camera control with stalling and blackholed simulated cameras")
+    parser.add_argument("--cameras", type=int, default=4, help="simulated Lumix cameras")
+    parser.add_argument("--engine", default="thread", choices=["thread", "asyncio"])
+    parser.add_argument("--duration", type=float, default=30, help="seconds to record with stalling cameras")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--stall", type=float, default=0.05, help="probability that a request is answered very late")
+    parser.add_argument("--stall-time", type=float, default=30, help="seconds a stalled request is delayed")
+    parser.add_argument("--blackhole-time", type=float, default=5,
+                        help="seconds the blackholed camera does not answer after it was shown as disconnected")
+    parser.add_argument("--no-hedge", action="store_true", help="only send a state read once, for comparison")
+    args = parser.parse_args()
+    main()
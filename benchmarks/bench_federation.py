@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+"""
+Start skew of the cameras of several federated web UI instances, each running as its own process on this host with
+simulated cameras and a simulated clock offset.
+
+The first instance is the primary, the others are its peers. Recording is started through the primary's /record, and
+the spread of the times at which the simulated cameras of all instances started recording is reported, along with how
+well the primary estimated the clock offsets of its peers.
+
+    python benchmarks/bench_federation.py --clock-offsets 0 0.7 -1.3 --cameras 2 --trials 5
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from camera_control.simulator import SimulatedLumix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request(port, path, data=None):
+    # like the web UI, send the body as plain text, as Flask would parse a form body
+    req = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=data, headers={"Content-Type": "text/plain"})
+    with urllib.request.urlopen(req, timeout=5) as response:
+        body = response.read()
+        return json.loads(body) if body else None
+
+
+def run_node(config):
+    """
+    Runs in an instance's process: the web UI with a clock that is off by the given offset
+    """
+    from video_time_webui import App
+    offset = config["clock_offset"]
+    App(host="127.0.0.1", port=config["port"], interfaces=[], state_file=config["state_file"],
+        peers=config.get("peers"), primary=config.get("primary"), clock=lambda: time.time() + offset).run()
+
+
+def wait_for(condition, timeout, what):
+    start = time.monotonic()
+    while not condition():
+        if time.monotonic() - start > timeout:
+            raise RuntimeError(f"{what} within {timeout} s")
+        time.sleep(0.02)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    cameras = [[SimulatedLumix(latency=args.latency, jitter=args.jitter, save_time=args.save_time)
+                for _ in range(args.cameras)] for _ in args.clock_offsets]
+    ports = [free_port() for _ in args.clock_offsets]
+    processes = []
+    try:
+        for i, (offset, port) in enumerate(zip(args.clock_offsets, ports)):
+            # the cameras are passed in through the state file, as if they were known from before a restart
+            state_file = os.path.join(directory, f"node{i}.json")
+            with open(state_file, "w") as f:
+                json.dump({"version": 1, "should_record": False, "cameras": [
+                    {"address": camera.address, "driver": "lumix", "name": None} for camera in cameras[i]
+                ]}, f)
+            config = {"port": port, "state_file": state_file, "clock_offset": offset}
+            if i == 0 and not args.register:
+                config["peers"] = [f"http://127.0.0.1:{peer_port}" for peer_port in ports[1:]]
+            elif i > 0 and args.register:
+                config["primary"] = f"http://127.0.0.1:{ports[0]}"
+            processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), "--node", json.dumps(config)],
+                                              cwd=ROOT, stderr=subprocess.DEVNULL if not args.verbose else None))
+
+        primary = ports[0]
+        total = sum(len(node_cameras) for node_cameras in cameras)
+
+        def all_connected():
+            try:
+                state = request(primary, "/get_state")
+                stats = request(primary, "/stats")
+            except OSError:
+                return False
+            peers = (stats["federation"] or {}).get("peers", {})
+            return (len(state["cameras"]) == total and all(camera["remaining"] is not None
+                                                           for camera in state["cameras"].values())
+                    and all(peer["round_trip"] is not None for peer in peers.values()))
+
+        start = time.monotonic()
+        wait_for(all_connected, 60, "the primary did not see all cameras")
+        print(f"primary sees {total} cameras of {len(ports)} instances after {time.monotonic() - start:.2f} s")
+
+        peers = request(primary, "/stats")["federation"]["peers"]
+        for port, offset in zip(ports[1:], args.clock_offsets[1:]):
+            peer = peers[f"127.0.0.1:{port}"]
+            estimated = peer["clock_offset"] - args.clock_offsets[0]
+            print(f"peer 127.0.0.1:{port}: clock offset {offset - args.clock_offsets[0]:+.3f} s, estimated "
+                  f"{estimated:+.4f} s, error {1000 * (estimated - offset + args.clock_offsets[0]):+.2f} ms, "
+                  f"round trip {1000 * peer['round_trip']:.2f} ms")
+
+        all_cameras = [camera for node_cameras in cameras for camera in node_cameras]
+        skews = []
+        for trial in range(args.trials):
+            request(primary, "/record", b"true")
+            wait_for(lambda: all(camera.camera.recording for camera in all_cameras), 10,
+                     "not all cameras started recording")
+            starts = [camera.camera._recording_since for camera in all_cameras]
+            skews.append(max(starts) - min(starts))
+            lead = request(primary, "/stats")["federation"]["last_record"]["lead"]
+            print(f"trial {trial + 1}: start skew {1000 * skews[-1]:6.1f} ms, lead {1000 * lead:.0f} ms")
+            request(primary, "/record", b"false")
+            wait_for(lambda: not any(camera.camera.recording or camera.camera.saving for camera in all_cameras), 10,
+                     "not all cameras stopped recording")
+        print(f"start skew: mean {1000 * sum(skews) / len(skews):.1f} ms, max {1000 * max(skews):.1f} ms")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Start skew of federated web UI instances")
+    parser.add_argument("--clock-offsets", type=float, nargs="+", default=[0, 0.7, -1.3],
+                        help="simulated clock offset of every instance in seconds, the first one is the primary")
+    parser.add_argument("--cameras", type=int, default=2, help="simulated Lumix cameras per instance")
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="network round trip of the simulated cameras")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--save-time", type=float, default=0.5)
+    parser.add_argument("--register", action="store_true",
+                        help="let the peers register at the primary instead of passing them to it with --peers")
+    parser.add_argument("--verbose", action="store_true", help="show the log output of the instances")
+    parser.add_argument("--node", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.node:
+        run_node(json.loads(args.node))
+    else:
+        main()
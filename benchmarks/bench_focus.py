@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"""
+Steps and wall time of focus racks against a simulated Lumix lens whose step sizes differ from the defaults.
+
+Compares the previous rack_focus algorithm, which assumed fixed step sizes and waited for every response, with the
+focus engine with and without pipelining, and checks how closely timed racks hit their duration.
+
+    python benchmarks/bench_focus.py --latency 0.03
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera_control.focus import parse_focus_position
+from camera_control.lumix_control import LumixCameraControl
+from camera_control.simulator import SimulatedLumix
+
+
+def legacy_rack_focus(control, end_point, speed):
+    """
+    The rack from the current position to end_point as implemented before the focus engine
+    """
+    current_position = parse_focus_position(control.focus_control("tele", "normal").text)
+    threshold = 70 if speed == "fast" else 13
+    if current_position > end_point:
+        while current_position - end_point > threshold:
+            current_position = parse_focus_position(control.focus_control("tele", speed).text)
+            if current_position - end_point <= threshold:
+                threshold = 13
+                speed = "normal"
+    else:
+        while end_point - current_position > threshold:
+            current_position = parse_focus_position(control.focus_control("wide", speed).text)
+            if end_point - current_position <= threshold:
+                threshold = 13
+                speed = "normal"
+
+
+def run(name, server, rack, target):
+    server.camera.focus_position = args.start
+    steps_before = server.requests["camctrl"]
+    start = time.monotonic()
+    rack()
+    elapsed = time.monotonic() - start
+    steps = server.requests["camctrl"] - steps_before
+    error = server.camera.focus_position - target
+    print(f"{name:>24}: {steps:4} steps, {elapsed:6.2f} s, error {error:+4}")
+
+
+def main():
+    server = SimulatedLumix(latency=args.latency, jitter=args.jitter,
+                            focus_steps={"normal": args.normal_step, "fast": args.fast_step},
+                            focus_step_time=args.step_time)
+    control = LumixCameraControl(server.address)
+
+    run("legacy, fast", server, lambda: legacy_rack_focus(control, args.end, "fast"), args.end)
+    for depth in (1, 4):
+        control = LumixCameraControl(server.address)
+        # the first rack learns the step sizes of the lens, the second one uses them
+        for attempt in ("first", "learned"):
+            run(f"engine depth {depth}, {attempt}", server,
+                lambda: control.rack_focus("current", args.end, "fast", pipeline_depth=depth), args.end)
+            server.camera.focus_position = args.start
+            control.focus_engine(depth).position = None
+
+    for duration in args.durations:
+        for depth in (1, 4):
+            control.focus_engine(depth).position = None
+            run(f"timed {duration} s, depth {depth}", server,
+                lambda: control.rack_focus("current", args.end, "fast", duration=duration, pipeline_depth=depth),
+                args.end)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Focus rack benchmark with a simulated lens")
+    parser.add_argument("--start", type=int, default=900, help="focus position before each rack")
+    parser.add_argument("--end", type=int, default=100, help="target focus position")
+    parser.add_argument("--normal-step", type=int, default=9, help="normal step size of the simulated lens")
+    parser.add_argument("--fast-step", type=int, default=47, help="fast step size of the simulated lens")
+    parser.add_argument("--latency", type=float, default=0.03, help="network round trip of the simulated camera")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--step-time", type=float, default=0.02, help="seconds the simulated lens needs per step")
+    parser.add_argument("--durations", type=float, nargs="*", default=[2, 5])
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+"""
+CPU time the web UI spends on many clients that follow the state of a steady rig, with simulated cameras.
+
+The web UI runs in its own process, so that its CPU time can be measured apart from the clients. For every mode, the
+given number of clients request the state for a while:
+
+- stats: /stats every second, which assembles the statistics of all cameras like /get_state did before it was cached
+- poll: /get_state every second
+- conditional: /get_state every second with If-None-Match, answered with 304 while nothing changes
+- long-poll: /get_state?since=<version>, answered only when something changes
+
+    python benchmarks/bench_get_state.py --cameras 8 --clients 50 --duration 10
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from camera_control.simulator import SimulatedLumix
+
+MODES = ["stats", "poll", "conditional", "long-poll"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def client(port, mode, until, counts, lock):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    etag = None
+    version = None
+    while time.monotonic() < until:
+        headers = {}
+        path = "/stats" if mode == "stats" else "/get_state"
+        if mode == "conditional" and etag is not None:
+            headers["If-None-Match"] = etag
+        if mode == "long-poll" and version is not None:
+            path += f"?since={version}&wait={max(min(until - time.monotonic(), 30), 0):.1f}"
+        started = time.monotonic()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        with lock:
+            counts["requests"] += 1
+            counts["bytes"] += len(body)
+        if response.status == 200 and mode != "stats":
+            etag = response.getheader("ETag")
+            version = json.loads(body)["version"]
+        if mode != "long-poll":
+            time.sleep(max(1 - (time.monotonic() - started), 0))
+    connection.close()
+
+
+def main():
+    cameras = [SimulatedLumix(latency=0.01) for _ in range(args.cameras)]
+    state_file = os.path.join(tempfile.mkdtemp(), "state.json")
+    with open(state_file, "w") as f:
+        json.dump({"version": 1, "should_record": False, "cameras": [
+            {"address": camera.address, "driver": "lumix", "name": None} for camera in cameras
+        ]}, f)
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "video_time_webui.py"), "--host", "127.0.0.1",
+                                "--port", str(port), "--interfaces", "lo", "--state-file", state_file,
+                                "--log-level", "WARNING"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        start = time.monotonic()
+        while True:
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                connection.request("GET", "/get_state")
+                state = json.loads(connection.getresponse().read())
+                if len(state["cameras"]) == args.cameras and all(camera["remaining"] is not None
+                                                                 for camera in state["cameras"].values()):
+                    break
+            except OSError:
+                pass
+            if time.monotonic() - start > 30:
+                raise RuntimeError("the cameras did not connect within 30 s")
+            time.sleep(0.1)
+
+        idle_before = cpu_seconds(process.pid)
+        time.sleep(args.duration)
+        idle = cpu_seconds(process.pid) - idle_before
+        print(f"{'idle':>12}: CPU {100 * idle / args.duration:5.1f} %")
+        for mode in args.modes:
+            counts = {"requests": 0, "bytes": 0}
+            lock = threading.Lock()
+            until = time.monotonic() + args.duration
+            before = cpu_seconds(process.pid)
+            threads = [threading.Thread(target=client, args=(port, mode, until, counts, lock), daemon=True)
+                       for _ in range(args.clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            cpu = cpu_seconds(process.pid) - before - idle
+            print(f"{mode:>12}: CPU {100 * cpu / args.duration:5.1f} % above idle, {counts['requests']:6} requests, "
+                  f"{counts['bytes'] / 1024:8.0f} KiB")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CPU time of clients following the state of the web UI")
+    parser.add_argument("--cameras", type=int, default=8, help="simulated Lumix cameras")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10, help="seconds per mode")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args()
+    main()
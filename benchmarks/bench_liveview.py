@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""
+Throughput of the live view parsers.
+
+By default, a simulated Sony live view stream is parsed from memory. A stream recorded from a camera, e.g. with
+`curl <liveview URL> > stream.bin`, can be used instead with --file. With --http, the stream is received over HTTP
+from a simulated camera, including the copy of every frame that is passed on to clients.
+
+    python benchmarks/bench_liveview.py --frames 2000 --frame-size 40000
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera_control.liveview import SonyLiveviewParser, SonyLiveView, extract_jpeg
+from camera_control.simulator import (SONY_FRAME_INFO, SONY_PAYLOAD_FRAME_INFO, SONY_PAYLOAD_IMAGE, SimulatedLumix,
+                                      SimulatedSony, dummy_jpeg, sony_liveview_packet)
+from camera_control.sony_control import SonyCameraControl
+
+
+def report(name, frames, size, elapsed, cpu):
+    print(f"{name:>12}: {frames} frames, {frames / elapsed:9.0f} frames/s, {size / elapsed / 2 ** 20:8.1f} MiB/s, "
+          f"{1e6 * cpu / max(frames, 1):6.1f} µs CPU/frame")
+
+
+def bench_sony_parser(stream: bytes):
+    source = io.BytesIO(stream)
+    frames = 0
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for frame in SonyLiveviewParser(source.readinto).frames():
+        frames += 1
+    report("sony parser", frames, len(stream), time.perf_counter() - start, time.process_time() - cpu_start)
+
+
+def bench_lumix_extract(frames, frame_size):
+    datagram = SimulatedLumix._make_frame(frame_size)
+    buffer = bytearray(65536)
+    buffer[:len(datagram)] = datagram
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for _ in range(frames):
+        with extract_jpeg(buffer, len(datagram)):
+            pass
+    report("lumix parser", frames, frames * len(datagram), time.perf_counter() - start,
+           time.process_time() - cpu_start)
+
+
+def bench_sony_http(duration, frame_size):
+    server = SimulatedSony(liveview_fps=10000, liveview_frame_size=frame_size)
+    control = SonyCameraControl(server.address)
+    control.__enter__()
+    # pass every frame on, like an unlimited number of clients would need
+    liveview = SonyLiveView(control, max_fps=1e9)
+    frames = liveview.frames()
+    liveview.start()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    while time.perf_counter() - start < duration:
+        next(frames)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    frames.close()
+    # CPU time includes the simulated camera, which runs in the same process
+    report("sony http", liveview.frames_received, liveview.frames_received * frame_size, elapsed, cpu)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live view parser throughput")
+    parser.add_argument("--frames", type=int, default=2000, help="number of frames in the simulated stream")
+    parser.add_argument("--frame-size", type=int, default=40000, help="bytes per simulated JPEG frame")
+    parser.add_argument("--file", help="recorded Sony live view stream to parse instead of a simulated one")
+    parser.add_argument("--http", type=float, metavar="SECONDS",
+                        help="also receive a simulated stream over HTTP for this many seconds")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            stream = f.read()
+    else:
+        frame = dummy_jpeg(args.frame_size)
+        stream = b"".join(
+            sony_liveview_packet(SONY_PAYLOAD_IMAGE, i, frame) + sony_liveview_packet(SONY_PAYLOAD_FRAME_INFO, i, SONY_FRAME_INFO)
+            for i in range(args.frames)
+        )
+        bench_lumix_extract(args.frames, args.frame_size)
+    bench_sony_parser(stream)
+    if args.http:
+        bench_sony_http(args.http, args.frame_size)
+
+
+if __name__ == '__main__':
+    main()
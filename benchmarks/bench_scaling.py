@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+"""
+Measures how the web UI's camera control scales with the number of cameras, using simulated cameras.
+
+For every engine and number of cameras, the simulated cameras run in one process and the controller in another, so
+that the CPU time and memory of the controller can be measured on their own. Recording is started through /record and
+kept running for the given duration while the simulated cameras cut their recordings off.
+
+    python benchmarks/bench_scaling.py --cameras 1 4 16 64 --duration 60
+    python benchmarks/bench_scaling.py --cameras 2 --discover off lo,eth0
+
+With --discover, every configuration is also measured while the controller searches for cameras on the given
+interfaces, whose SSDP searches block for several seconds each.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLUMNS = [
+    ("engine", "{}"),
+    ("cameras", "{}"),
+    ("discovery", "{}"),
+    ("connect_s", "{:.2f}"),
+    ("cpu_pct", "{:.1f}"),
+    ("rss_mb", "{:.1f}"),
+    ("threads", "{}"),
+    ("reads_per_s", "{:.2f}"),
+    ("jitter_mean_ms", "{:.1f}"),
+    ("jitter_p99_ms", "{:.0f}"),
+    ("restarts", "{}"),
+    ("gap_mean_s", "{:.2f}"),
+    ("gap_max_s", "{:.2f}"),
+    ("skew_sent_ms", "{:.1f}"),
+    ("skew_ack_ms", "{:.1f}"),
+]
+
+
+def histogram_quantile(histogram, q):
+    """
+    Upper bound of the bucket containing the given quantile
+    """
+    counts, _ = histogram.totals()
+    target = q * sum(counts)
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + (float("inf"),), counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+def calls(histogram, call):
+    """
+    Number of camera API calls of the given kind so far
+    """
+    return sum(sum(counts) for labels, (counts, _) in list(histogram._values.items()) if labels[1] == call)
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def measure(engine, addresses, duration, use_events, discover):
+    """
+    Runs in the controller process: controls the cameras at the given addresses, searching for cameras on the given
+    interfaces unless discover is "off", and returns the measurements
+    """
+    sys.path.insert(0, ROOT)
+    from camera_control import metrics
+    from camera_control.lumix_control import LumixCameraControl
+    from camera_control.sony_control import SonyCameraControl
+    from video_time_webui import App
+
+    types = {"SimulatedLumix": LumixCameraControl, "SimulatedSony": SonyCameraControl}
+    interfaces = [] if discover == "off" else discover.split(",")
+    app = App(engine=engine, use_events=use_events, max_cameras=len(addresses), interfaces=interfaces)
+    if app._engine is not None:
+        app._engine.start(discover=bool(interfaces))
+    elif interfaces:
+        app._discover_thread.start()
+    client = app._app.test_client()
+
+    start = time.monotonic()
+    for camera in addresses:
+        app.add_camera(camera["address"], types[camera["type"]])
+    while True:
+        cameras = client.get("/get_state").get_json()["cameras"]
+        # the fan-out only sends commands to cameras whose state is known
+        if len(cameras) == len(addresses) and all(camera["remaining"] is not None for camera in cameras.values()):
+            break
+        if time.monotonic() - start > 60:
+            raise RuntimeError("cameras did not connect within 60 s")
+        time.sleep(0.05)
+    connect_time = time.monotonic() - start
+
+    cpu_before = os.times()
+    reads_before = calls(metrics.camera_request_seconds, "get_state")
+    client.post("/record", data="true")
+    time.sleep(duration)
+    cpu_after = os.times()
+    reads = calls(metrics.camera_request_seconds, "get_state") - reads_before
+    state = client.get("/stats").get_json()
+
+    cpu = (cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system)
+    jitter_counts, jitter_sum = metrics.poll_jitter_seconds.totals()
+    restarts = [camera["restart"] for camera in state["cameras"].values()]
+    gaps = sum(restart["restarts"] for restart in restarts)
+    skew = state["command_skew"] or {"sent": float("nan"), "acknowledged": float("nan")}
+    return {
+        "engine": engine,
+        "cameras": len(addresses),
+        "discovery": discover,
+        "connect_s": connect_time,
+        "cpu_pct": 100 * cpu / duration,
+        "rss_mb": rss_mb(),
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "threads": threading.active_count(),
+        "reads_per_s": reads / len(addresses) / duration,
+        "jitter_mean_ms": 1000 * jitter_sum / max(sum(jitter_counts), 1),
+        "jitter_p99_ms": 1000 * histogram_quantile(metrics.poll_jitter_seconds, 0.99),
+        "restarts": gaps,
+        "gap_mean_s": sum(r["mean_gap"] * r["restarts"] for r in restarts if r["restarts"]) / gaps if gaps else float("nan"),
+        "gap_max_s": max((r["max_gap"] for r in restarts if r["restarts"]), default=float("nan")),
+        "skew_sent_ms": 1000 * skew["sent"],
+        "skew_ack_ms": 1000 * skew["acknowledged"],
+    }
+
+
+def run(engine, cameras, discover, args):
+    """
+    Starts the simulated cameras and a controller process, and returns the controller's measurements
+    """
+    simulator_args = [
+        sys.executable, "-m", "camera_control.simulator",
+        "--lumix", str(cameras - cameras * args.sony_share // 100), "--sony", str(cameras * args.sony_share // 100),
+        "--cutoff", str(args.cutoff), "--save-time", str(args.save_time),
+        "--latency", str(args.latency), "--jitter", str(args.jitter), "--loss", str(args.loss),
+    ]
+    simulator = subprocess.Popen(simulator_args, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    try:
+        addresses = simulator.stdout.readline()
+        controller_args = [
+            sys.executable, os.path.abspath(__file__), "--measure", addresses,
+            "--engine", engine, "--duration", str(args.duration), "--discover", discover,
+        ]
+        if args.events:
+            controller_args.append("--events")
+        output = subprocess.run(controller_args, cwd=ROOT, stdout=subprocess.PIPE, text=True, check=True).stdout
+        return json.loads(output.splitlines()[-1])
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+
+def print_row(values):
+    print("  ".join(f"{value:>{max(len(name), 8)}}" for (name, _), value in zip(COLUMNS, values)), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the camera control with simulated cameras")
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--engine", nargs="+", choices=["thread", "asyncio"], default=["thread", "asyncio"])
+    parser.add_argument("--duration", type=float, default=60, help="seconds to record for each configuration")
+    parser.add_argument("--cutoff", type=float, default=20, help="seconds after which simulated recordings stop")
+    parser.add_argument("--save-time", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--sony-share", type=int, default=0, help="percentage of simulated Sony cameras")
+    parser.add_argument("--events", action="store_true", help="use state change events of the Sony cameras")
+    parser.add_argument("--discover", nargs="+", default=["off"],
+                        help="comma separated interfaces to search for cameras on while measuring, or off")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON lines instead of a table")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.engine[0], json.loads(args.measure), args.duration, args.events,
+                                    args.discover[0])), flush=True)
+        # don't wait for the camera workers, which would keep polling or log errors during interpreter shutdown
+        os._exit(0)
+
+    if not args.json:
+        print_row([name for name, _ in COLUMNS])
+    for engine in args.engine:
+        for cameras in args.cameras:
+            for discover in args.discover:
+                result = run(engine, cameras, discover, args)
+                if args.json:
+                    print(json.dumps(result), flush=True)
+                else:
+                    print_row([fmt.format(result[name]) for name, fmt in COLUMNS])
+
+
+if __name__ == '__main__':
+    main()
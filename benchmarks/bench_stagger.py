@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+"""
+Coverage of a rig of simulated cameras that were started together, with and without staggered restarts.
+
+For every value of --min-recording, the cameras record for the given duration and hit their (short) recording time
+limit several times. The coverage is computed from the clips the simulated cameras actually recorded: the share of
+the time at least N cameras were recording, the fewest cameras recording at any time, and the time no camera was
+recording at all. With staggered restarts, the coverage predicted by the orchestrator is reported as well.
+
+    python benchmarks/bench_stagger.py --cameras 4 --min-recording 0 3 --cutoff 60 --duration 180
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def coverage(intervals, start, end, min_recording):
+    """
+    Seconds with at least min_recording and with no camera recording, and the fewest cameras recording, between start
+    and end, given the (start, end) times of all recorded clips
+    """
+    events = sorted([(max(a, start), 1) for a, b in intervals if b > start and a < end] +
+                    [(min(b, end), -1) for a, b in intervals if b > start and a < end])
+    recording = 0
+    fewest = None
+    covered = none = 0.0
+    last = start
+    for t, change in events:
+        if t > last:
+            fewest = recording if fewest is None else min(fewest, recording)
+            covered += (t - last) if recording >= min_recording else 0
+            none += (t - last) if recording == 0 else 0
+            last = t
+        recording += change
+    if end > last:
+        fewest = recording if fewest is None else min(fewest, recording)
+        covered += (end - last) if recording >= min_recording else 0
+        none += (end - last) if recording == 0 else 0
+    return covered, none, fewest
+
+
+def measure(min_recording):
+    """
+    Runs in a child process: records with the given minimum of recording cameras (0 for no staggering)
+    """
+    from camera_control.lumix_control import LumixCameraControl
+    from camera_control.simulator import SimulatedLumix
+    from video_time_webui import App
+
+    cameras = [SimulatedLumix(cutoff=args.cutoff, save_time=args.save_time, latency=args.latency, jitter=args.jitter)
+               for _ in range(args.cameras)]
+    app = App(interfaces=[], state_file="", min_recording=min_recording or None)
+    for camera in cameras:
+        app.add_camera(camera.address, LumixCameraControl)
+    client = app._app.test_client()
+    start = time.monotonic()
+    while not all(camera["remaining"] is not None for camera in client.get("/get_state").get_json()["cameras"].values()):
+        if time.monotonic() - start > 30:
+            raise RuntimeError("cameras did not connect within 30 s")
+        time.sleep(0.05)
+    if app._orchestrator is not None:
+        app._orchestrator.start()
+
+    client.post("/record", data="true")
+    start = time.time()
+    time.sleep(args.duration)
+    end = time.time()
+    stats = client.get("/stats").get_json()
+    intervals = []
+    for camera in cameras:
+        intervals += camera.camera.clips
+        if camera.camera._recording_since is not None:
+            intervals.append((camera.camera._recording_since, end))
+    wanted = min_recording or args.cameras
+    covered, none, fewest = coverage(intervals, start + args.settle, end, wanted)
+    orchestrator = stats["orchestrator"] or {}
+    return {
+        "min_recording": min_recording,
+        "clips": sum(len(camera.camera.clips) for camera in cameras),
+        "covered": covered / (end - start - args.settle),
+        "none_s": none,
+        "fewest": fewest,
+        "early_restarts": orchestrator.get("early_restarts"),
+        "predicted_min": orchestrator.get("predicted_min_recording"),
+        "unstaggered_min": orchestrator.get("unstaggered_min_recording"),
+        "achieved": (orchestrator.get("achieved") or {}).get("covered"),
+    }
+
+
+def main():
+    print(f"{args.cameras} cameras, recordings cut off after {args.cutoff:.0f} s, {args.duration:.0f} s of recording")
+    for min_recording in args.min_recording:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--measure",
+                                 str(min_recording)], cwd=ROOT, stdout=subprocess.PIPE, text=True, check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        wanted = min_recording or args.cameras
+        line = (f"min recording {min_recording or 'off':>3}: {result['clips']:3} clips, "
+                f"{100 * result['covered']:5.1f} % of the time >= {wanted} recording, "
+                f"fewest {result['fewest']}, none recording for {result['none_s']:.1f} s")
+        if min_recording:
+            line += (f", {result['early_restarts']} early restarts, orchestrator: predicted min "
+                     f"{result['predicted_min']} (unstaggered {result['unstaggered_min']}), "
+                     f"achieved {100 * (result['achieved'] or 0):.1f} %")
+        print(line, flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Coverage of simulated cameras with and without staggered restarts")
+    parser.add_argument("--cameras", type=int, default=4, help="simulated Lumix cameras")
+    parser.add_argument("--min-recording", type=int, nargs="+", default=[0, 3],
+                        help="cameras to keep recording at any time, 0 to not stagger the restarts")
+    parser.add_argument("--cutoff", type=float, default=60, help="seconds after which simulated recordings stop")
+    parser.add_argument("--save-time", type=float, default=1.5)
+    parser.add_argument("--duration", type=float, default=180, help="seconds to record for each configuration")
+    parser.add_argument("--settle", type=float, default=5, help="seconds after the start that are not counted")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--measure", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure is not None:
+        print(json.dumps(measure(args.measure)), flush=True)
+        # don't wait for the camera workers, which would keep polling during interpreter shutdown
+        os._exit(0)
+    main()
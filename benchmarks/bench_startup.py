@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+"""
+Startup time of the web UI, from starting the process until the web UI answers and until the camera drivers have been
+loaded, plus the import time of the main module and of each driver on its own.
+
+New drivers should not make the web UI answer later, as they are only imported once it is being served.
+
+    python benchmarks/bench_startup.py --runs 5 --drivers "lumix sony" lumix
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from camera_control.drivers import BUILTIN_DRIVERS
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(port, path):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+            return response.read()
+    except OSError:
+        return None
+
+
+def start_web_ui(drivers, engine, timeout):
+    """
+    Starts the web UI and returns the seconds until it served the index page and until all drivers were loaded
+    """
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, "video_time_webui.py"), "--host", "127.0.0.1", "--port", str(port),
+               "--interfaces", args.interface, "--engine", engine, "--log-level", "WARNING", "--state-file", "",
+               "--drivers", *drivers]
+    start = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    serving = loaded = None
+    try:
+        while time.monotonic() - start < timeout and loaded is None:
+            if serving is None:
+                if get(port, "/") is not None:
+                    serving = time.monotonic() - start
+            else:
+                stats = get(port, "/stats")
+                if stats is not None and all(seconds is not None for seconds in json.loads(stats)["drivers"].values()):
+                    loaded = time.monotonic() - start
+            time.sleep(0.005)
+    finally:
+        process.kill()
+        process.wait()
+    if loaded is None:
+        raise RuntimeError(f"web UI with drivers {drivers} did not start within {timeout} s")
+    return serving, loaded
+
+
+def import_time(module):
+    start = time.monotonic()
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT, check=True)
+    return time.monotonic() - start
+
+
+def main():
+    baseline = statistics.median(import_time("os") for _ in range(args.runs))
+    modules = {"web UI": "video_time_webui",
+               **{name: reference.partition(":")[0] for name, reference in BUILTIN_DRIVERS.items()}}
+    for name, module in modules.items():
+        seconds = statistics.median(import_time(module) for _ in range(args.runs)) - baseline
+        print(f"{'import ' + name:>28}: {1000 * seconds:7.0f} ms")
+
+    for drivers in args.drivers:
+        drivers = drivers.split()
+        runs = [start_web_ui(drivers, args.engine, args.timeout) for _ in range(args.runs)]
+        serving = statistics.median(run[0] for run in runs)
+        loaded = statistics.median(run[1] for run in runs)
+        print(f"{' '.join(drivers):>28}: serving after {1000 * serving:5.0f} ms, "
+              f"drivers loaded after {1000 * loaded:5.0f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Startup time of the web UI")
+    parser.add_argument("--runs", type=int, default=5, help="runs per configuration, the median is reported")
+    parser.add_argument("--drivers", nargs="+", default=["lumix sony", "lumix", "sony"],
+                        help="driver configurations to start the web UI with, each a space separated list")
+    parser.add_argument("--engine", default="thread", choices=["thread", "asyncio"])
+    parser.add_argument("--interface", default="lo", help="network interface to discover cameras on")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+    main()
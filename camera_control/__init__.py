@@ -1,5 +1,6 @@
 import dataclasses
 import datetime as dt
+import functools
 from abc import ABC
 from typing import Optional
 
@@ -8,13 +9,50 @@ from typing import Optional
 class CameraState:
     recording: Optional[bool]
     remaining: Optional[dt.timedelta]
+    # the recording has been stopped, but the camera is still saving the clip and reports itself as recording
+    saving: bool = False
 
 
 class CameraControl(ABC):
+    # SSDP search target the camera answers to
+    ssdp_search_target = None
+    # True if get_state(wait=True) blocks until the camera reports a state change
+    supports_events = False
+    # seconds to wait before reconnecting after the connection to the camera was lost
+    reconnect_delay = 5
+    # True if create_liveview is implemented
+    supports_liveview = False
+    # True if apply_settings is implemented
+    supports_settings = False
+    # executor the async variants of the interface run the blocking calls on, None for the event loop's default one
+    executor = None
+
     @classmethod
     def discover(cls):
         pass
 
+    @classmethod
+    def address_from_ssdp(cls, headers: dict) -> Optional[str]:
+        """
+        Returns the camera address if the given SSDP response or announcement headers belong to a supported camera
+        """
+        return None
+
+    @classmethod
+    def export_cache(cls) -> Optional[dict]:
+        """
+        Information the driver has cached about cameras to speed up reconnecting to them, as JSON compatible data that
+        is kept across restarts of the web UI, or None
+        """
+        return None
+
+    @classmethod
+    def import_cache(cls, data: dict):
+        """
+        Restores information returned by export_cache before the web UI was restarted
+        """
+        pass
+
     def __open__(self):
         pass
 
@@ -25,7 +63,71 @@ class CameraControl(ABC):
         pass
 
     def video_record_start(self):
+        """
+        Returns False if the camera did not accept the command, e.g. because it is still saving the previous recording
+        """
         pass
 
     def video_record_stop(self):
-        pass
\ No newline at end of file
+        pass
+
+    def connection_stats(self) -> Optional[dict]:
+        return None
+
+    @classmethod
+    def validate_settings(cls, settings: dict):
+        """
+        Raises ValueError if the camera does not support one of the settings' values
+        """
+        pass
+
+    def apply_settings(self, settings: dict, refresh=False) -> list:
+        """
+        Applies a settings profile (see camera_control.settings) and returns the names of the settings that were
+        changed. Settings that already have the wanted value are not sent to the camera.
+        """
+        raise NotImplementedError()
+
+    def create_liveview(self):
+        """
+        Returns a camera_control.liveview.LiveView thread receiving the camera's live view, which has not been started yet
+        """
+        raise NotImplementedError()
+
+    # Async variants of the interface, used by the asyncio engine. By default, the blocking implementations are run
+    # on the camera's executor, so drivers only need to override these if they have a native async transport. The
+    # asyncio engine gives every camera an executor of its own, so that a camera that does not answer until its
+    # deadline cannot delay the calls of any other camera.
+
+    @classmethod
+    async def async_discover(cls, executor=None, **kwargs):
+        return await _run_blocking(executor, functools.partial(cls.discover, **kwargs))
+
+    async def __aenter__(self):
+        return await _run_blocking(self.executor, self.__enter__)
+
+    async def __aexit__(self, *args):
+        return await _run_blocking(self.executor, self.__exit__, *args)
+
+    async def async_prepare(self):
+        return await _run_blocking(self.executor, self.prepare)
+
+    async def async_get_state(self) -> CameraState:
+        return await _run_blocking(self.executor, self.get_state)
+
+    async def async_video_record_start(self):
+        return await _run_blocking(self.executor, self.video_record_start)
+
+    async def async_video_record_stop(self):
+        return await _run_blocking(self.executor, self.video_record_stop)
+
+
+async def _run_blocking(executor, func, *args):
+    """
+    Runs func on the executor, or the event loop's default executor if it is None
+    """
+    # only imported here, as the thread engine does not use asyncio and importing it slows down the start of the web UI
+    import asyncio
+    import contextvars
+    # the executor does not pass on context variables by itself, e.g. the deadline of a camera call
+    return await asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, func, *args)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .deadline import deadline
+from .worker import CALL_DEADLINES, CameraWorker
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCameraSupervisor(CameraWorker):
+    """
+    Supervises a single camera as a task on the engine's event loop. Implements the same restart logic as
+    CameraControlThread.
+    """
+
+    def __init__(self, app, ip, type):
+        super().__init__(app, ip, type)
+        self._loop = None
+        self._wakeup = None
+        # runs this camera's blocking calls. A supervisor makes one call at a time, so a single thread is enough, and
+        # as no other camera uses it, a call that runs until its deadline only delays this camera.
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"io({ip})")
+        self._control.executor = self._io
+
+    def wake(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _wait(self, timeout):
+        waiting_since = time.monotonic()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+            self._observe_poll_delay(timeout, time.monotonic() - waiting_since)
+        self._wakeup.clear()
+        return woken
+
+    async def _get_state(self):
+        # hedged and retried like in the thread engine, so not the driver's async_get_state
+        return await self._loop.run_in_executor(self._io, self._read_state)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        logger.info(f"Camera control starting for {self.ip}")
+        while not self._stopped:
+            self.connected = False
+            try:
+                async with self._control:
+                    self._on_connected()
+
+                    with deadline(CALL_DEADLINES["prepare"]):
+                        await self._control.async_prepare()
+
+                    self._policy.reset()
+                    self.cam_state = await self._get_state()
+                    await self._loop.run_in_executor(self._io, self._apply_settings_on_connect)
+                    if self._use_events:
+                        # a long-poll blocks for up to a minute, so it runs on a thread of its own instead of
+                        # occupying the executor that all cameras share
+                        self._start_listener()
+                    while not self._stopped:
+                        # the commands share a lock with App's record fan-out, so they are issued from the executor
+                        await self._loop.run_in_executor(self._io, self._act, self.cam_state, self._app.should_record)
+                        self._publish()
+
+                        woken = await self._wait(self._wait_timeout())
+                        self._check_listener()
+                        if not self._use_events or not woken:
+                            self.cam_state = await self._get_state()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._wait(self._on_connection_failed(e))
+            finally:
+                self._connection += 1
+        self._io.shutdown(wait=False)
+        logger.info(f"Camera control stopped for {self.ip}")
+
+
+class AsyncCameraEngine:
+    """
+    Runs discovery and the supervision of all cameras on a single asyncio event loop in a background thread.
+
+    Camera drivers are still blocking, so every camera's HTTP calls run on a thread of its own (see
+    AsyncCameraSupervisor), and SSDP searches on threads of their own. A camera that does not answer until the deadline
+    of its calls therefore never delays the polls of another camera, which a thread pool shared by all cameras did.
+    """
+
+    def __init__(self, app, drivers, interfaces, backoff):
+        self._app = app
+        self._drivers = drivers
+        self._interfaces = interfaces
+        self._backoff = backoff
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="AsyncCameraEngine", daemon=True)
+        self._tasks = set()
+
+    def start(self, discover=True):
+        self._thread.start()
+        if discover:
+            asyncio.run_coroutine_threadsafe(self._discover(), self._loop)
+
+    def add_camera(self, ip, type):
+        """
+        Creates a supervisor for the camera and schedules it on the event loop. Safe to call from any thread.
+        """
+        supervisor = AsyncCameraSupervisor(self._app, ip, type)
+        self._loop.call_soon_threadsafe(self._spawn, supervisor.run())
+        return supervisor
+
+    def _spawn(self, coro):
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _discover(self):
+        # an SSDP search blocks for several seconds, so the searches run on an executor of their own, like in the
+        # thread engine, instead of delaying the cameras' I/O
+        executor = ThreadPoolExecutor(max_workers=max(len(self._drivers.names) * len(self._interfaces), 1),
+                                      thread_name_prefix="discover")
+        camera_types = await asyncio.get_running_loop().run_in_executor(executor, self._drivers.load_all)
+        while True:
+            searches = [(type, interface) for type in camera_types for interface in self._interfaces]
+            results = await asyncio.gather(
+                *(self._search(type, interface, executor) for type, interface in searches),
+                return_exceptions=True
+            )
+            for (type, interface), result in zip(searches, results):
+                if isinstance(result, Exception):
+                    logger.error(f"discovery of {type.__name__} on {interface} failed", exc_info=result)
+                    continue
+                for cam_ip in result:
+                    self._app.add_camera(cam_ip, type)
+            await asyncio.sleep(self._backoff.next_interval(self._app.camera_count()))
+
+    async def _search(self, type, interface, executor):
+        start = time.monotonic()
+        try:
+            return await type.async_discover(executor, iface=interface)
+        finally:
+            metrics.discovery_seconds.observe(time.monotonic() - start, type.__name__, interface)
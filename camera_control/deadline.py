@@ -0,0 +1,90 @@
+"""
+Deadlines for camera calls.
+
+A deadline is set around a call with `deadline(seconds)` and applies to every request CameraSession sends within it:
+the request's connect and read timeouts are cut to the time that is left, so a camera that stops answering in the
+middle of a call (e.g. because it overheats or the hotspot roams) cannot block its worker for longer than the call's
+budget. The deadline is kept in a context variable, so it also applies to the parallel requests of hedged reads.
+
+Hedged requests run on an executor per camera, so that the requests a stalled camera leaves behind cannot hold up the
+reads of any other camera.
+"""
+
+import contextlib
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Optional
+
+_deadline = contextvars.ContextVar("camera_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Limits the camera requests within the block to end at most the given seconds from now. A nested deadline can only
+    shorten the one around it.
+    """
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(at if outer is None else min(at, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+    Seconds until the current deadline, or None if there is none
+    """
+    at = _deadline.get()
+    if at is None:
+        return None
+    return at - time.monotonic()
+
+
+def hedged(func, hedge_after, executor: Executor, attempts=2, on_attempt=None):
+    """
+    Calls the idempotent func on the executor within the current deadline. If it has neither returned after
+    hedge_after seconds nor failed, it is called another time in parallel, and an attempt that fails is retried right
+    away, up to the given number of attempts. Returns the first successful result. Raises the error of the last attempt
+    if all of them failed, or DeadlineExceeded. on_attempt() is called whenever another attempt is started.
+
+    Attempts that are still running once a result has arrived are left to end by themselves, which they do by the
+    deadline at the latest. Attempts still waiting for a thread of the executor are cancelled.
+    """
+    pending = set()
+    error = None
+    started = 0
+    next_attempt_at = 0
+    try:
+        while True:
+            left = remaining()
+            if left is not None and left <= 0:
+                raise DeadlineExceeded(f"no result within the deadline after {started} attempts") from error
+            if started < attempts and (not pending or time.monotonic() >= next_attempt_at):
+                if started and on_attempt is not None:
+                    on_attempt()
+                pending.add(executor.submit(contextvars.copy_context().run, func))
+                started += 1
+                next_attempt_at = time.monotonic() + hedge_after
+            if not pending:
+                raise error
+            timeout = max(next_attempt_at - time.monotonic(), 0) if started < attempts else None
+            if left is not None:
+                timeout = left if timeout is None else min(timeout, left)
+            done, _ = wait(pending, timeout, return_when=FIRST_COMPLETED)
+            pending -= done
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,141 @@
+import logging
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ssdpy.http_helper import parse_headers
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SSDP_ADDRESS = "239.255.255.250"
+SSDP_PORT = 1900
+# Linux socket options that the socket module does not export: receive multicast only from the groups joined on this
+# socket, and report the interface every packet arrived on
+IP_MULTICAST_ALL = 49
+IP_PKTINFO = 8
+# struct in_pktinfo: interface index, local address, destination address
+IN_PKTINFO = struct.Struct("i4s4s")
+
+
+def search(camera_types, interfaces, executor: ThreadPoolExecutor):
+    """
+    Runs an M-SEARCH for every camera type on every interface in parallel, so a full round takes as long as a single
+    search. Returns a list of (camera type, address) tuples.
+    """
+    futures = [
+        (type, interface, executor.submit(_timed_discover, type, interface))
+        for type in camera_types for interface in interfaces
+    ]
+    found = []
+    for type, interface, future in futures:
+        try:
+            found += [(type, address) for address in future.result()]
+        except Exception:
+            logger.error(f"discovery of {type.__name__} on {interface} failed", exc_info=True)
+    return found
+
+
+def _timed_discover(type, interface):
+    start = time.monotonic()
+    try:
+        return type.discover(iface=interface)
+    finally:
+        metrics.discovery_seconds.observe(time.monotonic() - start, type.__name__, interface)
+
+
+class DiscoveryBackoff:
+    """
+    Interval between active searches. Once the expected number of cameras has been found, the interval is doubled
+    after each search up to max_interval, as newly started cameras are then picked up by the passive listener anyway.
+    """
+
+    def __init__(self, interval=10, max_interval=120, expected_cameras=None):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.expected_cameras = expected_cameras
+        self._current = interval
+
+    def next_interval(self, known_cameras):
+        if self.expected_cameras is None or known_cameras < self.expected_cameras:
+            self._current = self.interval
+        else:
+            self._current = min(self._current * 2, self.max_interval)
+        return self._current
+
+
+class SSDPListener(threading.Thread):
+    """
+    Listens for SSDP NOTIFY ssdp:alive announcements and reports cameras as soon as they announce themselves
+    """
+
+    def __init__(self, drivers, interfaces, callback):
+        self._drivers = drivers
+        self._interfaces = interfaces
+        self._callback = callback
+        # indexes of the interfaces announcements are accepted from, None for all of them
+        self._interface_indexes = None
+        super().__init__(name="SSDPListener", daemon=True)
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", SSDP_PORT))
+        group = socket.inet_aton(SSDP_ADDRESS)
+        if self._interfaces:
+            # a socket bound to the SSDP port otherwise also receives the announcements on every other interface that
+            # any socket (e.g. the listener of another worker process) has joined the group on, so that cameras would
+            # be controlled by more than one process
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+                sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+                self._interface_indexes = {socket.if_nametoindex(interface) for interface in self._interfaces}
+            except OSError:
+                logger.warning("cannot restrict SSDP announcements to the interfaces %s", self._interfaces,
+                               exc_info=True)
+            for interface in self._interfaces:
+                # struct ip_mreqn: multicast group, local address, interface index
+                mreqn = struct.pack("4s4si", group, socket.inet_aton("0.0.0.0"), socket.if_nametoindex(interface))
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreqn)
+        else:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, struct.pack("4s4s", group, socket.inet_aton("0.0.0.0")))
+        return sock
+
+    def run(self):
+        try:
+            sock = self._open_socket()
+        except OSError:
+            logger.warning("cannot listen for SSDP announcements, relying on active search only", exc_info=True)
+            return
+
+        camera_types = self._drivers.load_all()
+        while True:
+            data, ancillary, _, _ = sock.recvmsg(2048, socket.CMSG_SPACE(IN_PKTINFO.size))
+            if not data.startswith(b"NOTIFY") or not self._accepts(ancillary):
+                continue
+            try:
+                headers = parse_headers(data)
+            except ValueError:
+                continue
+            if headers.get("nts") != "ssdp:alive":
+                continue
+            for type in camera_types:
+                address = type.address_from_ssdp(headers)
+                if address is not None:
+                    logger.debug("%s at %s announced itself", type.__name__, address)
+                    self._callback(address, type)
+
+    def _accepts(self, ancillary):
+        """
+        True if the packet with the given ancillary data arrived on one of the listener's interfaces
+        """
+        if self._interface_indexes is None:
+            return True
+        for level, type, data in ancillary:
+            if level == socket.IPPROTO_IP and type == IP_PKTINFO:
+                interface_index, _, _ = IN_PKTINFO.unpack_from(data)
+                return interface_index in self._interface_indexes
+        return False
@@ -0,0 +1,105 @@
+"""
+Registry of the camera drivers.
+
+Drivers are referenced as "module:class" and only imported when they are first needed, as importing them and the
+libraries they use takes a large part of the startup time on a Raspberry Pi Zero. Besides the built-in drivers,
+installed packages can provide drivers through the "video_time.drivers" entry point group, e.g. in pyproject.toml:
+
+    [project.entry-points."video_time.drivers"]
+    canon = "canon_driver:CanonCameraControl"
+"""
+
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "video_time.drivers"
+
+BUILTIN_DRIVERS = {
+    "lumix": "camera_control.lumix_control:LumixCameraControl",
+    "sony": "camera_control.sony_control:SonyCameraControl",
+}
+
+
+def _entry_point_drivers():
+    # only scanned for names that are not built in, as reading the metadata of all installed packages is slow
+    from importlib.metadata import entry_points
+    return {entry_point.name: entry_point.value for entry_point in entry_points(group=ENTRY_POINT_GROUP)}
+
+
+class DriverRegistry:
+    """
+    The enabled camera drivers by name. A name is a built-in driver, an entry point in the "video_time.drivers" group
+    or a "module:class" reference.
+    """
+
+    def __init__(self, names=None):
+        if names is None:
+            names = list(BUILTIN_DRIVERS)
+        references = dict(BUILTIN_DRIVERS)
+        if any(name not in references and ":" not in name for name in names):
+            references.update(_entry_point_drivers())
+        self._references = {}
+        for name in names:
+            if name in references:
+                self._references[name] = references[name]
+            elif ":" in name:
+                self._references[name] = name
+            else:
+                raise ValueError(f"unknown camera driver {name}, expected one of {sorted(references)} or module:class")
+        self._types = {}
+        self.load_seconds = {}
+        self._lock = threading.Lock()
+
+    @property
+    def names(self):
+        return list(self._references)
+
+    def load(self, name):
+        """
+        Imports the driver on first use and returns its CameraControl class
+        """
+        with self._lock:
+            type = self._types.get(name)
+            if type is None:
+                module_name, _, class_name = self._references[name].partition(":")
+                start = time.monotonic()
+                type = getattr(importlib.import_module(module_name), class_name)
+                self.load_seconds[name] = time.monotonic() - start
+                logger.info(f"loaded camera driver {name} in {self.load_seconds[name]:.3f} s")
+                self._types[name] = type
+            return type
+
+    def load_all(self):
+        """
+        Imports all enabled drivers and returns their classes. A driver that cannot be imported is logged and skipped,
+        so that the other cameras still work.
+        """
+        types = []
+        for name in self._references:
+            try:
+                types.append(self.load(name))
+            except Exception:
+                logger.error(f"cannot load camera driver {name}", exc_info=True)
+        return types
+
+    def loaded(self):
+        """
+        The classes of the drivers that have been imported so far
+        """
+        with self._lock:
+            return list(self._types.values())
+
+    def name_of(self, type):
+        """
+        The registry name of a loaded driver class, or None
+        """
+        with self._lock:
+            return next((name for name, loaded in self._types.items() if loaded is type), None)
+
+    def stats(self):
+        with self._lock:
+            return {name: self.load_seconds.get(name) for name in self._references}
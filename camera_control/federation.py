@@ -0,0 +1,257 @@
+"""
+Federation of several web UI instances, e.g. one Raspberry Pi per Sony camera hotspot, controlled from one primary.
+
+The primary polls the /get_state of its peers to show their cameras next to its own, and forwards record commands to
+them. Record commands are scheduled for a common start time, converted into each peer's clock with an estimate of its
+clock offset, so that all cameras start together even without a shared time source. Peers are given to the primary
+with --peers, or register themselves at the primary with --primary.
+"""
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .http import CameraSession
+
+logger = logging.getLogger(__name__)
+
+PEER_POLL_INTERVAL = 1
+# (connect, read) timeouts for requests to peers, which are on the local network
+PEER_TIMEOUT = (1, 2)
+# clock offset samples kept per peer, the one with the shortest round trip is used
+CLOCK_SAMPLES = 8
+CLOCK_SYNC_INTERVAL = 10
+# added to the longest round trip to a peer to get the time until a forwarded record command is executed
+RECORD_LEAD_MARGIN = 0.05
+# peers re-register every PEER_REGISTRATION_INTERVAL seconds, and are forgotten once they have stopped doing so
+PEER_REGISTRATION_INTERVAL = 10
+PEER_REGISTRATION_EXPIRY = 60
+# fields of a peer's cameras that are shown in the web UI of the primary
+PEER_CAMERA_FIELDS = ("connected", "rec", "remaining")
+
+
+class ClockOffset:
+    """
+    Offset of a peer's clock to the local one, estimated like NTP from the time the peer reports in the middle of a
+    request. The estimate is taken from the recent sample with the shortest round trip, as its error is bounded by
+    half of the round trip.
+    """
+
+    def __init__(self, samples=CLOCK_SAMPLES):
+        self._samples = collections.deque(maxlen=samples)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, sent, peer_time, received):
+        self._samples.append((received - sent, peer_time - (sent + received) / 2))
+
+    def _best(self):
+        return min(self._samples, default=(None, None))
+
+    @property
+    def round_trip(self):
+        return self._best()[0]
+
+    @property
+    def offset(self):
+        return self._best()[1]
+
+
+class Peer:
+    """
+    Another web UI instance, as seen by the primary
+    """
+
+    def __init__(self, url, clock, registered=False):
+        self.url = url.rstrip("/")
+        self.label = urlparse(self.url).netloc
+        self.clock = ClockOffset()
+        self._local_clock = clock
+        self._session = CameraSession(timeout=PEER_TIMEOUT)
+        self.state = None
+        self._etag = None
+        self.reachable = False
+        self.error = None
+        self.last_synced = 0
+        self.registered_at = time.monotonic() if registered else None
+        self.late = None
+
+    def poll(self):
+        """
+        Updates the clock offset if needed and fetches the peer's state
+        """
+        try:
+            if len(self.clock) < CLOCK_SAMPLES // 2 or time.monotonic() - self.last_synced > CLOCK_SYNC_INTERVAL:
+                self.sync_clock()
+            # the peer answers 304 without a body if its state has not changed
+            response = self._session.get(self.url + "/get_state",
+                                         headers={"If-None-Match": self._etag} if self._etag else None)
+            response.raise_for_status()
+            if response.status_code != 304:
+                self.state = response.json()
+                self._etag = response.headers.get("ETag")
+            if not self.reachable:
+                logger.info(f"peer {self.label} is reachable")
+            self.reachable = True
+            self.error = None
+        except (IOError, ValueError) as e:
+            if self.reachable:
+                logger.warning(f"peer {self.label} is not reachable: {e}")
+            self.reachable = False
+            self.error = str(e)
+
+    def sync_clock(self):
+        sent = self._local_clock()
+        response = self._session.get(self.url + "/clock")
+        received = self._local_clock()
+        response.raise_for_status()
+        self.clock.add(sent, response.json()["time"], received)
+        self.last_synced = time.monotonic()
+
+    def send_record(self, should_record, at=None):
+        """
+        Sends the record command, to be executed at the given time in the peer's clock or right away
+        """
+        try:
+            response = self._session.post(self.url + "/record", data="true" if should_record else "false",
+                                          params={"at": repr(at)} if at is not None else None)
+            response.raise_for_status()
+            self.late = response.json().get("late") if at is not None else None
+            if self.late:
+                logger.warning(f"record command reached peer {self.label} {self.late:.3f} s late")
+        except (IOError, ValueError) as e:
+            logger.warning(f"sending record command to peer {self.label} failed: {e}")
+
+    def cameras(self):
+        """
+        The peer's cameras as in its /get_state, keyed by the names shown on the primary
+        """
+        if self.state is None:
+            return {}
+        cameras = {}
+        for key, fields in self.state.get("cameras", {}).items():
+            if not self.reachable:
+                fields = {"connected": False, "rec": None, "remaining": None}
+            # the live view is only available from the peer itself
+            cameras[f"{key} @ {self.label}"] = {**fields, "liveview": False, "peer": self.label}
+        return cameras
+
+    def stats(self):
+        return {
+            "reachable": self.reachable,
+            "error": self.error,
+            "clock_offset": self.clock.offset,
+            "round_trip": self.clock.round_trip,
+            "registered": self.registered_at is not None,
+            "late": self.late,
+            "cameras": len(self.state.get("cameras", {})) if self.state is not None else 0,
+        }
+
+
+class Federation(threading.Thread):
+    """
+    Polls the peers and publishes their cameras to the state hub. On a peer, registers it at the primary.
+    """
+
+    def __init__(self, hub, peers=(), primary=None, port=None, clock=time.time):
+        super().__init__(name="Federation", daemon=True)
+        self._hub = hub
+        self._clock = clock
+        self._primary = primary.rstrip("/") if primary else None
+        self._port = port
+        self._peers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="federation")
+        self._last_registration = 0
+        self._primary_session = CameraSession(timeout=PEER_TIMEOUT) if self._primary else None
+        self.last_record = None
+        for url in peers:
+            self.add_peer(url)
+
+    def add_peer(self, url, registered=False):
+        url = url.rstrip("/")
+        with self._lock:
+            peer = self._peers.get(url)
+            if peer is None:
+                logger.info(f"adding peer {url}")
+                peer = self._peers[url] = Peer(url, self._clock, registered)
+            elif registered and peer.registered_at is not None:
+                peer.registered_at = time.monotonic()
+        return peer
+
+    def peers(self):
+        with self._lock:
+            return list(self._peers.values())
+
+    def cameras(self):
+        cameras = {}
+        for peer in self.peers():
+            cameras.update(peer.cameras())
+        return cameras
+
+    def stats(self):
+        return {peer.label: peer.stats() for peer in self.peers()}
+
+    def broadcast_record(self, should_record):
+        """
+        Forwards a record command to all peers, to be executed at the same time everywhere. Returns the time in the
+        local clock at which it should be executed here, or None if there are no peers.
+        """
+        peers = self.peers()
+        if not peers:
+            return None
+        round_trips = [peer.clock.round_trip for peer in peers if peer.reachable and peer.clock.round_trip is not None]
+        lead = max(round_trips, default=0) + RECORD_LEAD_MARGIN
+        at = self._clock() + lead
+        for peer in peers:
+            # peers without a clock estimate execute the command as soon as it arrives
+            peer_at = at + peer.clock.offset if peer.reachable and peer.clock.offset is not None else None
+            self._executor.submit(peer.send_record, should_record, peer_at)
+        self.last_record = {"should_record": should_record, "at": at, "lead": lead}
+        return at
+
+    def run(self):
+        while True:
+            start = time.monotonic()
+            peers = self.peers()
+            list(self._executor.map(Peer.poll, peers))
+            for peer in peers:
+                self._publish(peer)
+            self._expire_registrations()
+            if self._primary is not None and time.monotonic() - self._last_registration > PEER_REGISTRATION_INTERVAL:
+                self._register()
+            time.sleep(max(PEER_POLL_INTERVAL - (time.monotonic() - start), 0))
+
+    def _publish(self, peer):
+        keys = set()
+        for key, fields in peer.cameras().items():
+            keys.add(key)
+            self._hub.update_camera((peer.url, key), key,
+                                    {**{name: fields.get(name) for name in PEER_CAMERA_FIELDS}, "liveview": False})
+        for address in self._hub.addresses():
+            if isinstance(address, tuple) and address[0] == peer.url and address[1] not in keys:
+                self._hub.remove_camera(address)
+
+    def _expire_registrations(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [peer for peer in self._peers.values()
+                       if peer.registered_at is not None and now - peer.registered_at > PEER_REGISTRATION_EXPIRY]
+            for peer in expired:
+                logger.info(f"forgetting peer {peer.label}, which has stopped registering")
+                del self._peers[peer.url]
+        for peer in expired:
+            for address in self._hub.addresses():
+                if isinstance(address, tuple) and address[0] == peer.url:
+                    self._hub.remove_camera(address)
+
+    def _register(self):
+        self._last_registration = time.monotonic()
+        try:
+            self._primary_session.post(self._primary + "/peers", json={"port": self._port}).raise_for_status()
+        except IOError as e:
+            logger.warning(f"cannot register at primary {self._primary}: {e}")
@@ -0,0 +1,236 @@
+"""
+Closed-loop focus control for Lumix cameras.
+
+The camera moves the focus by one step per camctrl request and answers with the new focus position. "tele" steps
+decrease the position and "wide" steps increase it, "fast" steps are several times larger than "normal" ones. The
+step sizes differ between lenses, so they are learned from the positions reported by the camera.
+"""
+
+import collections
+import dataclasses
+import logging
+import math
+import socket
+import time
+from typing import Optional
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+DIRECTION_SIGNS = {"tele": -1, "wide": 1}
+# step sizes assumed before the first steps of a lens have been observed
+DEFAULT_STEP_SIZES = {"normal": 13, "fast": 70}
+# position changes larger than this many fast steps are not caused by a single step, e.g. after manual focusing
+MAX_PLAUSIBLE_STEPS = 3
+
+
+def parse_focus_position(text):
+    """
+    Focus position from a camctrl response such as "ok,512,1023"
+    """
+    parts = text.strip().split(",")
+    if parts[0] != "ok" or len(parts) < 2:
+        raise IOError(f"focus control failed: {text}")
+    return int(parts[1])
+
+
+class FocusStepModel:
+    """
+    Step sizes of a lens per speed, as moving averages of the observed position changes
+    """
+
+    def __init__(self, step_sizes=None, smoothing=0.3):
+        self._step_sizes = dict(step_sizes or DEFAULT_STEP_SIZES)
+        self._smoothing = smoothing
+        self.observations = collections.Counter()
+
+    def step(self, speed):
+        return self._step_sizes[speed]
+
+    def observe(self, speed, distance):
+        if distance <= 0 or distance > MAX_PLAUSIBLE_STEPS * max(self._step_sizes.values()):
+            return
+        if self.observations[speed] == 0:
+            self._step_sizes[speed] = distance
+        else:
+            self._step_sizes[speed] += self._smoothing * (distance - self._step_sizes[speed])
+        self.observations[speed] += 1
+
+    def plan(self, distance, speeds=("fast", "normal"), max_steps=None):
+        """
+        Numbers of (fast, normal) steps to cover the distance. With max_steps, as few fast steps as possible are used
+        to cover the distance within that many steps, as normal steps give a smoother rack.
+        """
+        normal = self.step("normal")
+        normal_steps = round(distance / normal)
+        if "fast" not in speeds:
+            return 0, normal_steps
+        fast = self.step("fast")
+        if fast <= normal:
+            return 0, normal_steps
+        if max_steps is not None:
+            if normal_steps <= max_steps:
+                return 0, normal_steps
+            fast_steps = min(math.ceil((distance - max_steps * normal) / (fast - normal)), round(distance / fast))
+        else:
+            fast_steps = int(distance // fast)
+        return fast_steps, max(round((distance - fast_steps * fast) / normal), 0)
+
+
+@dataclasses.dataclass
+class FocusResult:
+    position: int
+    target: int
+    steps: int
+    elapsed: float
+
+
+class SessionFocusTransport:
+    """
+    Sends focus steps one at a time through the camera's HTTP session, which keeps the connection open
+    """
+
+    def __init__(self, control):
+        self._control = control
+        self._pending = collections.deque()
+
+    def send(self, direction, speed):
+        self._pending.append((direction, speed))
+
+    def receive(self):
+        direction, speed = self._pending.popleft()
+        return parse_focus_position(self._control.focus_control(direction, speed).text)
+
+    def close(self):
+        self._pending.clear()
+
+
+class PipelinedFocusTransport:
+    """
+    Sends focus steps over a dedicated HTTP/1.1 connection without waiting for the previous responses, so that the
+    network round trips of consecutive steps overlap. Responses arrive in the order of the requests.
+    """
+
+    def __init__(self, host, port=80, timeout=3.05):
+        self._host = host
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile("rb")
+
+    def send(self, direction, speed):
+        query = urlencode({"mode": "camctrl", "type": "focus", "value": f"{direction}-{speed}"})
+        self._sock.sendall(f"GET /cam.cgi?{query} HTTP/1.1\r\nHost: {self._host}\r\n\r\n".encode())
+
+    def receive(self):
+        status = self._file.readline().split(None, 2)
+        if len(status) < 2 or status[1] != b"200":
+            raise IOError(f"focus control failed: {status}")
+        length = None
+        while True:
+            line = self._file.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+        if length is None:
+            raise IOError("focus control response without Content-Length cannot be pipelined")
+        return parse_focus_position(self._file.read(length).decode())
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class FocusEngine:
+    """
+    Moves the focus to target positions, choosing fast and normal steps from the learned step sizes and correcting
+    the plan with every reported position. Up to pipeline_depth steps are in flight at the same time.
+    """
+
+    def __init__(self, transport, model: Optional[FocusStepModel] = None, pipeline_depth=1):
+        self._transport = transport
+        self.model = model or FocusStepModel()
+        self._pipeline_depth = pipeline_depth
+        self.position = None
+        # moving average of the seconds per step, to plan timed racks
+        self._step_time = None
+        # direction in which the lens has reached its end
+        self._blocked = None
+        self._last_receive = 0
+
+    def close(self):
+        self._transport.close()
+
+    def move_to(self, target, speeds=("fast", "normal"), duration=None) -> FocusResult:
+        """
+        Moves the focus to the target position. With a duration, the steps are spread so that the target is reached
+        after that many seconds, using fast steps only as far as needed to make it in time.
+        """
+        start = time.monotonic()
+        # the lens may have been focused by hand since the last move, so neither its position nor whether it is at
+        # an end can be trusted. The position is only known from a response, so take a first small step.
+        self.position = None
+        self._blocked = None
+        probe = collections.deque()
+        self._send("tele", "normal", probe)
+        self._receive(probe)
+        steps = 1
+        deadline = start + duration if duration is not None else None
+        in_flight = collections.deque()
+        next_send = start
+        while True:
+            now = time.monotonic()
+            predicted = self.position + sum(expected for _, _, expected, _ in in_flight)
+            step, remaining_steps = self._next_step(target - predicted, speeds, deadline, now)
+            if step is not None and len(in_flight) < self._pipeline_depth and now >= next_send:
+                direction, speed = step
+                self._send(direction, speed, in_flight)
+                steps += 1
+                if deadline is not None:
+                    # spread the remaining steps so that the last one completes at the deadline
+                    next_send = now + max(deadline - now - self._step_time, 0) / max(remaining_steps - 1, 1)
+            elif in_flight:
+                self._receive(in_flight)
+            elif step is not None:
+                time.sleep(next_send - now)
+            else:
+                break
+        return FocusResult(self.position, target, steps, time.monotonic() - start)
+
+    def _next_step(self, distance, speeds, deadline, now):
+        """
+        The next (direction, speed) step towards the target and the number of steps planned, or None if the target
+        has been reached or cannot be reached
+        """
+        direction = "wide" if distance > 0 else "tele"
+        if abs(distance) < self.model.step("normal") / 2 or direction == self._blocked:
+            return None, 0
+        max_steps = None
+        if deadline is not None and self._step_time is not None:
+            max_steps = max(int((deadline - now) / self._step_time), 1)
+        fast_steps, normal_steps = self.model.plan(abs(distance), speeds, max_steps)
+        if fast_steps + normal_steps == 0:
+            return None, 0
+        return (direction, "fast" if fast_steps > 0 else "normal"), fast_steps + normal_steps
+
+    def _send(self, direction, speed, in_flight):
+        self._transport.send(direction, speed)
+        expected = DIRECTION_SIGNS[direction] * self.model.step(speed)
+        in_flight.append((direction, speed, expected, time.monotonic()))
+
+    def _receive(self, in_flight):
+        direction, speed, _, sent_at = in_flight.popleft()
+        position = self._transport.receive()
+        now = time.monotonic()
+        # with several steps in flight, a step only takes the time since the previous response
+        step_time = now - max(sent_at, self._last_receive)
+        self._last_receive = now
+        self._step_time = step_time if self._step_time is None else self._step_time + 0.3 * (step_time - self._step_time)
+        if self.position is not None:
+            delta = position - self.position
+            if delta == 0:
+                self._blocked = direction
+            elif (delta > 0) == (DIRECTION_SIGNS[direction] > 0):
+                self._blocked = None
+                self.model.observe(speed, abs(delta))
+        self.position = position
@@ -0,0 +1,181 @@
+"""
+Compact per-camera history of the recording state, to review afterwards where footage was lost.
+"""
+
+import array
+import collections
+import json
+import math
+import os
+import struct
+import threading
+import time
+
+# samples kept in memory per camera, 3 hours at one sample per second
+HISTORY_CAPACITY = 3 * 3600
+HISTORY_EVENTS = 1000
+# a sample is valid for at most this many seconds, so that gaps in the history (e.g. while the web UI was not
+# running) are not bridged
+MAX_HOLD = 30
+# an unchanged state is only sampled again after this many seconds
+HEARTBEAT_INTERVAL = 10
+# samples are written to the spill file in batches to spare the SD card
+SPILL_BATCH = 300
+MAX_SPILL_BYTES = 16 * 1024 * 1024
+
+# timestamp, recording (-1 unknown, 0, 1), remaining seconds (NaN unknown), connected
+SAMPLE = struct.Struct("<dbfb")
+
+
+class StateHistory:
+    """
+    Ring buffer of (timestamp, recording, remaining, connected) samples in fixed-size arrays, plus the latest
+    events such as restarts. With a spill path, samples are also appended to a binary file and events to a JSON lines
+    file, so that the history outlives the ring buffer and the process.
+    """
+
+    def __init__(self, capacity=HISTORY_CAPACITY, spill_path=None, max_spill_bytes=MAX_SPILL_BYTES):
+        self.capacity = capacity
+        self._timestamps = array.array("d", [0.0]) * capacity
+        self._recording = array.array("b", [0]) * capacity
+        self._remaining = array.array("f", [0.0]) * capacity
+        self._connected = array.array("b", [0]) * capacity
+        self._start = 0
+        self._count = 0
+        self.events = collections.deque(maxlen=HISTORY_EVENTS)
+        self._lock = threading.Lock()
+        self._spill_path = spill_path
+        self._max_spill_bytes = max_spill_bytes
+        self._unspilled = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, recording, remaining, connected):
+        """
+        Adds a sample, unless the state is unchanged and the last sample is younger than HEARTBEAT_INTERVAL
+        """
+        recording = -1 if recording is None else int(recording)
+        remaining = math.nan if remaining is None else remaining
+        with self._lock:
+            if self._count:
+                last = (self._start + self._count - 1) % self.capacity
+                if (self._recording[last] == recording and self._connected[last] == connected
+                        and not (recording == 1 and remaining != self._remaining[last])
+                        and timestamp - self._timestamps[last] < HEARTBEAT_INTERVAL):
+                    return
+            if self._count < self.capacity:
+                index = (self._start + self._count) % self.capacity
+                self._count += 1
+            else:
+                index = self._start
+                self._start = (self._start + 1) % self.capacity
+            self._timestamps[index] = timestamp
+            self._recording[index] = recording
+            self._remaining[index] = remaining
+            self._connected[index] = connected
+            if self._spill_path is not None:
+                self._unspilled += 1
+                # spill before unspilled samples are overwritten by the ring buffer
+                if self._unspilled >= min(SPILL_BATCH, self.capacity):
+                    self._spill()
+
+    def add_event(self, timestamp, kind, **details):
+        event = {"time": timestamp, "event": kind, **details}
+        with self._lock:
+            self.events.append(event)
+        if self._spill_path is not None:
+            with open(self._spill_path + ".events", "a") as f:
+                f.write(json.dumps(event) + "\n")
+
+    def flush(self):
+        with self._lock:
+            if self._spill_path is not None and self._unspilled:
+                self._spill()
+
+    def _spill(self):
+        first = self._count - self._unspilled
+        data = b"".join(SAMPLE.pack(*self._sample(i)) for i in range(first, self._count))
+        if os.path.exists(self._spill_path) and os.path.getsize(self._spill_path) + len(data) > self._max_spill_bytes:
+            # keep one older file, so that the history on disk is at least max_spill_bytes long
+            os.replace(self._spill_path, self._spill_path + ".1")
+        with open(self._spill_path, "ab") as f:
+            f.write(data)
+        self._unspilled = 0
+
+    def _sample(self, i):
+        index = (self._start + i) % self.capacity
+        return self._timestamps[index], self._recording[index], self._remaining[index], self._connected[index]
+
+    def _first_at_or_after(self, timestamp):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[(self._start + middle) % self.capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def samples(self, start, end):
+        """
+        Samples between start and end, including the one before start that is still valid at start. Samples that are
+        no longer in memory are read from the spill files.
+        """
+        with self._lock:
+            first = max(self._first_at_or_after(start) - 1, 0)
+            last = self._first_at_or_after(end)
+            samples = [self._sample(i) for i in range(first, last)]
+            oldest = self._timestamps[self._start] if self._count else math.inf
+        if self._spill_path is not None and start < oldest:
+            samples = [sample for sample in self._read_spill(start - MAX_HOLD, min(end, oldest)) if sample[0] < oldest] + samples
+        return samples
+
+    def _read_spill(self, start, end):
+        samples = []
+        for path in (self._spill_path + ".1", self._spill_path):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            data = data[:len(data) - len(data) % SAMPLE.size]
+            samples += [sample for sample in SAMPLE.iter_unpack(data) if start <= sample[0] < end]
+        return samples
+
+    def timeline(self, start, end, buckets):
+        """
+        Downsampled history: for each of the buckets between start and end, the fraction of the time the camera was
+        recording and connected, and the lowest remaining recording time. Values are None where nothing is known.
+        """
+        step = (end - start) / buckets
+        recording = [0.0] * buckets
+        connected = [0.0] * buckets
+        known = [0.0] * buckets
+        remaining = [None] * buckets
+        samples = self.samples(start, end)
+        for i, (timestamp, sample_recording, sample_remaining, sample_connected) in enumerate(samples):
+            valid_until = min(samples[i + 1][0] if i + 1 < len(samples) else time.time(), timestamp + MAX_HOLD, end)
+            valid_from = max(timestamp, start)
+            if valid_until <= valid_from:
+                continue
+            for bucket in range(int((valid_from - start) // step), min(int(math.ceil((valid_until - start) / step)), buckets)):
+                bucket_start = start + bucket * step
+                overlap = min(valid_until, bucket_start + step) - max(valid_from, bucket_start)
+                if overlap <= 0:
+                    continue
+                known[bucket] += overlap
+                if sample_recording == 1:
+                    recording[bucket] += overlap
+                if sample_connected:
+                    connected[bucket] += overlap
+                if not math.isnan(sample_remaining) and (remaining[bucket] is None or sample_remaining < remaining[bucket]):
+                    remaining[bucket] = sample_remaining
+        with self._lock:
+            events = [event for event in self.events if start <= event["time"] < end]
+        return {
+            "recording": [round(r / step, 3) if k else None for r, k in zip(recording, known)],
+            "connected": [round(c / step, 3) if k else None for c, k in zip(connected, known)],
+            "remaining": remaining,
+            "events": events,
+        }
@@ -0,0 +1,62 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import deadline
+
+# (connect, read) timeouts in seconds. Camera Wi-Fi stacks are slow to accept connections, but once connected
+# they answer quickly, so the read timeout can stay short.
+DEFAULT_TIMEOUT = (3.05, 10)
+
+
+class CameraSession(requests.Session):
+    """
+    HTTP session with a small keep-alive connection pool and default timeouts, shared by all calls to one camera.
+    Within a deadline (see camera_control.deadline), the timeouts are cut to the time that is left.
+
+    The session outlives reconnects of the camera controller, so pooled connections are reused whenever the camera
+    keeps them open.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, pool_maxsize=2):
+        super().__init__()
+        self.timeout = timeout
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=0)
+        self.mount("http://", self._adapter)
+        self.mount("https://", self._adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        left = deadline.remaining()
+        if left is None:
+            return super().request(method, url, **kwargs)
+        if left <= 0:
+            raise deadline.DeadlineExceeded(f"deadline exceeded before {method} {url}")
+        timeout = kwargs["timeout"]
+        kwargs["timeout"] = tuple(min(t, left) for t in timeout) if isinstance(timeout, tuple) else min(timeout, left)
+        try:
+            return super().request(method, url, **kwargs)
+        except requests.Timeout as e:
+            if deadline.remaining() <= 0:
+                raise deadline.DeadlineExceeded(f"deadline exceeded during {method} {url}") from e
+            raise
+
+    def stats(self):
+        """
+        Number of requests sent and TCP connections opened by this session, summed over all pooled hosts
+        """
+        requests_sent = 0
+        connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": max(requests_sent - connections, 0),
+        }
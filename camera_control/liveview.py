@@ -0,0 +1,269 @@
+import http.client
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# frames per second passed on to clients, further frames are dropped before they are copied
+LIVEVIEW_MAX_FPS = 10
+# seconds without any client after which the live view is stopped
+LIVEVIEW_IDLE_TIMEOUT = 10
+# maximum number of clients watching the live view of one camera at the same time
+LIVEVIEW_MAX_CLIENTS = 4
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+# Sony live view packets: common header (start byte 0xFF, payload type, sequence number, time stamp), followed by
+# a 128 byte payload header (start code, 3 byte payload size, padding size, ...), followed by the payload and padding
+SONY_COMMON_HEADER = struct.Struct(">BBHI")
+SONY_PAYLOAD_HEADER = struct.Struct(">4sI")
+SONY_HEADER_SIZE = SONY_COMMON_HEADER.size + 128
+SONY_START_BYTE = 0xFF
+SONY_START_CODE = b"\x24\x35\x68\x79"
+SONY_PAYLOAD_IMAGE = 0x01
+
+
+class FrameSlot:
+    """
+    Holds only the latest frame. Clients that are slower than the camera skip the frames they missed, so memory does
+    not grow with the number or speed of the clients.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self.sequence = 0
+        self.closed = False
+
+    def publish(self, frame: bytes):
+        with self._cond:
+            self._frame = frame
+            self.sequence += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait(self, sequence, timeout) -> Optional[tuple]:
+        """
+        Waits for a frame newer than the given sequence number and returns (sequence, frame), or None on timeout or
+        if the slot has been closed
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.sequence != sequence or self.closed, timeout) or self.closed:
+                return None
+            return self.sequence, self._frame
+
+
+class LiveView(threading.Thread):
+    """
+    Receives a camera's live view in a background thread while clients are watching it, and stops once no client has
+    watched it for LIVEVIEW_IDLE_TIMEOUT seconds. Subclasses implement _stream for the camera's transport.
+    """
+
+    def __init__(self, name, max_fps=LIVEVIEW_MAX_FPS):
+        super().__init__(name=f"LiveView {name}", daemon=True)
+        self.slot = FrameSlot()
+        self._min_interval = 1 / max_fps
+        self._last_published = 0
+        self._last_watched = time.monotonic()
+        self._clients = 0
+        self._lock = threading.Lock()
+        self.frames_received = 0
+        self.frames_dropped = 0
+
+    @property
+    def stopped(self):
+        return self.slot.closed
+
+    def frames(self):
+        """
+        Generator of the frames for one client, or None if too many clients are watching already
+        """
+        with self._lock:
+            if self._clients >= LIVEVIEW_MAX_CLIENTS:
+                return None
+            self._clients += 1
+        return self._client_frames()
+
+    def _client_frames(self):
+        try:
+            sequence = 0
+            while not self.stopped:
+                self._last_watched = time.monotonic()
+                frame = self.slot.wait(sequence, 1)
+                if frame is not None:
+                    sequence, data = frame
+                    yield data
+        finally:
+            with self._lock:
+                self._clients -= 1
+            self._last_watched = time.monotonic()
+
+    def _idle(self):
+        return self._clients == 0 and time.monotonic() - self._last_watched > LIVEVIEW_IDLE_TIMEOUT
+
+    def _publish(self, frame: memoryview):
+        """
+        Passes a frame on to the clients. The frame is only copied out of the receive buffer if it is not dropped by
+        the frame rate limit.
+        """
+        self.frames_received += 1
+        now = time.monotonic()
+        if now - self._last_published < self._min_interval:
+            self.frames_dropped += 1
+            return
+        self._last_published = now
+        self.slot.publish(bytes(frame))
+
+    def _stream(self):
+        raise NotImplementedError()
+
+    def run(self):
+        try:
+            self._stream()
+        except Exception:
+            logger.warning(f"{self.name} failed", exc_info=True)
+        finally:
+            self.slot.close()
+            logger.info(f"{self.name} stopped")
+
+
+def extract_jpeg(buffer: bytearray, length, search_limit=512) -> Optional[memoryview]:
+    """
+    Finds the JPEG image in the first length bytes of the buffer, skipping any header in front of it. Returns a view of
+    the image within the buffer, or None if there is no image.
+    """
+    start = buffer.find(JPEG_SOI, 0, min(length, search_limit))
+    if start < 0:
+        return None
+    end = buffer.rfind(JPEG_EOI, start, length)
+    if end < 0:
+        return None
+    return memoryview(buffer)[start:end + len(JPEG_EOI)]
+
+
+class LumixLiveView(LiveView):
+    """
+    Live view of a Lumix camera, which sends every frame as a single UDP datagram to the port given in startstream
+    """
+
+    # largest possible UDP datagram
+    MAX_DATAGRAM = 65536
+    # the camera stops streaming unless startstream is repeated regularly
+    KEEPALIVE_INTERVAL = 5
+
+    def __init__(self, control, max_fps=LIVEVIEW_MAX_FPS):
+        super().__init__(control.cam_ip, max_fps)
+        self._control = control
+
+    def _stream(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(("", 0))
+            sock.settimeout(1)
+            port = sock.getsockname()[1]
+            # the buffer is reused for every datagram, frames are only copied when they are passed on to clients
+            buffer = bytearray(self.MAX_DATAGRAM)
+            last_keepalive = 0
+            while not self._idle():
+                if time.monotonic() - last_keepalive > self.KEEPALIVE_INTERVAL:
+                    self._control.start_stream(port)
+                    last_keepalive = time.monotonic()
+                try:
+                    length = sock.recv_into(buffer)
+                except socket.timeout:
+                    continue
+                frame = extract_jpeg(buffer, length)
+                if frame is not None:
+                    self._publish(frame)
+                    frame.release()
+        finally:
+            sock.close()
+            try:
+                self._control.stop_stream()
+            except Exception:
+                pass
+
+
+class SonyLiveviewParser:
+    """
+    Splits a Sony live view stream into JPEG frames. Every packet is read with two readinto calls, one for the headers
+    and one for the whole payload, directly into a reused buffer, so the JPEG data is never copied by the parser.
+    """
+
+    def __init__(self, readinto, buffer_size=256 * 1024, max_payload_size=4 * 1024 * 1024):
+        self._readinto = readinto
+        self._buffer = bytearray(buffer_size)
+        self._max_payload_size = max_payload_size
+
+    def _read_exactly(self, start, end):
+        with memoryview(self._buffer) as view:
+            while start < end:
+                length = self._readinto(view[start:end])
+                if not length:
+                    return False
+                start += length
+        return True
+
+    def frames(self):
+        """
+        Generator of the JPEG frames as views into the parser's buffer. A view is only valid until the next frame is
+        requested, so it must be copied to keep the frame.
+        """
+        while self._read_exactly(0, SONY_HEADER_SIZE):
+            start_byte, payload_type, sequence, timestamp = SONY_COMMON_HEADER.unpack_from(self._buffer)
+            start_code, size_and_padding = SONY_PAYLOAD_HEADER.unpack_from(self._buffer, SONY_COMMON_HEADER.size)
+            if start_byte != SONY_START_BYTE or start_code != SONY_START_CODE:
+                raise ValueError(f"invalid live view packet header: {bytes(self._buffer[:16]).hex()}")
+            size = size_and_padding >> 8
+            end = SONY_HEADER_SIZE + size + (size_and_padding & 0xFF)
+            if size > self._max_payload_size:
+                raise ValueError(f"live view payload of {size} bytes is too large")
+            if end > len(self._buffer):
+                self._buffer = bytearray(end)
+            if not self._read_exactly(SONY_HEADER_SIZE, end):
+                return
+            if payload_type == SONY_PAYLOAD_IMAGE:
+                with memoryview(self._buffer) as view, view[SONY_HEADER_SIZE:SONY_HEADER_SIZE + size] as frame:
+                    yield frame
+
+
+class SonyLiveView(LiveView):
+    """
+    Live view of a Sony camera, streamed over HTTP from the URL returned by startLiveview
+    """
+
+    READ_TIMEOUT = 5
+
+    def __init__(self, control, max_fps=LIVEVIEW_MAX_FPS):
+        super().__init__(control.name or control.cam_url, max_fps)
+        self._control = control
+
+    def _stream(self):
+        url = urlparse(self._control.start_liveview())
+        # http.client instead of requests, as its readinto fills the parser's buffer without an intermediate copy
+        connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.READ_TIMEOUT)
+        try:
+            connection.request("GET", url.path + ("?" + url.query if url.query else ""))
+            response = connection.getresponse()
+            if response.status != 200:
+                raise IOError(f"live view stream returned HTTP {response.status}")
+            for frame in SonyLiveviewParser(response.readinto).frames():
+                self._publish(frame)
+                if self._idle():
+                    break
+        finally:
+            connection.close()
+            try:
+                self._control.stop_liveview()
+            except Exception:
+                pass
@@ -1,15 +1,120 @@
 from urllib.parse import urlparse
 
-import requests as r
 from ssdpy import SSDPClient
 
 from . import CameraControl, CameraState
+from .focus import FocusEngine, FocusStepModel, PipelinedFocusTransport, SessionFocusTransport
+from .http import CameraSession
+from .liveview import LumixLiveView
 import xml.etree.ElementTree as ET
 import datetime as dt
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 256 between full stops. The rest are third stops.
+# See http://c710720.r20.cf2.rackcdn.com/wp-content/uploads/2011/08/ISO-Shutter-Speeds-Fstops-Copyright-2009-2011-photographyuncapped.gif
+FSTOPS = {
+    "1": "0/256",
+    "1.1": "85/256",
+    "1.2": "171/256",
+    "1.4": "256/256",
+    "1.6": "341/256",
+    "1.8": "427/256",
+    "2": "512/256",
+    "2.2": "597/256",
+    "2.4": "640/256",
+    "2.8": "768/256",
+    "3.2": "853/256",
+    "3.5": "939/256",
+    "4": "1024/256",
+    "4.5": "1110/256",
+    "5": "1195/256",
+    "5.6": "1280/256",
+    "6.3": "1364/256",
+    "7.1": "1451/256",
+    "8": "1536/256",
+    "9": "1621/256",
+    "10": "1707/256",
+    "11": "1792/256",
+    "13": "1877/256",
+    "14": "1963/256",
+    "16": "2048/256",
+    "18": "2133/256",
+    "20": "2219/256",
+    "22": "2304/256"
+}
+
+# 256 between full stops. 1 second is the pos/neg boundary
+# See http://c710720.r20.cf2.rackcdn.com/wp-content/uploads/2011/08/ISO-Shutter-Speeds-Fstops-Copyright-2009-2011-photographyuncapped.gif
+SHUTTER_SPEEDS = {
+    "4000": "3072/256",
+    "3200": "2987/256",
+    "2500": "2902/256",
+    "2000": "2816/256",
+    "1600": "2731/256",
+    "1300": "2646/256",
+    "1000": "2560/256",
+    "800": "2475/256",
+    "640": "2390/256",
+    "500": "2304/256",
+    "400": "2219/256",
+    "320": "2134/256",
+    "250": "2048/256",
+    "200": "1963/256",
+    "160": "1878/256",
+    "125": "1792/256",
+    "100": "1707/256",
+    "80": "1622/256",
+    "60": "1536/256",
+    "50": "1451/256",
+    "40": "1366/256",
+    "30": "1280/256",
+    "25": "1195/256",
+    "20": "1110/256",
+    "15": "1024/256",
+    "13": "939/256",
+    "10": "854/256",
+    "8": "768/256",
+    "6": "683/256",
+    "5": "598/256",
+    "4": "512/256",
+    "3.2": "427/256",
+    "2.5": "342/256",
+    "2": "256/256",
+    "1.6": "171/256",
+    "1.3": "86/256",
+    "1": "0/256",
+    "1.3s": "-85/256",
+    "1.6s": "-170/256",
+    "2s": "-256/256",
+    "2.5s": "-341/256",
+    "3.2s": "-426/256",
+    "4s": "-512/256",
+    "5s": "-682/256",
+    "6s": "-768/256",
+    "8s": "-853/256",
+    "10s": "-938/256",
+    "13s": "-1024/256",
+    "15s": "-1109/256",
+    "20s": "-1194/256",
+    "25s": "-1280/256",
+    "30s": "-1365/256",
+    "40s": "-1450/256",
+    "50s": "-1536/256",
+    "60s": "16384/256",
+    "B": "256/256"
+}
+
+# settings profile names -> Lumix setting types
+SETTING_TYPES = {
+    "iso": "iso",
+    "aperture": "focal",
+    "shutter": "shtrspeed",
+    "video_quality": "videoquality",
+    "color_mode": "colormode",
+}
+
 
 class LumixCameraControl(CameraControl):
     """
@@ -19,30 +124,88 @@ class LumixCameraControl(CameraControl):
     Python implementation based on https://github.com/palmdalian/python_lumix_control
     """
 
+    ssdp_search_target = 'urn:schemas-upnp-org:service:ContentDirectory:1'
+    supports_liveview = True
+    supports_settings = True
+
     def __init__(self, cam_ip):
         self.cam_ip = cam_ip
         self.baseurl = "http://" + self.cam_ip + "/cam.cgi"
         self.name = f"Panasonic ({self.cam_ip})"
+        self._session = CameraSession()
+        # last known values of the settings, by Lumix setting type
+        self._known_settings = {}
+        self._focus_model = FocusStepModel()
+        self._focus_engine = None
+        self._focus_engine_depth = None
 
     @classmethod
     def discover(cls, iface=None):
         client = SSDPClient(iface=iface.encode("utf-8"))
-        devices = client.m_search('urn:schemas-upnp-org:service:ContentDirectory:1')
+        devices = client.m_search(cls.ssdp_search_target)
         ips = []
         for device in devices:
-            if "Panasonic-UPnP" in device["server"]:
-                ip, port = urlparse(device["location"]).netloc.split(':')
+            ip = cls.address_from_ssdp(device)
+            if ip is not None:
                 ips.append(ip)
         return ips
 
+    @classmethod
+    def address_from_ssdp(cls, headers):
+        if "Panasonic-UPnP" in headers.get("server", "") and "location" in headers:
+            return urlparse(headers["location"]).hostname
+        return None
+
     def __enter__(self):
-        resp = r.get(self.baseurl, params={"mode": "camcmd", "value": "recmode"})
+        # the settings may have been changed on the camera while it was disconnected
+        self._known_settings.clear()
+        # the same goes for the focus, and a pipelined focus connection does not survive a reconnect
+        if self._focus_engine is not None:
+            self._focus_engine.close()
+            self._focus_engine = None
+        resp = self._session.get(self.baseurl, params={"mode": "camcmd", "value": "recmode"})
         self._check_response(resp)
         return self
 
     def __exit__(self, *args):
         pass
 
+    def connection_stats(self):
+        return self._session.stats()
+
+    def create_liveview(self):
+        return LumixLiveView(self)
+
+    @classmethod
+    def validate_settings(cls, settings):
+        for name, value in settings.items():
+            cls._setting_value(name, value)
+
+    def apply_settings(self, settings, refresh=False):
+        changed = []
+        for name, value in settings.items():
+            setting = SETTING_TYPES[name]
+            value = self._setting_value(name, value)
+            if refresh or setting not in self._known_settings:
+                self._known_settings[setting] = self._read_setting(setting)
+            if self._known_settings[setting] != value:
+                self._set_setting({"type": setting, "value": value})
+                changed.append(name)
+        return changed
+
+    @staticmethod
+    def _setting_value(name, value):
+        try:
+            if name == "aperture":
+                return FSTOPS[value]
+            if name == "shutter":
+                return SHUTTER_SPEEDS[value]
+        except KeyError:
+            raise ValueError(f"unsupported {name} {value}")
+        if name == "iso" and value == "auto":
+            return "50"
+        return value
+
     def prepare(self):
         try:
             # set Cinelike D profile
@@ -65,16 +228,16 @@ class LumixCameraControl(CameraControl):
         return CameraState(rec, remaining)
 
     def start_stream(self, upd_port):
-        resp = r.get(self.baseurl, params={"mode": "startstream", "value": str(upd_port)})
+        resp = self._session.get(self.baseurl, params={"mode": "startstream", "value": str(upd_port)})
         self._check_response(resp)
 
     def stop_stream(self):
-        resp = r.get(self.baseurl, params={"mode": "stopstream"})
+        resp = self._session.get(self.baseurl, params={"mode": "stopstream"})
         self._check_response(resp)
 
     def _get_info(self, setting):
         params = {"mode": "getinfo", "type": setting}
-        resp = r.get(self.baseurl, params=params)
+        resp = self._session.get(self.baseurl, params=params)
         return resp
 
     def _get_lens_info(self):
@@ -84,14 +247,26 @@ class LumixCameraControl(CameraControl):
 
     def _get_setting(self, setting):
         params = {"mode": "getsetting", "type": setting}
-        resp = r.get(self.baseurl, params=params)
+        resp = self._session.get(self.baseurl, params=params)
         return resp
 
+    def _read_setting(self, setting):
+        """
+        Current value of the setting, or None if the camera did not report it
+        """
+        resp = self._get_setting(setting)
+        try:
+            element = ET.fromstring(resp.text).find("settingvalue")
+        except ET.ParseError:
+            return None
+        return element.get(setting) if element is not None else None
+
     def _set_setting(self, settings):
         params = {"mode": "setsetting"}
         params.update(settings)
-        resp = r.get(self.baseurl, params=params)
+        resp = self._session.get(self.baseurl, params=params)
         self._check_response(resp)
+        self._known_settings[settings["type"]] = settings["value"]
         return resp
 
     def get_focus_mode(self):
@@ -107,107 +282,13 @@ class LumixCameraControl(CameraControl):
         return resp
 
     def set_iso(self, iso):
-        if iso == "auto":
-            iso = "50"
-        self._set_setting({"type": "iso", "value": iso})
+        self._set_setting({"type": "iso", "value": self._setting_value("iso", iso)})
 
     def set_focal(self, focal):
-        # 256 between full stops. The rest are third stops.
-        # See http://c710720.r20.cf2.rackcdn.com/wp-content/uploads/2011/08/ISO-Shutter-Speeds-Fstops-Copyright-2009-2011-photographyuncapped.gif
-        fstop = {
-            "1": "0/256",
-            "1.1": "85/256",
-            "1.2": "171/256",
-            "1.4": "256/256",
-            "1.6": "341/256",
-            "1.8": "427/256",
-            "2": "512/256",
-            "2.2": "597/256",
-            "2.4": "640/256",
-            "2.8": "768/256",
-            "3.2": "853/256",
-            "3.5": "939/256",
-            "4": "1024/256",
-            "4.5": "1110/256",
-            "5": "1195/256",
-            "5.6": "1280/256",
-            "6.3": "1364/256",
-            "7.1": "1451/256",
-            "8": "1536/256",
-            "9": "1621/256",
-            "10": "1707/256",
-            "11": "1792/256",
-            "13": "1877/256",
-            "14": "1963/256",
-            "16": "2048/256",
-            "18": "2133/256",
-            "20": "2219/256",
-            "22": "2304/256"
-        }
-        self._set_setting({"type": "focal", "value": fstop[focal]})
+        self._set_setting({"type": "focal", "value": FSTOPS[focal]})
 
     def set_shutter(self, shutter):
-        # 256 between full stops. 1 second is the pos/neg boundary
-        # See http://c710720.r20.cf2.rackcdn.com/wp-content/uploads/2011/08/ISO-Shutter-Speeds-Fstops-Copyright-2009-2011-photographyuncapped.gif
-        shutter_speed = {
-            "4000": "3072/256",
-            "3200": "2987/256",
-            "2500": "2902/256",
-            "2000": "2816/256",
-            "1600": "2731/256",
-            "1300": "2646/256",
-            "1000": "2560/256",
-            "800": "2475/256",
-            "640": "2390/256",
-            "500": "2304/256",
-            "400": "2219/256",
-            "320": "2134/256",
-            "250": "2048/256",
-            "200": "1963/256",
-            "160": "1878/256",
-            "125": "1792/256",
-            "100": "1707/256",
-            "80": "1622/256",
-            "60": "1536/256",
-            "50": "1451/256",
-            "40": "1366/256",
-            "30": "1280/256",
-            "25": "1195/256",
-            "20": "1110/256",
-            "15": "1024/256",
-            "13": "939/256",
-            "10": "854/256",
-            "8": "768/256",
-            "6": "683/256",
-            "5": "598/256",
-            "4": "512/256",
-            "3.2": "427/256",
-            "2.5": "342/256",
-            "2": "256/256",
-            "1.6": "171/256",
-            "1.3": "86/256",
-            "1": "0/256",
-            "1.3s": "-85/256",
-            "1.6s": "-170/256",
-            "2s": "-256/256",
-            "2.5s": "-341/256",
-            "3.2s": "-426/256",
-            "4s": "-512/256",
-            "5s": "-682/256",
-            "6s": "-768/256",
-            "8s": "-853/256",
-            "10s": "-938/256",
-            "13s": "-1024/256",
-            "15s": "-1109/256",
-            "20s": "-1194/256",
-            "25s": "-1280/256",
-            "30s": "-1365/256",
-            "40s": "-1450/256",
-            "50s": "-1536/256",
-            "60s": "16384/256",
-            "B": "256/256"
-        }
-        self._set_setting({"type": "shtrspeed", "value": shutter_speed[shutter]})
+        self._set_setting({"type": "shtrspeed", "value": SHUTTER_SPEEDS[shutter]})
 
     def set_video_quality(self, quality="mp4ed_30p_100mbps_4k"):
         # mp4_24p_100mbps_4k / mp4_30p_100mbps_4k
@@ -222,72 +303,62 @@ class LumixCameraControl(CameraControl):
     def focus_control(self, direction="tele", speed="normal"):
         # tele or wide for direction, normal or fast for speed
         params = {"mode": "camctrl", "type": "focus", "value": direction + "-" + speed}
-        resp = r.get(self.baseurl, params=params)
+        resp = self._session.get(self.baseurl, params=params)
         return resp
 
-    def rack_focus(self, start_point="current", end_point="0", speed="normal"):
-        # tele or wide for direction, normal or fast for speed
-
-        # Check where we are with a fine step
-        resp = self.focus_control("tele", "normal").text
-        current_position = int(resp.split(',')[1])
-
-        if end_point == "current":
-            end_point = current_position + 13
-
-        # First get to the starting point if necessary
-        if start_point == "current":
-            start_point = current_position + 13
-        elif int(start_point) < current_position:
-            while current_position - int(start_point) > 13:
-                resp = self.focus_control("tele", "fast").text
-                current_position = int(resp.split(',')[1])
-        else:
-            while int(start_point) - current_position > 13:
-                resp = self.focus_control("wide", "fast").text
-                current_position = int(resp.split(',')[1])
-
-        # At the start, now let's get to the end point
-        start_point = int(start_point)
-
-        threshold = 13
-        if speed == "fast":
-            threshold = 70
-
-        if start_point > int(end_point):
-            while current_position - int(end_point) > threshold:
-                resp = self.focus_control("tele", speed).text
-                current_position = int(resp.split(',')[1])
-                if current_position - int(end_point) <= threshold:
-                    # Fine focus for the last bit
-                    threshold = 13
-                    speed = "normal"
-        else:
-            while int(end_point) - current_position > threshold:
-                resp = self.focus_control("wide", speed).text
-                current_position = int(resp.split(',')[1])
-                if int(end_point) - current_position <= threshold:
-                    threshold = 13
-                    speed = "normal"
+    def focus_engine(self, pipeline_depth=1):
+        """
+        Focus engine for this camera. The learned step sizes of the lens are kept between racks. With a pipeline_depth
+        above 1, the steps are sent over a dedicated connection without waiting for each response.
+        """
+        if self._focus_engine is not None and self._focus_engine_depth != pipeline_depth:
+            self._focus_engine.close()
+            self._focus_engine = None
+        if self._focus_engine is None:
+            if pipeline_depth > 1:
+                url = urlparse(self.baseurl)
+                transport = PipelinedFocusTransport(url.hostname, url.port or 80)
+            else:
+                transport = SessionFocusTransport(self)
+            self._focus_engine = FocusEngine(transport, self._focus_model, pipeline_depth)
+            self._focus_engine_depth = pipeline_depth
+        return self._focus_engine
+
+    def rack_focus(self, start_point="current", end_point="0", speed="normal", duration=None, pipeline_depth=1):
+        """
+        Moves the focus to start_point as fast as possible, then racks it to end_point with normal steps, or also fast
+        steps if speed is "fast". With a duration, the rack to end_point takes that many seconds.
+        """
+        engine = self.focus_engine(pipeline_depth)
+        try:
+            if start_point != "current":
+                engine.move_to(int(start_point))
+            if end_point != "current":
+                return engine.move_to(int(end_point), ("fast", "normal") if speed == "fast" else ("normal",), duration)
+        except Exception:
+            # the position is unknown after a failed step
+            engine.close()
+            self._focus_engine = None
+            raise
 
     def capture_photo(self):
         params = {"mode": "camcmd", "value": "capture"}
-        resp = r.get(self.baseurl, params=params)
+        resp = self._session.get(self.baseurl, params=params)
         return resp
 
     def video_record_start(self):
         params = {"mode": "camcmd", "value": "video_recstart"}
-        resp = r.get(self.baseurl, params=params)
-        return resp
+        resp = self._session.get(self.baseurl, params=params)
+        return "<result>ok</result" in resp.text
 
     def video_record_stop(self):
         params = {"mode": "camcmd", "value": "video_recstop"}
-        resp = r.get(self.baseurl, params=params)
+        resp = self._session.get(self.baseurl, params=params)
         return resp
 
     def _get_state(self):
         params = {"mode": "getstate"}
-        resp = r.get(self.baseurl, params=params)
+        resp = self._session.get(self.baseurl, params=params)
         return resp
 
     def _check_response(self, resp):
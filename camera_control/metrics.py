@@ -0,0 +1,135 @@
+import bisect
+import threading
+
+# latency buckets in seconds, from fast local requests up to the HTTP read timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+GAP_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, labelvalues)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [bucket counts (not cumulative, last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def totals(self):
+        """
+        Bucket counts (not cumulative, last one is +Inf) and sum over all label values
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        with self._lock:
+            for entry_counts, entry_total in self._values.values():
+                counts = [a + b for a, b in zip(counts, entry_counts)]
+                total += entry_total
+        return counts, total
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._values.items()]
+        for labelvalues, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+camera_request_seconds = registry.histogram(
+    "camera_request_seconds", "Duration of camera API calls", ("camera", "call"))
+discovery_seconds = registry.histogram(
+    "camera_discovery_seconds", "Duration of SSDP searches", ("type", "interface"))
+poll_jitter_seconds = registry.histogram(
+    "camera_poll_jitter_seconds", "Delay of polls after their scheduled time", ("camera",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+camera_deadline_exceeded_total = registry.counter(
+    "camera_deadline_exceeded_total", "Camera API calls that did not finish within their deadline", ("camera", "call"))
+camera_read_attempts_total = registry.counter(
+    "camera_read_attempts_total", "Hedged or retried reads of the camera state", ("camera",))
+camera_unconfirmed_commands_total = registry.counter(
+    "camera_unconfirmed_commands_total", "Start and stop commands not confirmed by the camera state read right after",
+    ("camera", "command"))
+reconnects_total = registry.counter(
+    "camera_reconnects_total", "Failed connections to a camera", ("camera",))
+restart_gap_seconds = registry.histogram(
+    "camera_restart_gap_seconds", "Time without recording while restarting the recording", ("camera",),
+    buckets=GAP_BUCKETS)
+early_restarts_total = registry.counter(
+    "camera_early_restarts_total", "Recordings restarted early to stagger the restarts of the cameras", ("camera",))
+http_requests_total = registry.counter(
+    "webui_requests_total", "Requests to the web UI", ("endpoint",))
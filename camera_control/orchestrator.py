@@ -0,0 +1,168 @@
+"""
+Staggered recording restarts across all cameras, so that a given number of them is recording at any time.
+
+Cameras that were started together reach their recording time limit together, so without coordination all of them
+would be restarting, and no angle would be recorded, at the same moment. The orchestrator predicts when every camera has
+to be restarted, plans the restarts so that no more cameras restart at the same time than can be spared, and restarts
+cameras early where needed. Restarts are only ever moved earlier, as a camera stops by itself at its limit. As all
+clips are equally long afterwards, the cameras stay staggered after the first round of restarts.
+"""
+
+import logging
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+ORCHESTRATION_INTERVAL = 0.25
+# assumed time a camera is not recording during a restart, until restart gaps have been measured
+DEFAULT_RESTART_GAP = 3
+# planned time between the end of one camera's restart and the start of the next one
+STAGGER_MARGIN = 1
+# a planned restart less than this many seconds before its camera's own restart is left to the camera's worker
+MIN_EARLY_RESTART = 1
+
+
+def plan_restarts(due: dict, spacing, capacity, busy=()) -> dict:
+    """
+    Plans the restarts of cameras that have to be restarted by the given times, so that at most `capacity` restarts
+    overlap, every restart taking `spacing` seconds. Restarts already in progress are given as their start times in
+    busy. Returns the planned times by camera, none of them later than the camera's due time.
+    """
+    planned = {}
+    for camera, at in sorted(due.items(), key=lambda item: item[1], reverse=True):
+        start = at
+        while True:
+            overlapping = sorted(t for t in [*planned.values(), *busy] if t < start + spacing and start < t + spacing)
+            if len(overlapping) < capacity:
+                break
+            # move before enough of the overlapping restarts to leave only capacity - 1 of them
+            start = overlapping[capacity - 1] - spacing
+        planned[camera] = start
+    return planned
+
+
+def max_overlap(starts, spacing) -> int:
+    """
+    Largest number of restarts of the given start times that are in progress at the same time
+    """
+    events = sorted([(t, 1) for t in starts] + [(t + spacing, -1) for t in starts], key=lambda e: (e[0], e[1]))
+    overlap = highest = 0
+    for _, change in events:
+        overlap += change
+        highest = max(highest, overlap)
+    return highest
+
+
+class Coverage:
+    """
+    Time during which at least the wanted number of cameras was recording, while recording was wanted
+    """
+
+    def __init__(self, min_recording):
+        self.min_recording = min_recording
+        self.seconds = 0.0
+        self.covered_seconds = 0.0
+        self.min_seen = None
+        self._last = None
+
+    def add(self, now, recording):
+        if self._last is not None:
+            since, last_recording = self._last
+            self.seconds += now - since
+            if last_recording >= self.min_recording:
+                self.covered_seconds += now - since
+        self.min_seen = recording if self.min_seen is None else min(self.min_seen, recording)
+        self._last = now, recording
+
+    def pause(self):
+        self._last = None
+
+    def stats(self):
+        return {
+            "seconds": self.seconds,
+            "covered": self.covered_seconds / self.seconds if self.seconds else None,
+            "min_recording": self.min_seen,
+        }
+
+
+class RestartOrchestrator(threading.Thread):
+    """
+    Plans the restarts of the cameras of the given workers (a callable returning them) and restarts cameras early, so
+    that at least min_recording of them are recording whenever should_record() is True
+    """
+
+    def __init__(self, workers, min_recording, should_record):
+        super().__init__(name="RestartOrchestrator", daemon=True)
+        self.min_recording = min_recording
+        self._workers = workers
+        self._should_record = should_record
+        self.coverage = Coverage(min_recording)
+        self.early_restarts = 0
+        self._stats = {}
+
+    def run(self):
+        while True:
+            try:
+                self.tick(time.monotonic())
+            except Exception:
+                logger.error("orchestrating restarts failed", exc_info=True)
+            time.sleep(ORCHESTRATION_INTERVAL)
+
+    def tick(self, now):
+        # only cameras that report whether they are recording can be orchestrated
+        active = [worker for worker in self._workers() if worker.connected and worker.cam_state is not None
+                  and worker.cam_state.recording is not None]
+        if not self._should_record():
+            self.coverage.pause()
+            self._stats = {}
+            return
+        recording = [worker for worker in active if worker.is_recording()]
+        self.coverage.add(now, len(recording))
+
+        due = {}
+        for worker in recording:
+            time_to_restart = worker.time_to_restart(now)
+            if time_to_restart is not None:
+                due[worker] = now + time_to_restart
+        capacity = max(len(active) - self.min_recording, 1)
+        spacing = self._expected_gap(active) + STAGGER_MARGIN
+        busy = [now] * (len(active) - len(recording))
+        planned = plan_restarts(due, spacing, capacity, busy)
+
+        self._stats = {
+            "cameras": len(active),
+            "recording": len(recording),
+            "predicted_min_recording": len(active) - max_overlap([*planned.values(), *busy], spacing),
+            "unstaggered_min_recording": len(active) - max_overlap([*due.values(), *busy], spacing),
+            "planned": {worker.cam_name or worker.ip: {"in": max(at - now, 0), "early_by": due[worker] - at}
+                        for worker, at in planned.items()},
+        }
+
+        for worker, at in sorted(planned.items(), key=lambda item: item[1]):
+            if at > now or len(busy) >= capacity:
+                break
+            early_by = due[worker] - now
+            if early_by < MIN_EARLY_RESTART:
+                continue
+            logger.info(f"restarting {worker.ip} {early_by:.1f}s early, to stagger the restarts")
+            worker.request_restart(early_by)
+            metrics.early_restarts_total.inc(worker.ip)
+            self.early_restarts += 1
+            busy.append(now)
+
+    @staticmethod
+    def _expected_gap(workers):
+        gaps = [worker.restart_stats()["mean_gap"] for worker in workers]
+        gaps = [gap for gap in gaps if gap is not None]
+        return max(gaps) if gaps else DEFAULT_RESTART_GAP
+
+    def stats(self):
+        return {
+            "min_recording": self.min_recording,
+            "early_restarts": self.early_restarts,
+            "achieved": self.coverage.stats(),
+            **self._stats,
+        }
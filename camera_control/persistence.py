@@ -0,0 +1,68 @@
+"""
+State of the web UI that is kept across restarts, so that it can reconnect to the known cameras and continue recording
+right away after a crash or power loss, without waiting for discovery.
+"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+
+class StateFile:
+    """
+    A JSON file that is replaced atomically, so that a power loss while saving leaves either the old or the new state
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._saved = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """
+        The saved state, or an empty dict if there is none or it cannot be read
+        """
+        try:
+            with open(self.path) as f:
+                text = f.read()
+            state = json.loads(text)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring unreadable state file {self.path}: {e}")
+            return {}
+        if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+            logger.warning(f"ignoring state file {self.path} of an unknown version")
+            return {}
+        self._saved = text
+        return state
+
+    def save(self, state: dict) -> bool:
+        """
+        Writes the state unless it is unchanged since the last save, to spare the SD card. Returns True if it was written.
+        """
+        text = json.dumps({"version": STATE_VERSION, **state}, indent=1, sort_keys=True)
+        with self._lock:
+            if text == self._saved:
+                return False
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+            # the rename itself is only durable once the directory has been synced
+            directory_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+            self._saved = text
+            return True
@@ -0,0 +1,102 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CameraRegistry:
+    """
+    Workers of all known cameras, keyed by camera address.
+
+    A camera that has neither been connected nor seen by discovery for evict_after seconds is evicted: its worker is
+    stopped and removed. If discovery finds it again later, a new worker is created. At most max_size cameras are
+    kept; when the registry is full, the camera that has been absent the longest makes room for a new one.
+    """
+
+    def __init__(self, create_worker, evict_after=600, max_size=64, on_evict=None):
+        self._create_worker = create_worker
+        self.evict_after = evict_after
+        self.max_size = max_size
+        self._on_evict = on_evict
+        self._workers = {}
+        self._last_seen = {}
+        self._lock = threading.Lock()
+        # recently evicted addresses, to count re-adoptions
+        self._evicted = collections.OrderedDict()
+        self.evictions = 0
+        self.readoptions = 0
+
+    def add(self, address, type):
+        """
+        Called whenever discovery sees a camera. Starts a worker for it unless it is already known.
+        """
+        with self._lock:
+            self._last_seen[address] = time.monotonic()
+            if address in self._workers:
+                self._workers[address].on_seen()
+                return
+            if len(self._workers) >= self.max_size and not self._evict_longest_absent():
+                logger.warning(f"camera registry is full, ignoring {address}")
+                return
+            if self._evicted.pop(address, None) is not None:
+                self.readoptions += 1
+                logger.info(f"re-adopting camera {address}")
+            self._workers[address] = self._create_worker(address, type)
+
+    def workers(self):
+        with self._lock:
+            return list(self._workers.values())
+
+    def items(self):
+        with self._lock:
+            return list(self._workers.items())
+
+    def __len__(self):
+        return len(self._workers)
+
+    def sweep(self):
+        """
+        Evicts all cameras that have been absent for longer than evict_after
+        """
+        now = time.monotonic()
+        with self._lock:
+            for address in [address for address in self._workers if self._absence(address, now) > self.evict_after]:
+                self._evict(address)
+
+    def stats(self):
+        return {
+            "size": len(self._workers),
+            "max_size": self.max_size,
+            "evictions": self.evictions,
+            "readoptions": self.readoptions,
+        }
+
+    def _absence(self, address, now):
+        worker = self._workers[address]
+        if worker.connected:
+            return 0
+        last_present = max(self._last_seen.get(address, 0), worker.last_connected_at or 0)
+        return now - last_present
+
+    def _evict_longest_absent(self):
+        now = time.monotonic()
+        absences = {address: self._absence(address, now) for address in self._workers}
+        absent = [address for address, absence in absences.items() if absence > 0]
+        if not absent:
+            return False
+        self._evict(max(absent, key=absences.get))
+        return True
+
+    def _evict(self, address):
+        logger.info(f"evicting camera {address}")
+        worker = self._workers.pop(address)
+        self._last_seen.pop(address, None)
+        worker.stop()
+        self.evictions += 1
+        self._evicted[address] = True
+        while len(self._evicted) > 256:
+            self._evicted.popitem(last=False)
+        if self._on_evict is not None:
+            self._on_evict(address)
@@ -0,0 +1,56 @@
+"""
+Declarative settings profiles, applied to all cameras in parallel.
+
+A profile maps setting names to the values as they are written on the camera, e.g.
+{"iso": "400", "aperture": "5.6", "shutter": "50", "color_mode": "cinelike_d"}. Drivers only send the settings that
+differ from the camera's current values.
+"""
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SETTING_NAMES = ("iso", "aperture", "shutter", "video_quality", "color_mode")
+
+
+def validate_profile(profile, camera_types=()):
+    """
+    Raises ValueError if the profile is malformed or one of the given camera types does not support one of its values
+    """
+    if not isinstance(profile, dict):
+        raise ValueError("a settings profile must be a JSON object")
+    for name, value in profile.items():
+        if name not in SETTING_NAMES:
+            raise ValueError(f"unknown setting {name}, expected one of {SETTING_NAMES}")
+        if not isinstance(value, str):
+            raise ValueError(f"value of {name} must be a string")
+    for type in camera_types:
+        if type.supports_settings:
+            type.validate_settings(profile)
+    return profile
+
+
+def load_profile(path, camera_types=()):
+    with open(path) as f:
+        return validate_profile(json.load(f), camera_types)
+
+
+def apply_profile(workers, profile, refresh=False):
+    """
+    Applies the profile to all given camera workers at the same time. Returns a dict mapping the camera addresses to
+    the list of changed settings, to an error message, or to None if the camera does not support settings.
+    """
+    if not workers:
+        return {}
+
+    def apply(worker):
+        try:
+            return worker.apply_settings(profile, refresh)
+        except Exception as e:
+            logger.warning(f"applying settings to {worker.ip} failed: {e}")
+            return {"error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=len(workers), thread_name_prefix="settings") as executor:
+        return dict(zip([worker.ip for worker in workers], executor.map(apply, workers)))
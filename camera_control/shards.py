@@ -0,0 +1,163 @@
+"""
+Camera control in worker processes, one per network interface, behind the web UI's front end process.
+
+A camera whose driver blocks or keeps the CPU busy then only delays the cameras of its own process. The worker
+processes send the state of their cameras to the front end as (pickled) diffs over a pipe, and receive record
+commands and calls such as applying a settings profile. A worker process that exits or crashes is restarted.
+"""
+
+import atexit
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+# a worker process that has been running for this long is considered healthy again, resetting the restart delay
+HEALTHY_AFTER = 60
+CALL_TIMEOUT = 30
+
+
+class ShardProcess(threading.Thread):
+    """
+    Runs target(connection, *args) in a worker process and restarts it whenever it exits. Messages from the worker
+    are passed to on_message(shard, message), except for the results of call(). on_start(shard) is called whenever the
+    worker has been started, on_exit(shard) whenever it has exited.
+    """
+
+    def __init__(self, name, target, args, on_message, on_start=None, on_exit=None):
+        super().__init__(name=f"Shard {name}", daemon=True)
+        self.shard_name = name
+        self._target = target
+        self._args = args
+        self._on_message = on_message
+        self._on_start = on_start
+        self._on_exit = on_exit
+        # spawned instead of forked, as forking a process with running threads can copy locks in a locked state
+        self._context = multiprocessing.get_context("spawn")
+        self._connection = None
+        self._send_lock = threading.Lock()
+        self._calls = {}
+        self._call_ids = itertools.count()
+        self.process = None
+        self.restarts = 0
+        self.started_at = None
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+
+    def send(self, message) -> bool:
+        """
+        Sends a message to the worker process. Returns False if it is not running.
+        """
+        with self._send_lock:
+            if self._connection is None:
+                return False
+            try:
+                self._connection.send(message)
+                return True
+            except (OSError, ValueError):
+                return False
+
+    def call(self, method, *args, timeout=CALL_TIMEOUT):
+        """
+        Calls a method in the worker process and returns its result. Raises IOError if the worker is not running or
+        exits before answering.
+        """
+        call_id = next(self._call_ids)
+        future = self._calls[call_id] = Future()
+        try:
+            if not self.send(("call", call_id, method, args)):
+                raise IOError(f"worker process {self.shard_name} is not running")
+            return future.result(timeout)
+        finally:
+            self._calls.pop(call_id, None)
+
+    def stats(self):
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.process is not None and self.process.is_alive(),
+            "restarts": self.restarts,
+            "uptime": time.monotonic() - self.started_at if self.started_at is not None else None,
+        }
+
+    def run(self):
+        delay = RESTART_DELAY
+        while True:
+            connection, child_connection = self._context.Pipe()
+            self.process = self._context.Process(target=self._target, args=(child_connection, *self._args),
+                                                 name=self.name, daemon=True)
+            self.process.start()
+            if not self.restarts:
+                # multiprocessing terminates the worker processes on exit, which must not be taken for a crash. Its
+                # exit handler is registered on the first start, so this one runs before it.
+                atexit.register(self.stop)
+            child_connection.close()
+            self.started_at = time.monotonic()
+            with self._send_lock:
+                self._connection = connection
+            logger.info(f"worker process {self.shard_name} started with pid {self.process.pid}")
+            if self._on_start is not None:
+                self._on_start(self)
+            self._receive(connection)
+
+            with self._send_lock:
+                self._connection = None
+            connection.close()
+            self.process.join()
+            for future in list(self._calls.values()):
+                future.set_exception(IOError(f"worker process {self.shard_name} exited"))
+            if self._stopping:
+                return
+            if self._on_exit is not None:
+                self._on_exit(self)
+            if time.monotonic() - self.started_at > HEALTHY_AFTER:
+                delay = RESTART_DELAY
+            logger.error(f"worker process {self.shard_name} exited with code {self.process.exitcode}, "
+                         f"restarting in {delay} s")
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+            self.restarts += 1
+
+    def _receive(self, connection):
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == "result":
+                _, call_id, result, error = message
+                future = self._calls.get(call_id)
+                if future is not None:
+                    if error is not None:
+                        future.set_exception(IOError(error))
+                    else:
+                        future.set_result(result)
+            else:
+                try:
+                    self._on_message(self, message)
+                except Exception:
+                    logger.error(f"cannot handle message from worker process {self.shard_name}", exc_info=True)
+
+
+class ShardConnection:
+    """
+    The worker process's end of the pipe to the front end
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            self._connection.send(message)
+
+    def receive(self):
+        return self._connection.recv()
@@ -0,0 +1,615 @@
+"""
+Simulated Lumix and Sony cameras for load tests without physical cameras.
+
+Every simulated camera serves the parts of the camera's HTTP API used by this project on its own address. Recordings
+stop by themselves after a configurable cutoff, and request latency, jitter and packet loss can be injected, as well as
+requests that are not answered for a long time (stalls) and cameras that stop answering altogether (blackhole). An SSDP
+responder answers M-SEARCH requests for all simulated cameras.
+
+Run ``python -m camera_control.simulator --lumix 4 --sony 2`` to start simulated cameras. Their addresses are printed
+as JSON on the first line of the output.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+SSDP_ADDRESS = "239.255.255.250"
+SSDP_PORT = 1900
+
+LUMIX_SEARCH_TARGET = "urn:schemas-upnp-org:service:ContentDirectory:1"
+SONY_SEARCH_TARGET = "urn:schemas-sony-com:service:ScalarWebAPI:1"
+
+SONY_DEVICE_DESCRIPTION = """<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+  <device>
+    <friendlyName>{name}</friendlyName>
+    <av:X_ScalarWebAPI_DeviceInfo xmlns:av="urn:schemas-sony-com:av">
+      <av:X_ScalarWebAPI_Version>1.0</av:X_ScalarWebAPI_Version>
+      <av:X_ScalarWebAPI_ServiceList>
+        <av:X_ScalarWebAPI_Service>
+          <av:X_ScalarWebAPI_ServiceType>camera</av:X_ScalarWebAPI_ServiceType>
+          <av:X_ScalarWebAPI_ActionList_URL>http://{host}:{port}/sony</av:X_ScalarWebAPI_ActionList_URL>
+        </av:X_ScalarWebAPI_Service>
+      </av:X_ScalarWebAPI_ServiceList>
+    </av:X_ScalarWebAPI_DeviceInfo>
+  </device>
+</root>
+"""
+
+# getEvent returns an array with one entry per event type, the ones used here are at these indices
+SONY_EVENT_COUNT = 60
+SONY_EVENT_CAMERA_STATUS = 1
+SONY_EVENT_RECORDING_TIME = 57
+
+
+SONY_PAYLOAD_IMAGE = 0x01
+SONY_PAYLOAD_FRAME_INFO = 0x02
+SONY_START_CODE = b"\x24\x35\x68\x79"
+# frame information payload without any focus frames
+SONY_FRAME_INFO = bytes(16)
+
+
+def dummy_jpeg(size):
+    return b"\xff\xd8" + bytes(size - 4) + b"\xff\xd9"
+
+
+def sony_liveview_packet(payload_type, sequence, payload, padding=0):
+    """
+    Sony live view packet: common header, payload header, payload and padding
+    """
+    common_header = struct.pack(">BBHI", 0xFF, payload_type, sequence, int(time.monotonic() * 1000) & 0xFFFFFFFF)
+    payload_header = SONY_START_CODE + len(payload).to_bytes(3, "big") + bytes([padding]) + bytes(120)
+    return common_header + payload_header + payload + bytes(padding)
+
+
+class SimulatedCamera:
+    """
+    Recording state of a simulated camera. Recordings stop by themselves after `cutoff` seconds, and the camera is
+    busy for `save_time` seconds after every recording while it saves the clip.
+    """
+
+    def __init__(self, cutoff=1800, save_time=1.0, latency=0.0, jitter=0.0, loss=0.0, retransmit_delay=1.0,
+                 stall=0.0, stall_time=30.0, focus_steps=None, focus_range=1023, focus_step_time=0.02):
+        self.cutoff = cutoff
+        self.save_time = save_time
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.retransmit_delay = retransmit_delay
+        # probability that a request is only answered after stall_time seconds, like a camera that stops responding
+        # in the middle of a request
+        self.stall = stall
+        self.stall_time = stall_time
+        self._answering = threading.Event()
+        self._answering.set()
+        self.settings = {}
+        # lens: focus step sizes per speed, and the time the camera needs for a step
+        self.focus_steps = focus_steps or {"normal": 13, "fast": 70}
+        self.focus_range = focus_range
+        self.focus_step_time = focus_step_time
+        self.focus_position = focus_range // 2
+
+        self._recording_since = None
+        self._saving_until = 0
+        self._changed = threading.Condition()
+        self.version = 0
+        # history of (start, end) times of all finished recordings, to measure coverage and gaps
+        self.clips = []
+
+    def delay(self, since=None):
+        """
+        Sleeps for the injected latency, counted from the given monotonic time. A lost packet is modelled as a TCP
+        retransmission.
+        """
+        self._answering.wait()
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.loss and random.random() < self.loss:
+            delay += self.retransmit_delay
+        if self.stall and random.random() < self.stall:
+            delay += self.stall_time
+        if since is not None:
+            delay -= time.monotonic() - since
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def blackhole(self):
+        """
+        While True, requests are received but not answered, like by an overheated camera
+        """
+        return not self._answering.is_set()
+
+    @blackhole.setter
+    def blackhole(self, value):
+        if value:
+            self._answering.clear()
+        else:
+            self._answering.set()
+
+    def step_focus(self, direction, speed):
+        time.sleep(self.focus_step_time)
+        step = self.focus_steps[speed] * (-1 if direction == "tele" else 1)
+        self.focus_position = min(max(self.focus_position + step, 0), self.focus_range)
+        return self.focus_position
+
+    def _update(self, now):
+        if self._recording_since is not None and now - self._recording_since >= self.cutoff:
+            self._finish(self._recording_since + self.cutoff)
+        if self._saving_until and now >= self._saving_until:
+            # the end of saving is a state change as well, e.g. for Sony event clients
+            self._saving_until = 0
+            self.version += 1
+            self._changed.notify_all()
+
+    def _finish(self, end):
+        self.clips.append((self._recording_since, end))
+        self._recording_since = None
+        self._saving_until = end + self.save_time
+        self.version += 1
+        self._changed.notify_all()
+
+    @property
+    def recording(self):
+        with self._changed:
+            self._update(time.time())
+            return self._recording_since is not None
+
+    @property
+    def saving(self):
+        with self._changed:
+            now = time.time()
+            self._update(now)
+            return self._recording_since is None and now < self._saving_until
+
+    def recording_time(self):
+        """
+        Seconds since the recording was started, or None if not recording
+        """
+        with self._changed:
+            now = time.time()
+            self._update(now)
+            return now - self._recording_since if self._recording_since is not None else None
+
+    def start_recording(self):
+        """
+        Returns False if the camera is busy
+        """
+        with self._changed:
+            now = time.time()
+            self._update(now)
+            if self._recording_since is not None or now < self._saving_until:
+                return False
+            self._recording_since = now
+            self.version += 1
+            self._changed.notify_all()
+            return True
+
+    def stop_recording(self):
+        with self._changed:
+            now = time.time()
+            self._update(now)
+            if self._recording_since is not None:
+                self._finish(now)
+
+    def wait_for_change(self, version, timeout):
+        """
+        Waits until the state differs from the given version, also noticing recordings that hit the cutoff
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while self.version == version:
+                now = time.time()
+                self._update(now)
+                if self.version != version or now >= deadline:
+                    break
+                wait = deadline - now
+                if self._recording_since is not None:
+                    wait = min(wait, self._recording_since + self.cutoff - now)
+                if self._saving_until:
+                    wait = min(wait, self._saving_until - now)
+                self._changed.wait(max(wait, 0.001))
+            return self.version
+
+
+class _CameraRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # unbuffered, so that pipelined requests can be detected on the socket
+    rbufsize = 0
+    _pipelined = False
+    _arrived_at = 0
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, which would otherwise be delayed by Nagle's algorithm
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @property
+    def camera(self) -> SimulatedCamera:
+        return self.server.camera
+
+    def wait_for_latency(self):
+        """
+        Delays the request by the camera's latency. A request that was already waiting when the previous reply was
+        sent has been pipelined by the client, so its latency overlapped with the previous request.
+        """
+        if not self._pipelined:
+            self._arrived_at = time.monotonic()
+        self.camera.delay(since=self._arrived_at)
+
+    def read_body(self):
+        # the unbuffered reader may return less than requested
+        length = int(self.headers.get("Content-Length", 0))
+        body = b""
+        while len(body) < length:
+            chunk = self.rfile.read(length - len(body))
+            if not chunk:
+                break
+            body += chunk
+        return body
+
+    def reply(self, body, content_type="text/xml"):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self._pipelined = bool(select.select([self.connection], [], [], 0)[0])
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class LumixRequestHandler(_CameraRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/cam.cgi":
+            self.send_error(404)
+            return
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self.wait_for_latency()
+        mode = params.get("mode")
+        value = params.get("value")
+        self.server.requests[mode] += 1
+
+        if mode == "camctrl" and params.get("type") == "focus":
+            direction, speed = value.split("-")
+            self.reply(f"ok,{self.camera.step_focus(direction, speed)},{self.camera.focus_range}", "text/plain")
+            return
+
+        ok = True
+        extra = ""
+        if mode == "getstate":
+            recording_time = self.camera.recording_time()
+            remaining = int(self.camera.cutoff - (recording_time or 0))
+            extra = (f"<state><video_remaincapacity>{remaining}</video_remaincapacity>"
+                     f"<rec>{'on' if recording_time is not None else 'off'}</rec></state>")
+        elif mode == "camcmd":
+            if value == "video_recstart":
+                ok = self.camera.start_recording()
+            elif value == "video_recstop":
+                self.camera.stop_recording()
+        elif mode == "setsetting":
+            self.camera.settings[params.get("type")] = value
+        elif mode == "startstream":
+            self.server.start_stream((self.client_address[0], int(value)))
+        elif mode == "stopstream":
+            self.server.stop_stream()
+        elif mode == "getsetting":
+            setting = params.get("type")
+            extra = f'<settingvalue {setting}="{self.camera.settings.get(setting, "")}"></settingvalue>'
+        self.reply(f"<?xml version=\"1.0\"?><camrply><result>{'ok' if ok else 'err_busy'}</result>{extra}</camrply>")
+
+
+class SonyRequestHandler(_CameraRequestHandler):
+    def do_GET(self):
+        if self.path == "/liveview/liveviewstream":
+            self.stream_liveview()
+            return
+        if self.path != "/dd.xml":
+            self.send_error(404)
+            return
+        host, port = self.server.server_address[:2]
+        self.reply(SONY_DEVICE_DESCRIPTION.format(name=self.server.name, host=host, port=port))
+
+    def do_POST(self):
+        if self.path != "/sony/camera":
+            self.send_error(404)
+            return
+        request = json.loads(self.read_body())
+        self.wait_for_latency()
+        method = request["method"]
+        params = request.get("params", [])
+        self.server.requests[method] += 1
+
+        if method == "getEvent":
+            if params and params[0]:
+                # like the real cameras, only one long-poll is answered at a time
+                with self.server.lock:
+                    if self.server.long_polling:
+                        self.reply_json({"error": [40402, "Already polling"], "id": request["id"]})
+                        return
+                    self.server.long_polling = True
+                try:
+                    # long polling: answer once something has changed since the last getEvent
+                    version = self.camera.wait_for_change(self.server.event_version, self.server.long_poll_timeout)
+                finally:
+                    with self.server.lock:
+                        self.server.long_polling = False
+                if version == self.server.event_version:
+                    self.reply_json({"error": [2, "Timeout"], "id": request["id"]})
+                    return
+            self.server.event_version = self.camera.version
+            recording_time = self.camera.recording_time()
+            if recording_time is not None:
+                status = "MovieRecording"
+            elif self.camera.saving:
+                status = "MovieSaving"
+            else:
+                status = "IDLE"
+            result = [None] * SONY_EVENT_COUNT
+            result[SONY_EVENT_CAMERA_STATUS] = {"type": "cameraStatus", "cameraStatus": status}
+            result[SONY_EVENT_RECORDING_TIME] = {"type": "recordingTime",
+                                                 "recordingTime": int(recording_time) if recording_time is not None else -1}
+            self.reply_json({"result": result, "id": request["id"]})
+        elif method == "startMovieRec":
+            if self.camera.start_recording():
+                self.reply_json({"result": [0], "id": request["id"]})
+            else:
+                self.reply_json({"error": [40403, "Already in use"], "id": request["id"]})
+        elif method == "stopMovieRec":
+            self.camera.stop_recording()
+            self.reply_json({"result": [""], "id": request["id"]})
+        elif method == "startLiveview":
+            host, port = self.server.server_address[:2]
+            self.server.liveview_active = True
+            self.reply_json({"result": [f"http://{host}:{port}/liveview/liveviewstream"], "id": request["id"]})
+        elif method == "stopLiveview":
+            self.server.liveview_active = False
+            self.reply_json({"result": [0], "id": request["id"]})
+        elif method == "getVersions":
+            self.reply_json({"result": [["1.0", "1.1", "1.2"]], "id": request["id"]})
+        else:
+            self.reply_json({"error": [12, "No Such Method"], "id": request["id"]})
+
+    def reply_json(self, data):
+        self.reply(json.dumps(data), "application/json")
+
+    def stream_liveview(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        interval = 1 / self.server.liveview_fps
+        next_frame = time.monotonic()
+        sequence = 0
+        try:
+            while self.server.liveview_active:
+                for payload_type, payload in ((SONY_PAYLOAD_FRAME_INFO, SONY_FRAME_INFO),
+                                              (SONY_PAYLOAD_IMAGE, self.server.liveview_frame)):
+                    self.wfile.write(sony_liveview_packet(payload_type, sequence, payload))
+                sequence = (sequence + 1) & 0xFFFF
+                self.server.frames_sent += 1
+                next_frame += interval
+                time.sleep(max(next_frame - time.monotonic(), 0))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class CameraServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, camera: SimulatedCamera, name):
+        super().__init__(address, handler)
+        self.camera = camera
+        self.name = name
+        self.event_version = -1
+        # number of requests per Lumix mode or Sony method
+        self.requests = collections.Counter()
+        self.long_poll_timeout = 30
+        self.long_polling = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def handle_error(self, request, client_address):
+        # clients give up on stalled requests, which is not an error of the simulator
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SimulatedLumix(CameraServer):
+    search_target = LUMIX_SEARCH_TARGET
+    # the live view stops if startstream is not repeated within this many seconds
+    STREAM_TIMEOUT = 10
+
+    def __init__(self, host="127.0.0.1", port=0, name="DMC-G81", liveview_fps=30, liveview_frame_size=30000,
+                 **camera_args):
+        super().__init__((host, port), LumixRequestHandler, SimulatedCamera(**camera_args), name)
+        self.liveview_fps = liveview_fps
+        self._frame = self._make_frame(liveview_frame_size)
+        self._stream_target = None
+        self._stream_until = 0
+        self._stream_thread = None
+        self.frames_sent = 0
+
+    @staticmethod
+    def _make_frame(size):
+        # a header like the camera's, followed by a dummy JPEG
+        return bytes(30) + struct.pack(">H", 0) + dummy_jpeg(size)
+
+    def start_stream(self, target):
+        self._stream_target = target
+        self._stream_until = time.monotonic() + self.STREAM_TIMEOUT
+        if self._stream_thread is None or not self._stream_thread.is_alive():
+            self._stream_thread = threading.Thread(target=self._stream, name=f"{self.name} live view", daemon=True)
+            self._stream_thread.start()
+
+    def stop_stream(self):
+        self._stream_until = 0
+
+    def _stream(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        interval = 1 / self.liveview_fps
+        next_frame = time.monotonic()
+        while time.monotonic() < self._stream_until:
+            if not (self.camera.loss and random.random() < self.camera.loss):
+                sock.sendto(self._frame, self._stream_target)
+                self.frames_sent += 1
+            next_frame += interval
+            time.sleep(max(next_frame - time.monotonic(), 0))
+        sock.close()
+
+    @property
+    def address(self):
+        """
+        Address as passed to LumixCameraControl
+        """
+        return self.host if self.port == 80 else f"{self.host}:{self.port}"
+
+    @property
+    def location(self):
+        return f"http://{self.host}:{self.port}/dms/ddd.xml"
+
+    server_header = "Panasonic-UPnP/1.0 UPnP/1.0"
+
+
+class SimulatedSony(CameraServer):
+    search_target = SONY_SEARCH_TARGET
+    server_header = "UPnP/1.0 SonyImagingDevice/1.0"
+
+    def __init__(self, host="127.0.0.1", port=0, name="ILCE-7M3", liveview_fps=30, liveview_frame_size=30000,
+                 **camera_args):
+        super().__init__((host, port), SonyRequestHandler, SimulatedCamera(**camera_args), name)
+        self.liveview_fps = liveview_fps
+        self.liveview_frame = dummy_jpeg(liveview_frame_size)
+        self.liveview_active = False
+        self.frames_sent = 0
+
+    @property
+    def address(self):
+        """
+        Address as passed to SonyCameraControl
+        """
+        return self.location
+
+    @property
+    def location(self):
+        return f"http://{self.host}:{self.port}/dd.xml"
+
+
+class SSDPResponder(threading.Thread):
+    """
+    Answers SSDP M-SEARCH requests on behalf of simulated cameras. Lost packets are simulated by not answering.
+    """
+
+    def __init__(self, servers, loss=0.0):
+        self.servers = servers
+        self.loss = loss
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("", SSDP_PORT))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                             struct.pack("4s4s", socket.inet_aton(SSDP_ADDRESS), socket.inet_aton("0.0.0.0")))
+        super().__init__(name="SSDPResponder", daemon=True)
+
+    def run(self):
+        while True:
+            data, sender = self.sock.recvfrom(2048)
+            if not data.startswith(b"M-SEARCH"):
+                continue
+            headers = {}
+            for line in data.decode(errors="replace").split("\r\n")[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            search_target = headers.get("st")
+            for server in self.servers:
+                if search_target not in ("ssdp:all", server.search_target):
+                    continue
+                if self.loss and random.random() < self.loss:
+                    continue
+                response = (
+                    "HTTP/1.1 200 OK\r\n"
+                    "CACHE-CONTROL: max-age=1800\r\n"
+                    "EXT:\r\n"
+                    f"LOCATION: {server.location}\r\n"
+                    f"SERVER: {server.server_header}\r\n"
+                    f"ST: {server.search_target}\r\n"
+                    f"USN: uuid:simulated-{server.host}-{server.port}::{server.search_target}\r\n"
+                    "\r\n"
+                )
+                self.sock.sendto(response.encode(), sender)
+
+
+def start_cameras(lumix=0, sony=0, distinct_hosts=False, lumix_port=0, **camera_args):
+    """
+    Starts simulated cameras. With distinct_hosts, every camera gets its own loopback address (127.0.1.x), which
+    allows serving the Lumix API on port 80 as expected by LumixCameraControl's discovery.
+    """
+    servers = []
+    for i in range(lumix + sony):
+        host = f"127.0.1.{i + 1}" if distinct_hosts else "127.0.0.1"
+        if i < lumix:
+            servers.append(SimulatedLumix(host, lumix_port, name=f"DMC-G81 #{i + 1}", **camera_args))
+        else:
+            servers.append(SimulatedSony(host, 0, name=f"ILCE-7M3 #{i + 1 - lumix}", **camera_args))
+    return servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Lumix and Sony cameras")
+    parser.add_argument("--lumix", type=int, default=1, help="number of simulated Lumix cameras")
+    parser.add_argument("--sony", type=int, default=0, help="number of simulated Sony cameras")
+    parser.add_argument("--cutoff", type=float, default=1800, help="seconds after which a recording stops by itself")
+    parser.add_argument("--save-time", type=float, default=1.0, help="seconds the camera is busy after a recording")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of latency added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random seconds added to the latency")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability of a lost packet per request")
+    parser.add_argument("--stall", type=float, default=0.0, help="probability that a request is answered very late")
+    parser.add_argument("--stall-time", type=float, default=30.0, help="seconds a stalled request is delayed")
+    parser.add_argument("--distinct-hosts", action="store_true", help="give every camera its own loopback address")
+    parser.add_argument("--lumix-port", type=int, default=0,
+                        help="port for the Lumix API, use 80 together with --distinct-hosts for SSDP discovery")
+    parser.add_argument("--ssdp", action="store_true", help="answer SSDP M-SEARCH requests")
+    args = parser.parse_args()
+
+    servers = start_cameras(args.lumix, args.sony, args.distinct_hosts, args.lumix_port, cutoff=args.cutoff,
+                            save_time=args.save_time, latency=args.latency, jitter=args.jitter, loss=args.loss,
+                            stall=args.stall, stall_time=args.stall_time)
+    if args.ssdp:
+        SSDPResponder(servers, loss=args.loss).start()
+    print(json.dumps([{"type": type(server).__name__, "address": server.address} for server in servers]), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,107 @@
+import collections
+import dataclasses
 import json
+import threading
+import time
 from urllib.parse import urlparse
 import datetime as dt
 
-import requests
 import logging
 from ssdpy import SSDPClient
 
+from typing import Dict, Optional
+
 from camera_control import CameraControl, CameraState
+from camera_control.http import CameraSession
+from camera_control.liveview import SonyLiveView
 import xml.etree.ElementTree as ET
 
-logging.basicConfig(level=logging.DEBUG)
-
 logger = logging.getLogger(__name__)
 
+RECORDING_STATUSES = ["MovieWaitRecStart", "MovieRecording", "MovieWaitRecStop", "MovieSaving"]
+SAVING_STATUSES = ["MovieWaitRecStop", "MovieSaving"]
+
+ERROR_TIMEOUT = 2
+
+# (connect, read) timeout for getEvent long-polling, which the camera only answers once something has changed
+LONG_POLL_TIMEOUT = (3.05, 75)
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceDescriptor:
+    """
+    Information from the camera's UPnP device description needed to use its API
+    """
+    name: str
+    api_version: str
+    api_service_urls: Dict[str, str]
+    fetched_at: float
+
+
+class DescriptorCache:
+    """
+    Device descriptors keyed by their location URL, so that reconnecting to a camera does not need to download and
+    parse the device description again. Entries expire after max_age seconds, the least recently used entries are
+    evicted once the cache is full.
+    """
+
+    def __init__(self, max_size=16, max_age=12 * 3600):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url) -> Optional[DeviceDescriptor]:
+        with self._lock:
+            descriptor = self._entries.get(url)
+            if descriptor is None:
+                return None
+            if time.monotonic() - descriptor.fetched_at > self.max_age:
+                del self._entries[url]
+                return None
+            self._entries.move_to_end(url)
+            return descriptor
+
+    def put(self, url, descriptor: DeviceDescriptor):
+        with self._lock:
+            self._entries[url] = descriptor
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict(self, url):
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def export(self) -> dict:
+        """
+        The cached descriptors as JSON compatible data. The monotonic fetch times are converted to wall clock time.
+        """
+        offset = time.time() - time.monotonic()
+        with self._lock:
+            return {
+                url: {**dataclasses.asdict(descriptor), "fetched_at": round(descriptor.fetched_at + offset)}
+                for url, descriptor in self._entries.items()
+            }
+
+    def load(self, data: dict):
+        """
+        Adds the descriptors returned by export, unless they have expired in the meantime
+        """
+        offset = time.time() - time.monotonic()
+        for url, entry in data.items():
+            try:
+                descriptor = DeviceDescriptor(entry["name"], entry["api_version"], dict(entry["api_service_urls"]),
+                                              entry["fetched_at"] - offset)
+            except (KeyError, TypeError):
+                logger.warning(f"ignoring invalid cached device descriptor for {url}")
+                continue
+            if time.monotonic() - descriptor.fetched_at <= self.max_age:
+                self.put(url, descriptor)
+
+
+descriptor_cache = DescriptorCache()
+
 
 def _parse_list(data):
     return data.decode("utf-8").strip().split("\n")
@@ -27,18 +116,29 @@ class SonyCameraControl(CameraControl):
     API from https://developer.sony.com/develop/cameras/
     Python implementation based on https://github.com/petabite/libsonyapi
     """
+    ssdp_search_target = 'urn:schemas-sony-com:service:ScalarWebAPI:1'
+    supports_events = True
+    supports_liveview = True
+    # reconnecting only takes a single request once the device descriptor is cached
+    reconnect_delay = 1
+
     def __init__(self, cam_url):
         self.cam_url = cam_url
         self.name = None
+        self._session = CameraSession()
+        self._camera_status = None
+        self._recording_time = -1
+        self._recording_time_at = 0
 
     @classmethod
     def discover(cls, iface="wlan0"):
         client = SSDPClient(iface=iface.encode("utf-8"))
-        devices = client.m_search('urn:schemas-sony-com:service:ScalarWebAPI:1')
+        devices = client.m_search(cls.ssdp_search_target)
         urls = []
         for device in devices:
-            cam_url = device["location"]
-            urls.append(cam_url)
+            cam_url = cls.address_from_ssdp(device)
+            if cam_url is not None:
+                urls.append(cam_url)
         return urls
 
         # subprocess.run(["wpa_cli", "-i", "wlan0", "p2p_find", "10"], capture_output=True, check=True)
@@ -53,25 +153,58 @@ class SonyCameraControl(CameraControl):
         #     print(info["oper_ssid"])
         # return result
 
+    @classmethod
+    def address_from_ssdp(cls, headers):
+        # M-SEARCH responses carry the search target in ST, NOTIFY announcements in NT
+        if headers.get("st", headers.get("nt")) == cls.ssdp_search_target:
+            return headers.get("location")
+        return None
+
+    @classmethod
+    def export_cache(cls):
+        return {"descriptors": descriptor_cache.export()}
+
+    @classmethod
+    def import_cache(cls, data):
+        descriptor_cache.load(data.get("descriptors", {}))
+
     def __enter__(self):
         #status = subprocess.run(["wpa_cli", "-i", "wlan0", "p2p_connect", self.cam_mac, "pbc", "join"], capture_output=True, check=True).stdout
         #if status != "OK\n":
         #    raise IOError(f"Failed to connect to camera on {self.cam_mac}")
 
-        device_xml_request = requests.get(self.cam_url)
+        descriptor = descriptor_cache.get(self.cam_url)
+        if descriptor is not None:
+            self._use_descriptor(descriptor)
+            # validate the cached descriptor with a single cheap request
+            try:
+                if self._post_request("getVersions") is not None:
+                    return self
+            except (IOError, ValueError):
+                pass
+            logger.info(f"cached device descriptor for {self.cam_url} is no longer valid")
+            descriptor_cache.evict(self.cam_url)
+
+        descriptor = self._fetch_descriptor()
+        descriptor_cache.put(self.cam_url, descriptor)
+        self._use_descriptor(descriptor)
+        return self
+
+    def _fetch_descriptor(self) -> DeviceDescriptor:
+        device_xml_request = self._session.get(self.cam_url)
         xml_file = str(device_xml_request.content.decode())
         xml = ET.fromstring(xml_file)
-        self.name = xml.find(
+        name = xml.find(
             "{urn:schemas-upnp-org:device-1-0}device/{urn:schemas-upnp-org:device-1-0}friendlyName"
         ).text
-        self.name += " (" + urlparse(self.cam_url).netloc.split(':')[0] + ")"
-        self.api_version = xml.find(
+        name += " (" + urlparse(self.cam_url).netloc.split(':')[0] + ")"
+        api_version = xml.find(
             "{urn:schemas-upnp-org:device-1-0}device/{urn:schemas-sony-com:av}X_ScalarWebAPI_DeviceInfo/{urn:schemas-sony-com:av}X_ScalarWebAPI_Version"
         ).text
         service_list = xml.find(
             "{urn:schemas-upnp-org:device-1-0}device/{urn:schemas-sony-com:av}X_ScalarWebAPI_DeviceInfo/{urn:schemas-sony-com:av}X_ScalarWebAPI_ServiceList"
         )
-        self.api_service_urls = {}
+        api_service_urls = {}
         for service in service_list:
             service_type = service.find(
                 "{urn:schemas-sony-com:av}X_ScalarWebAPI_ServiceType"
@@ -79,40 +212,89 @@ class SonyCameraControl(CameraControl):
             action_url = service.find(
                 "{urn:schemas-sony-com:av}X_ScalarWebAPI_ActionList_URL"
             ).text
-            self.api_service_urls[service_type] = action_url
-        return self
+            api_service_urls[service_type] = action_url
+        return DeviceDescriptor(name, api_version, api_service_urls, time.monotonic())
+
+    def _use_descriptor(self, descriptor: DeviceDescriptor):
+        self.name = descriptor.name
+        self.api_version = descriptor.api_version
+        self.api_service_urls = dict(descriptor.api_service_urls)
 
     def prepare(self):
         pass
 
-    def get_state(self) -> CameraState:
-        result = self._post_request("getEvent", False, version="1.2")["result"]
-        camera_status = result[1]["cameraStatus"]
-        recording = camera_status in ["MovieWaitRecStart", "MovieRecording", "MovieWaitRecStop", "MovieSaving"]
+    def get_state(self, wait=False) -> CameraState:
+        """
+        With wait=True, uses getEvent long-polling: the camera only answers once its state has changed (or the
+        camera's polling timeout has passed). Fields that have not changed are missing from long-poll responses, so
+        the last known values are kept.
+        """
+        response = self._post("getEvent", wait, version="1.2", timeout=LONG_POLL_TIMEOUT if wait else None)
+        if "error" in response:
+            # only the long-poll timeout means that nothing has changed. Any other error, e.g. "Already polling" while
+            # the long-poll of a previous connection is still open, must not be retried right away.
+            if not wait or response["error"][0] != ERROR_TIMEOUT:
+                raise IOError(f"getEvent failed for {self.cam_url}: {response['error']}")
+            logger.debug(response)
+        else:
+            result = response["result"]
+            if result[1]:
+                self._camera_status = result[1]["cameraStatus"]
+            if len(result) > 57 and result[57]:
+                self._recording_time = result[57]["recordingTime"]
+                self._recording_time_at = time.monotonic()
+        recording = self._camera_status in RECORDING_STATUSES
 
-        recording_time = result[57]["recordingTime"]
-        time = dt.timedelta(minutes=30) - dt.timedelta(seconds=recording_time) if recording_time >= 0 else dt.timedelta(minutes=30)
-        return CameraState(recording, time)
+        recording_time = self._recording_time
+        if recording and recording_time >= 0:
+            # the recording time is not necessarily reported on every event, so extrapolate it
+            recording_time += int(time.monotonic() - self._recording_time_at)
+        remaining = dt.timedelta(minutes=30) - dt.timedelta(seconds=recording_time) if recording_time >= 0 else dt.timedelta(minutes=30)
+        return CameraState(recording, remaining, saving=self._camera_status in SAVING_STATUSES)
 
     def video_record_start(self):
-        self._post_request("startMovieRec")
+        return self._post_request("startMovieRec") is not None
 
     def video_record_stop(self):
         self._post_request("stopMovieRec")
 
-    def _post_request(self, method, *params, version="1.0"):
+    def create_liveview(self):
+        return SonyLiveView(self)
+
+    def start_liveview(self):
         """
-        sends post request to url with method and param as json
+        Returns the URL of the live view stream
         """
-        url = self.api_service_urls["camera"] + "/camera"
-        json_request = {"method": method, "params": params, "id": 1, "version": version}
-        request = requests.post(url, json.dumps(json_request))
-        response = json.loads(request.content)
+        response = self._post_request("startLiveview")
+        if response is None:
+            raise IOError(f"startLiveview failed for {self.cam_url}")
+        return response["result"][0]
+
+    def stop_liveview(self):
+        self._post_request("stopLiveview")
+
+    def _post_request(self, method, *params, version="1.0", timeout=None):
+        """
+        sends post request to url with method and param as json, returns None if the camera answered with an error
+        """
+        response = self._post(method, *params, version=version, timeout=timeout)
         if "error" in list(response.keys()):
             logger.error("Error: ")
             logger.error(response)
         else:
             return response
 
+    def _post(self, method, *params, version="1.0", timeout=None) -> dict:
+        """
+        sends post request to url with method and param as json, returns the response including any error
+        """
+        url = self.api_service_urls["camera"] + "/camera"
+        json_request = {"method": method, "params": params, "id": 1, "version": version}
+        request = self._session.post(url, json.dumps(json_request), timeout=timeout)
+        return json.loads(request.content)
+
+    def connection_stats(self):
+        return self._session.stats()
+
     def __exit__(self, *args):
         pass
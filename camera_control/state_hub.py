@@ -0,0 +1,104 @@
+import dataclasses
+import functools
+import json
+import threading
+import time
+
+
+@dataclasses.dataclass(frozen=True)
+class Snapshot:
+    """
+    The state shown in the web UI at one version. A change creates a new snapshot instead of modifying the current
+    one, so snapshots can be used without holding a lock. Their camera fields must not be modified either.
+    """
+    version: int
+    should_record: bool
+    cameras: dict
+
+    @functools.cached_property
+    def body(self) -> str:
+        """
+        The snapshot as served by /get_state, serialized once for all clients
+        """
+        return json.dumps({"version": self.version, "should_record": self.should_record, "cameras": self.cameras})
+
+
+class StateHub:
+    """
+    Collects the state shown in the web UI as it is published by the camera workers, and lets clients wait for changes.
+
+    Cameras are keyed by their display name, like in /get_state. Every change increments the version. Versions start
+    at the time the hub was created in milliseconds, so that clients don't mistake the state after a restart of the
+    web UI for one they have already seen.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._snapshot = Snapshot(int(time.time() * 1000), False, {})
+        # worker address -> display name, to notice when a camera is renamed after connecting
+        self._keys = {}
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def set_should_record(self, should_record):
+        with self._cond:
+            if should_record != self._snapshot.should_record:
+                self._changed(should_record=should_record)
+
+    def update_camera(self, address, key, fields: dict):
+        with self._cond:
+            old_key = self._keys.get(address)
+            if old_key == key and self._snapshot.cameras.get(key) == fields:
+                return
+            cameras = dict(self._snapshot.cameras)
+            if old_key is not None and old_key != key:
+                del cameras[old_key]
+            self._keys[address] = key
+            cameras[key] = fields
+            self._changed(cameras=cameras)
+
+    def remove_camera(self, address):
+        with self._cond:
+            key = self._keys.pop(address, None)
+            if key is not None:
+                cameras = dict(self._snapshot.cameras)
+                del cameras[key]
+                self._changed(cameras=cameras)
+
+    def addresses(self):
+        with self._cond:
+            return list(self._keys)
+
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    def wait(self, version, timeout) -> Snapshot:
+        """
+        Waits until the version differs from the given one and returns the new snapshot, or None on timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._snapshot.version != version, timeout):
+                return None
+            return self._snapshot
+
+    def _changed(self, **changes):
+        self._snapshot = dataclasses.replace(self._snapshot, version=self._snapshot.version + 1, **changes)
+        self._cond.notify_all()
+
+
+def diff_cameras(old: dict, new: dict):
+    """
+    Per-camera fields that have changed between two snapshots. Removed cameras map to None.
+    """
+    changes = {}
+    for key, fields in new.items():
+        old_fields = old.get(key, {})
+        changed = {name: value for name, value in fields.items() if name not in old_fields or old_fields[name] != value}
+        if changed:
+            changes[key] = changed
+    for key in old:
+        if key not in new:
+            changes[key] = None
+    return changes
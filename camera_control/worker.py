@@ -0,0 +1,577 @@
+import collections
+import datetime as dt
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from . import CameraState, metrics
+from .deadline import DeadlineExceeded, deadline, hedged
+from .history import StateHistory
+
+logger = logging.getLogger(__name__)
+
+RESTART = "restart"
+START = "start"
+STOP = "stop"
+STOP_FOR_RESTART = "stop_for_restart"
+
+# restart the recording when less than this much time is remaining
+RESTART_MARGIN = dt.timedelta(seconds=10)
+POLL_INTERVAL = 1
+# polling interval close to a restart and while waiting for the camera to be ready again
+MIN_POLL_INTERVAL = 0.2
+# time the camera is given to report that it has started recording before the start command is repeated
+START_GRACE = 1
+# in event mode, the state is still refreshed after this many seconds without any event
+EVENT_REFRESH_INTERVAL = 10
+# upper limit for the exponential backoff between reconnection attempts
+MAX_RECONNECT_DELAY = 60
+# seconds a camera API call may take in total, including hedged and retried requests
+CALL_DEADLINES = {"get_state": 6, "video_record_start": 5, "video_record_stop": 5, "prepare": 15, "apply_settings": 30}
+DEFAULT_CALL_DEADLINE = 10
+# a state read that has taken HEDGE_FACTOR times as long as the recent ones is sent again in parallel
+HEDGE_FACTOR = 3
+MIN_HEDGE_DELAY = 0.25
+READ_ATTEMPTS = 2
+
+
+class RestartPolicy:
+    """
+    Decides when a camera's recording needs to be (re)started or stopped, based on the state reported by the camera
+    and whether the user wants to record.
+
+    For cameras that report whether they are recording, a restart is split into stopping the recording and starting
+    it again as soon as the camera reports that it has stopped, and the time at which the remaining time runs out is
+    predicted from its trend so that the camera can be polled more often shortly before. The gap between the last
+    state seen recording and the first state seen recording again is measured for every restart.
+    """
+
+    def __init__(self, on_gap=None):
+        self.gaps = collections.deque(maxlen=100)
+        self._on_gap = on_gap
+        self.reset()
+
+    def reset(self):
+        # remaining time of the previously observed state
+        self.prev_remaining = dt.timedelta(hours=99)
+        self._remaining = dt.timedelta(hours=99)
+        self.started = False
+        # a restart is in progress: the recording was stopped (or stopped by itself) and has not been seen again yet
+        self.restarting = False
+        # the recording is to be restarted before its time runs out, see request_restart
+        self.restart_requested = False
+        self._start_sent_at = None
+        # (monotonic time, remaining seconds) while recording
+        self._samples = collections.deque(maxlen=10)
+        self._last_recording_at = None
+        self._gap_started_at = None
+        self._last_observed = None
+
+    def predicted_remaining(self, now) -> Optional[dt.timedelta]:
+        """
+        Remaining time extrapolated from the trend of the last reported values
+        """
+        if not self._samples:
+            return None
+        t_last, r_last = self._samples[-1]
+        slope = -1.0
+        if len(self._samples) >= 3:
+            t_mean = sum(t for t, r in self._samples) / len(self._samples)
+            r_mean = sum(r for t, r in self._samples) / len(self._samples)
+            var = sum((t - t_mean) ** 2 for t, r in self._samples)
+            if var > 0:
+                fitted = sum((t - t_mean) * (r - r_mean) for t, r in self._samples) / var
+                # the remaining time is reported in whole seconds, so only trust plausible fits
+                if -2 < fitted < -0.5:
+                    slope = fitted
+        return dt.timedelta(seconds=max(r_last + slope * (now - t_last), 0))
+
+    def time_to_restart(self, now) -> Optional[float]:
+        """
+        Seconds until the predicted remaining time drops below the restart margin
+        """
+        remaining = self.predicted_remaining(now)
+        if remaining is None:
+            return None
+        return max((remaining - RESTART_MARGIN).total_seconds(), 0)
+
+    def next_poll_interval(self, now):
+        if self.restarting:
+            return MIN_POLL_INTERVAL
+        time_to_restart = self.time_to_restart(now)
+        if time_to_restart is None:
+            return POLL_INTERVAL
+        return min(POLL_INTERVAL, max(MIN_POLL_INTERVAL, time_to_restart / 2))
+
+    def decide(self, cam_state: CameraState, should_record: bool, now) -> Optional[str]:
+        if should_record:
+            if cam_state.recording is not None:
+                if not cam_state.recording:
+                    if self._start_sent_at is not None and now - self._start_sent_at < START_GRACE:
+                        return None
+                    return START
+                if self.restarting:
+                    # stop has been sent, waiting for the camera to finish
+                    return None
+                if self.restart_requested:
+                    return STOP_FOR_RESTART
+                remaining = self.predicted_remaining(now)
+                if remaining is None:
+                    remaining = cam_state.remaining
+                # restart if less than 10s remaining
+                if remaining is not None and remaining < RESTART_MARGIN:
+                    return STOP_FOR_RESTART
+            elif cam_state.remaining is not None:
+                # restart if recording has not yet been started or remaining time has increased significantly
+                if cam_state.remaining > self.prev_remaining + dt.timedelta(minutes=1) or not self.started:
+                    return RESTART
+        elif (cam_state.recording and not cam_state.saving) or self.started:
+            return STOP
+        return None
+
+    def request_restart(self):
+        """
+        Restarts the recording on the next decision, regardless of the remaining time, e.g. to stagger the restarts
+        of several cameras
+        """
+        self.restart_requested = True
+
+    def on_start_sent(self, now, accepted=True):
+        self.started = True
+        # if the camera was busy, the start is sent again on the next poll
+        self._start_sent_at = now if accepted else None
+
+    def on_stop_sent(self, now, restart):
+        self.restart_requested = False
+        if restart:
+            if self._last_recording_at is not None:
+                self.restarting = True
+                self._open_gap()
+        else:
+            self.started = False
+            self.restarting = False
+            self._gap_started_at = None
+        self._start_sent_at = None
+
+    def observe(self, cam_state: CameraState, now):
+        if cam_state is self._last_observed:
+            # the same state can be acted upon more than once, e.g. by App's record fan-out
+            return
+        self._last_observed = cam_state
+        self.prev_remaining, self._remaining = self._remaining, cam_state.remaining
+        if cam_state.recording:
+            if self._gap_started_at is not None:
+                gap = now - self._gap_started_at
+                self.gaps.append(gap)
+                logger.info(f"recording gap of {gap:.1f}s")
+                if self._on_gap is not None:
+                    self._on_gap(gap)
+                self._gap_started_at = None
+            self.restarting = False
+            self._start_sent_at = None
+            if cam_state.remaining is not None:
+                if self._samples and cam_state.remaining.total_seconds() > self._samples[-1][1] + 1:
+                    # a new clip has been started
+                    self._samples.clear()
+                self._samples.append((now, cam_state.remaining.total_seconds()))
+            self._last_recording_at = now
+        elif cam_state.recording is False and self.started and self._last_recording_at is not None:
+            # the recording has stopped, either by itself or because of a restart
+            self.restarting = True
+            self._open_gap()
+            self._samples.clear()
+
+    def _open_gap(self):
+        # the camera stopped recording at some point after it was last seen recording
+        if self._gap_started_at is None:
+            self._gap_started_at = self._last_recording_at
+
+    def gap_stats(self):
+        return {
+            "restarts": len(self.gaps),
+            "last_gap": self.gaps[-1] if self.gaps else None,
+            "mean_gap": sum(self.gaps) / len(self.gaps) if self.gaps else None,
+            "max_gap": max(self.gaps) if self.gaps else None,
+        }
+
+
+class CameraWorker:
+    """
+    State shared by the threaded and the asyncio camera workers, as read by the web UI
+    """
+
+    def __init__(self, app, ip, type):
+        self.ip = ip
+        self.camera_type = type
+        self._control = type(ip)
+
+        self.connected = False
+        self.cam_state: Optional[CameraState] = None
+        self.cam_name = None
+        self._app = app
+        self._policy = RestartPolicy(on_gap=self._observe_gap)
+        # use event notifications from the camera instead of polling once per second
+        self._use_events = app.use_events and self._control.supports_events
+        # serializes start/stop commands from the worker itself and from App's record fan-out
+        self._command_lock = threading.Lock()
+        self._stopped = False
+        self.last_connected_at = None
+        # failed connection attempts, in total and since the last successful connection
+        self.retries = 0
+        self.consecutive_failures = 0
+        self._liveview = None
+        self._liveview_lock = threading.Lock()
+        # serializes settings profiles applied on connect and from the web UI, which share the known settings cache
+        self._settings_lock = threading.Lock()
+        self.history = StateHistory(spill_path=app.history_path(ip))
+        # durations of the recent successful state reads, to decide when to hedge
+        self._read_seconds = collections.deque(maxlen=20)
+        # runs the attempts of hedged state reads. A camera of its own, so that the attempts a stalled camera leaves
+        # behind until their deadline only delay this camera's reads.
+        self._read_executor = ThreadPoolExecutor(max_workers=READ_ATTEMPTS, thread_name_prefix=f"read({ip})")
+        # incremented whenever a connection ends, so that the event listener of an old connection stops
+        self._connection = 0
+        self._listener = None
+        # (connection, error) that ended the event listener
+        self._event_error = None
+
+    def stop(self):
+        """
+        Stops controlling the camera, e.g. when it has been evicted from the registry
+        """
+        self._stopped = True
+        self.wake()
+        self.history.flush()
+        self._read_executor.shutdown(wait=False, cancel_futures=True)
+
+    def connection_stats(self):
+        return self._control.connection_stats()
+
+    def public_fields(self):
+        """
+        Camera state as shown in the web UI
+        """
+        return {
+            "connected": self.connected,
+            "rec": self.cam_state.recording if self.cam_state is not None else None,
+            "remaining": self.cam_state.remaining.total_seconds() if self.cam_state is not None and self.cam_state.remaining is not None else None,
+            "liveview": self._control.supports_liveview,
+        }
+
+    def apply_settings(self, profile, refresh=False):
+        """
+        Applies a settings profile and returns the names of the changed settings, or None if the camera does not
+        support settings
+        """
+        if not self._control.supports_settings:
+            return None
+        if not self.connected:
+            raise IOError(f"camera {self.ip} is not connected")
+        with self._settings_lock:
+            return self._call("apply_settings", self._control.apply_settings, profile, refresh)
+
+    def _apply_settings_on_connect(self):
+        """
+        Applies App's settings profile after connecting, unless the camera is already recording, as the settings cannot
+        be changed during a recording anyway
+        """
+        profile = self._app.settings_profile
+        if not profile or not self._control.supports_settings or self.cam_state is None or self.cam_state.recording:
+            return
+        try:
+            changed = self.apply_settings(profile)
+            if changed:
+                logger.info(f"changed settings of {self.ip}: {changed}")
+        except Exception:
+            logger.warning(f"applying settings to {self.ip} failed", exc_info=True)
+
+    def liveview(self):
+        """
+        The camera's live view, started on demand and shared by all clients, or None if the camera does not support it
+        """
+        if not self._control.supports_liveview:
+            return None
+        with self._liveview_lock:
+            if self._liveview is None or self._liveview.stopped:
+                self._liveview = self._control.create_liveview()
+                self._liveview.start()
+            return self._liveview
+
+    def apply_record(self, should_record):
+        """
+        Immediately issues the command required by a change of App.should_record, based on the last known state.
+        Returns the (sent, acknowledged) monotonic times of the command, or None if no command was needed.
+        """
+        if not self.connected or self.cam_state is None:
+            return None
+        cam_state = self.cam_state
+        if should_record and cam_state.recording and not self._policy.started:
+            # the camera has been told to stop since its state was read, so it would only be started on the next poll
+            cam_state = self.cam_state = self._read_state()
+        return self._act(cam_state, should_record)
+
+    def _act(self, cam_state, should_record):
+        with self._command_lock:
+            now = time.monotonic()
+            timing = None
+            self._policy.observe(cam_state, now)
+            action = self._policy.decide(cam_state, should_record, now)
+            if action in (RESTART, STOP_FOR_RESTART):
+                logger.info('restarting recording for {}'.format(self.ip))
+                self.history.add_event(time.time(), "restart")
+                self._stop_recording()
+                self._policy.on_stop_sent(now, restart=True)
+                if action == STOP_FOR_RESTART:
+                    self._confirm("video_record_stop", recording=False)
+            if action in (RESTART, START):
+                if action == START:
+                    logger.info('starting recording for {}'.format(self.ip))
+                sent = time.monotonic()
+                accepted = self._call("video_record_start", self._control.video_record_start)
+                timing = sent, time.monotonic()
+                if action == START and accepted is not False:
+                    self.history.add_event(time.time(), "start")
+                self._policy.on_start_sent(sent, accepted is not False)
+                if accepted is not False:
+                    self._confirm("video_record_start", recording=True)
+            elif action == STOP:
+                logger.info('stopping recording for {}'.format(self.ip))
+                self.history.add_event(time.time(), "stop")
+                sent = time.monotonic()
+                self._stop_recording()
+                timing = sent, time.monotonic()
+                self._policy.on_stop_sent(sent, restart=False)
+                self._confirm("video_record_stop", recording=False)
+            return timing
+
+    def _stop_recording(self):
+        """
+        Sends the stop command. A failure is only logged, as the state read confirming the command shows whether the
+        camera has stopped nevertheless.
+        """
+        start = time.monotonic()
+        try:
+            self._call("video_record_stop", self._control.video_record_stop)
+        except Exception as e:
+            logger.warning(f"stopping recording for {self.ip} failed after {time.monotonic() - start:.2f}s: {e}")
+
+    def _confirm(self, command, recording):
+        """
+        Reads the state right after a start or stop command, so that it is not taken for granted until the next poll.
+        A command that the camera does not reflect yet is repeated by the policy once the camera has had time for it.
+        """
+        if self.cam_state is None or self.cam_state.recording is None:
+            # the camera does not report whether it is recording
+            return
+        cam_state = self.cam_state = self._read_state()
+        if recording:
+            confirmed = cam_state.recording
+        else:
+            confirmed = not cam_state.recording or cam_state.saving
+        if not confirmed:
+            logger.info(f"{command} not confirmed yet by {self.ip}")
+            metrics.camera_unconfirmed_commands_total.inc(self.ip, command)
+
+    def restart_stats(self):
+        return self._policy.gap_stats()
+
+    def is_recording(self):
+        """
+        True if the camera is connected and recording, and no restart of the recording is in progress or requested
+        """
+        return (self.connected and self.cam_state is not None and bool(self.cam_state.recording)
+                and not self.cam_state.saving and not self._policy.restarting and not self._policy.restart_requested)
+
+    def time_to_restart(self, now) -> Optional[float]:
+        """
+        Seconds until the recording will be restarted because its time runs out, or None if unknown
+        """
+        return self._policy.time_to_restart(now)
+
+    def request_restart(self, early_by):
+        """
+        Restarts the recording now, the given seconds before its time runs out
+        """
+        self.history.add_event(time.time(), "early_restart", seconds=round(early_by, 1))
+        self._policy.request_restart()
+        self.wake()
+
+    def _call(self, call, func, *args):
+        """
+        Calls the camera within the call's deadline
+        """
+        start = time.monotonic()
+        try:
+            with deadline(CALL_DEADLINES.get(call, DEFAULT_CALL_DEADLINE)):
+                return func(*args)
+        except DeadlineExceeded:
+            metrics.camera_deadline_exceeded_total.inc(self.ip, call)
+            raise
+        finally:
+            metrics.camera_request_seconds.observe(time.monotonic() - start, self.ip, call)
+
+    def _read_state(self) -> CameraState:
+        """
+        Reads the camera state, hedging the request if the camera takes longer than usual, and retrying it if it fails,
+        within the deadline of get_state
+        """
+        if self._read_seconds:
+            usual = sorted(self._read_seconds)[len(self._read_seconds) // 2]
+            hedge_after = max(HEDGE_FACTOR * usual, MIN_HEDGE_DELAY)
+        else:
+            hedge_after = CALL_DEADLINES["get_state"] / READ_ATTEMPTS
+        start = time.monotonic()
+        cam_state = self._call("get_state", hedged, self._control.get_state, hedge_after, self._read_executor,
+                               READ_ATTEMPTS, lambda: metrics.camera_read_attempts_total.inc(self.ip))
+        self._read_seconds.append(time.monotonic() - start)
+        return cam_state
+
+    def _observe_gap(self, gap):
+        metrics.restart_gap_seconds.observe(gap, self.ip)
+        self.history.add_event(time.time(), "gap", seconds=round(gap, 3))
+
+    def _observe_poll_delay(self, timeout, waited):
+        metrics.poll_jitter_seconds.observe(max(waited - timeout, 0), self.ip)
+
+    def _publish(self):
+        if not self._stopped:
+            fields = self.public_fields()
+            self.history.append(time.time(), fields["rec"], fields["remaining"], self.connected)
+            self._app.publish_camera(self)
+
+    def _on_connected(self):
+        self.connected = True
+        self.cam_name = self._control.name
+        self.last_connected_at = time.monotonic()
+        self.consecutive_failures = 0
+        self._publish()
+        self.history.add_event(time.time(), "connected")
+        logger.debug("Camera %s connected", self.cam_name)
+
+    def _on_connection_failed(self, exc):
+        """
+        Returns the time to wait before reconnecting
+        """
+        if self.connected:
+            self.last_connected_at = time.monotonic()
+        self.connected = False
+        self._publish()
+        self.retries += 1
+        self.consecutive_failures += 1
+        metrics.reconnects_total.inc(self.ip)
+        if self.consecutive_failures == 1:
+            self.history.add_event(time.time(), "disconnected", reason=str(exc))
+            logger.warning(f"Camera {self.cam_name or self.ip} disconnected: {exc}")
+            logger.debug("disconnected because of", exc_info=exc)
+        else:
+            logger.debug("Camera %s still not reachable: %s", self.cam_name or self.ip, exc)
+        delay = min(self._control.reconnect_delay * 2 ** (self.consecutive_failures - 1), MAX_RECONNECT_DELAY)
+        # randomize, so that cameras which dropped out together don't retry in lockstep
+        return random.uniform(delay / 2, delay)
+
+    def wake(self):
+        """
+        Makes the worker re-evaluate the camera state immediately, e.g. when the user has started recording
+        """
+        raise NotImplementedError
+
+    def on_seen(self):
+        """
+        Called when discovery sees the camera. If it is disconnected, e.g. after its battery was swapped, it is
+        reconnected right away instead of after the backoff, which grows up to MAX_RECONNECT_DELAY.
+        """
+        if not self.connected:
+            self.consecutive_failures = 0
+            self.wake()
+
+    def _start_listener(self):
+        """
+        Starts listening for events of the current connection on a thread of its own
+        """
+        self._listener = threading.Thread(target=self._listen_events, args=(self._connection, self._listener),
+                                          name=f"{self.camera_type.__name__}({self.ip})-events", daemon=True)
+        self._listener.start()
+
+    def _listen_events(self, connection, previous):
+        # the camera only answers one long-poll at a time, so wait until the listener of the previous connection has
+        # returned from its last one
+        if previous is not None:
+            previous.join()
+        while self._connection == connection:
+            try:
+                cam_state = self._control.get_state(wait=True)
+            except Exception as e:
+                self._event_error = connection, e
+                self.wake()
+                return
+            if self._connection == connection and cam_state != self.cam_state:
+                self.cam_state = cam_state
+                self.wake()
+
+    def _check_listener(self):
+        """
+        Re-raises the error that ended the event listener of the current connection
+        """
+        if self._event_error is not None and self._event_error[0] == self._connection:
+            raise self._event_error[1]
+
+    def _wait_timeout(self):
+        now = time.monotonic()
+        if not self._use_events:
+            return self._policy.next_poll_interval(now)
+        # state changes arrive as events, but a restart shortly before the time limit still has to be timed
+        timeout = EVENT_REFRESH_INTERVAL
+        if self._policy.restarting:
+            timeout = POLL_INTERVAL
+        time_to_restart = self._policy.time_to_restart(now)
+        if time_to_restart is not None:
+            timeout = min(timeout, max(time_to_restart, MIN_POLL_INTERVAL))
+        return timeout
+
+
+class CameraControlThread(CameraWorker, threading.Thread):
+    def __init__(self, app, ip, type):
+        CameraWorker.__init__(self, app, ip, type)
+        threading.Thread.__init__(self, name=f"{type.__name__}({ip})", daemon=True)
+        self._wakeup = threading.Event()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run(self):
+        logger.info(f"Camera control starting for {self.ip}")
+        while not self._stopped:
+            self.connected = False
+            try:
+                with self._control:
+                    self._on_connected()
+
+                    self._call("prepare", self._control.prepare)
+
+                    self._policy.reset()
+                    self.cam_state = self._read_state()
+                    self._apply_settings_on_connect()
+                    if self._use_events:
+                        self._start_listener()
+                    while not self._stopped:
+                        self._act(self.cam_state, self._app.should_record)
+                        self._publish()
+
+                        timeout = self._wait_timeout()
+                        waiting_since = time.monotonic()
+                        woken = self._wakeup.wait(timeout)
+                        self._wakeup.clear()
+                        if not woken:
+                            self._observe_poll_delay(timeout, time.monotonic() - waiting_since)
+                        self._check_listener()
+                        if not self._use_events or not woken:
+                            self.cam_state = self._read_state()
+            except Exception as e:
+                self._connection += 1
+                self._wakeup.wait(self._on_connection_failed(e))
+                self._wakeup.clear()
+        self._connection += 1
+        logger.info(f"Camera control stopped for {self.ip}")
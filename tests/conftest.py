@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import camera_control from the checkout, like the benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from camera_control.deadline import DeadlineExceeded, deadline, hedged, remaining
+
+executor = ThreadPoolExecutor(max_workers=2)
+
+
+class Calls:
+    """
+    A function that, per call, returns the given value, raises the given error, or blocks until released
+    """
+
+    def __init__(self, *behaviours):
+        self._behaviours = list(behaviours)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        with self._lock:
+            behaviour = self._behaviours[self.count]
+            self.count += 1
+        if behaviour == "block":
+            self.release.wait(5)
+            return "late"
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        return behaviour
+
+
+def test_no_deadline():
+    assert remaining() is None
+
+
+def test_nested_deadlines_can_only_shorten():
+    with deadline(1):
+        with deadline(10):
+            assert remaining() <= 1
+        with deadline(0.5):
+            assert remaining() <= 0.5
+        assert 0.5 < remaining() <= 1
+    assert remaining() is None
+
+
+def test_single_attempt_when_fast():
+    attempts = []
+    assert hedged(Calls("result"), 1, executor, on_attempt=lambda: attempts.append(1)) == "result"
+    assert attempts == []
+
+
+def test_slow_attempt_is_hedged():
+    func = Calls("block", "fast")
+    attempts = []
+    start = time.monotonic()
+    try:
+        assert hedged(func, 0.05, executor, on_attempt=lambda: attempts.append(1)) == "fast"
+    finally:
+        func.release.set()
+    assert time.monotonic() - start < 1
+    assert func.count == 2
+    assert attempts == [1]
+
+
+def test_failed_attempt_is_retried_at_once():
+    func = Calls(IOError("failed"), "result")
+    start = time.monotonic()
+    assert hedged(func, 5, executor) == "result"
+    assert time.monotonic() - start < 1
+
+
+def test_error_of_the_last_attempt():
+    with pytest.raises(IOError, match="second"):
+        hedged(Calls(IOError("first"), IOError("second")), 5, executor)
+
+
+def test_attempts_are_limited():
+    func = Calls(IOError("first"), IOError("second"), "third")
+    with pytest.raises(IOError):
+        hedged(func, 5, executor, attempts=2)
+    assert func.count == 2
+
+
+def test_deadline_exceeded():
+    func = Calls("block", "block")
+    start = time.monotonic()
+    try:
+        with deadline(0.2), pytest.raises(DeadlineExceeded):
+            hedged(func, 0.05, executor)
+    finally:
+        func.release.set()
+    assert 0.2 <= time.monotonic() - start < 1
+
+
+def test_attempts_run_within_the_deadline():
+    with deadline(1):
+        left = hedged(remaining, 1, executor)
+    assert 0 < left <= 1
+
+
+def test_attempts_waiting_for_the_executor_are_cancelled():
+    busy = Calls("block", "block")
+    own = ThreadPoolExecutor(max_workers=2)
+    try:
+        own.submit(busy)
+        own.submit(busy)
+        func = Calls("result")
+        with deadline(0.1), pytest.raises(DeadlineExceeded):
+            hedged(func, 0.05, own)
+    finally:
+        busy.release.set()
+    own.shutdown()
+    # the attempts never ran, not even once threads became free
+    assert func.count == 0
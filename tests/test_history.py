@@ -0,0 +1,115 @@
+import json
+import math
+import os
+import time
+
+from camera_control.history import HEARTBEAT_INTERVAL, SAMPLE, SPILL_BATCH, StateHistory
+
+
+def test_unchanged_state_is_only_sampled_as_heartbeat():
+    history = StateHistory()
+    history.append(0, False, None, True)
+    history.append(1, False, None, True)
+    history.append(HEARTBEAT_INTERVAL, False, None, True)
+    history.append(HEARTBEAT_INTERVAL + 1, False, None, False)
+    assert len(history) == 3
+
+
+def test_remaining_time_is_sampled_while_recording():
+    history = StateHistory()
+    for t in range(5):
+        history.append(t, True, 100 - t, True)
+    assert len(history) == 5
+
+
+def test_ring_buffer_keeps_the_latest_samples():
+    history = StateHistory(capacity=5)
+    for t in range(8):
+        history.append(t, True, 100 - t, True)
+    assert len(history) == 5
+    assert [sample[0] for sample in history.samples(0, 10)] == [3, 4, 5, 6, 7]
+
+
+def test_samples_include_the_one_valid_at_start():
+    history = StateHistory()
+    for t in range(0, 50, 10):
+        history.append(t, True, 100 - t, True)
+    assert [sample[0] for sample in history.samples(25, 45)] == [20, 30, 40]
+
+
+def test_timeline():
+    base = time.time() - 1000
+    history = StateHistory()
+    for t in range(0, 100, 5):
+        if t < 50:
+            history.append(base + t, True, 100 - t, True)
+        else:
+            history.append(base + t, False, None, True)
+    history.add_event(base + 50, "disconnected")
+    history.add_event(base + 200, "connected")
+    timeline = history.timeline(base, base + 100, 4)
+    assert timeline["recording"] == [1, 1, 0, 0]
+    assert timeline["connected"] == [1, 1, 1, 1]
+    assert timeline["remaining"] == [80, 55, None, None]
+    assert [event["event"] for event in timeline["events"]] == ["disconnected"]
+
+
+def test_timeline_does_not_bridge_gaps():
+    base = time.time() - 1000
+    history = StateHistory()
+    history.append(base, True, 100, True)
+    history.append(base + 100, True, 50, True)
+    timeline = history.timeline(base, base + 100, 4)
+    # the first sample is only valid for MAX_HOLD seconds
+    assert timeline["recording"] == [1, 0.2, None, None]
+
+
+def test_spill(tmp_path):
+    path = str(tmp_path / "camera")
+    history = StateHistory(capacity=SPILL_BATCH + 50, spill_path=path)
+    samples = SPILL_BATCH * 2 + 100
+    for t in range(samples):
+        history.append(t, True, samples - t, True)
+    assert os.path.getsize(path) == SPILL_BATCH * 2 * SAMPLE.size
+    history.flush()
+    assert os.path.getsize(path) == samples * SAMPLE.size
+    # samples no longer in memory are read from the spill file
+    assert [sample[0] for sample in history.samples(0, samples)] == list(range(samples))
+
+
+def test_small_ring_buffer_spills_before_overwriting(tmp_path):
+    path = str(tmp_path / "camera")
+    history = StateHistory(capacity=10, spill_path=path)
+    for t in range(25):
+        history.append(t, True, 100 - t, True)
+    history.flush()
+    assert [sample[0] for sample in history.samples(0, 25)] == list(range(25))
+
+
+def test_spill_file_is_rotated(tmp_path):
+    path = str(tmp_path / "camera")
+    history = StateHistory(capacity=10, spill_path=path, max_spill_bytes=SPILL_BATCH * SAMPLE.size)
+    samples = SPILL_BATCH * 3
+    for t in range(samples):
+        history.append(t, True, samples - t, True)
+    assert os.path.exists(path + ".1")
+    # the history on disk is at least max_spill_bytes long
+    assert [sample[0] for sample in history.samples(SPILL_BATCH, samples)] == list(range(SPILL_BATCH, samples))
+
+
+def test_unknown_values_are_spilled(tmp_path):
+    path = str(tmp_path / "camera")
+    history = StateHistory(capacity=10, spill_path=path)
+    history.append(0, None, None, False)
+    history.flush()
+    (timestamp, recording, remaining, connected), = SAMPLE.iter_unpack(open(path, "rb").read())
+    assert (timestamp, recording, connected) == (0, -1, 0)
+    assert math.isnan(remaining)
+
+
+def test_events_are_spilled(tmp_path):
+    path = str(tmp_path / "camera")
+    history = StateHistory(spill_path=path)
+    history.add_event(1, "gap", seconds=1.5)
+    with open(path + ".events") as f:
+        assert [json.loads(line) for line in f] == [{"time": 1, "event": "gap", "seconds": 1.5}]
@@ -0,0 +1,70 @@
+import io
+
+import pytest
+
+from camera_control.liveview import SONY_PAYLOAD_IMAGE, SonyLiveviewParser
+from camera_control.simulator import dummy_jpeg, sony_liveview_packet
+
+SONY_PAYLOAD_FRAME_INFO = 0x02
+
+
+def chunked_readinto(data, chunk_size):
+    """
+    readinto of a stream that returns at most chunk_size bytes per call, like a socket
+    """
+    stream = io.BytesIO(data)
+
+    def readinto(view):
+        return stream.readinto(view[:chunk_size])
+    return readinto
+
+
+def frames(data, chunk_size=None, **parser_args):
+    readinto = io.BytesIO(data).readinto if chunk_size is None else chunked_readinto(data, chunk_size)
+    return [bytes(frame) for frame in SonyLiveviewParser(readinto, **parser_args).frames()]
+
+
+def test_image_frames():
+    images = [dummy_jpeg(1000), dummy_jpeg(2000)]
+    data = b"".join(sony_liveview_packet(SONY_PAYLOAD_IMAGE, i, image) for i, image in enumerate(images))
+    assert frames(data) == images
+
+
+def test_partial_reads():
+    images = [dummy_jpeg(1000), dummy_jpeg(3000)]
+    data = b"".join(sony_liveview_packet(SONY_PAYLOAD_IMAGE, i, image) for i, image in enumerate(images))
+    assert frames(data, chunk_size=7) == images
+
+
+def test_frame_information_and_padding_are_skipped():
+    image = dummy_jpeg(500)
+    data = (sony_liveview_packet(SONY_PAYLOAD_FRAME_INFO, 0, bytes(16))
+            + sony_liveview_packet(SONY_PAYLOAD_IMAGE, 1, image, padding=13)
+            + sony_liveview_packet(SONY_PAYLOAD_IMAGE, 2, image))
+    assert frames(data) == [image, image]
+
+
+def test_buffer_grows_for_large_frames():
+    images = [dummy_jpeg(100), dummy_jpeg(10000), dummy_jpeg(100)]
+    data = b"".join(sony_liveview_packet(SONY_PAYLOAD_IMAGE, i, image) for i, image in enumerate(images))
+    assert frames(data, buffer_size=1024) == images
+
+
+def test_truncated_stream_ends_the_frames():
+    image = dummy_jpeg(1000)
+    data = sony_liveview_packet(SONY_PAYLOAD_IMAGE, 0, image) + sony_liveview_packet(SONY_PAYLOAD_IMAGE, 1, image)
+    assert frames(data[:-10]) == [image]
+    assert frames(data[:-len(image) - 10]) == [image]
+
+
+def test_invalid_header():
+    data = bytearray(sony_liveview_packet(SONY_PAYLOAD_IMAGE, 0, dummy_jpeg(100)))
+    data[0] = 0
+    with pytest.raises(ValueError):
+        frames(bytes(data))
+
+
+def test_payload_size_is_limited():
+    data = sony_liveview_packet(SONY_PAYLOAD_IMAGE, 0, dummy_jpeg(2000))
+    with pytest.raises(ValueError):
+        frames(data, max_payload_size=1000)
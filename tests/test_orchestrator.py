@@ -0,0 +1,48 @@
+from camera_control.orchestrator import Coverage, max_overlap, plan_restarts
+
+
+def test_max_overlap():
+    assert max_overlap([], 4) == 0
+    assert max_overlap([0, 0, 0], 4) == 3
+    assert max_overlap([0, 2, 5], 4) == 2
+    # a restart that starts as another one ends does not overlap it
+    assert max_overlap([0, 4, 8], 4) == 1
+
+
+def test_staggered_restarts_are_not_moved():
+    due = {"a": 10, "b": 20, "c": 30}
+    assert plan_restarts(due, 4, 1) == due
+
+
+def test_simultaneous_restarts_are_staggered():
+    due = {"a": 100, "b": 100, "c": 100, "d": 100}
+    planned = plan_restarts(due, 4, 1)
+    assert max_overlap(planned.values(), 4) == 1
+    assert all(planned[camera] <= due[camera] for camera in due)
+    # restarts are moved no further than needed
+    assert sorted(planned.values()) == [88, 92, 96, 100]
+
+
+def test_capacity():
+    due = {camera: 100 for camera in "abcdef"}
+    planned = plan_restarts(due, 4, 2)
+    assert max_overlap(planned.values(), 4) == 2
+    assert sorted(planned.values()) == [92, 92, 96, 96, 100, 100]
+
+
+def test_restarts_in_progress():
+    planned = plan_restarts({"a": 2, "b": 2}, 4, 1, busy=[0])
+    assert max_overlap([*planned.values(), 0], 4) == 1
+    assert all(at <= 2 for at in planned.values())
+
+
+def test_coverage():
+    coverage = Coverage(2)
+    coverage.add(0, 3)
+    coverage.add(10, 1)
+    coverage.add(15, 2)
+    coverage.pause()
+    # the time while paused is not counted
+    coverage.add(100, 2)
+    coverage.add(105, 2)
+    assert coverage.stats() == {"seconds": 20, "covered": 15 / 20, "min_recording": 1}
@@ -0,0 +1,49 @@
+from camera_control.registry import CameraRegistry
+
+
+class FakeWorker:
+    def __init__(self, address, type):
+        self.address = address
+        self.connected = False
+        self.last_connected_at = None
+        self.seen = 0
+        self.stopped = False
+
+    def on_seen(self):
+        self.seen += 1
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_known_cameras_are_told_they_were_seen():
+    registry = CameraRegistry(FakeWorker)
+    registry.add("10.0.0.1", None)
+    worker, = registry.workers()
+    assert worker.seen == 0
+    registry.add("10.0.0.1", None)
+    assert registry.workers() == [worker]
+    assert worker.seen == 1
+
+
+def test_absent_cameras_are_evicted():
+    registry = CameraRegistry(FakeWorker, evict_after=-1)
+    registry.add("10.0.0.1", None)
+    worker, = registry.workers()
+    registry.sweep()
+    assert registry.workers() == []
+    assert worker.stopped
+    registry.add("10.0.0.1", None)
+    assert registry.stats()["readoptions"] == 1
+
+
+def test_full_registry_makes_room_for_new_cameras():
+    registry = CameraRegistry(FakeWorker, max_size=1)
+    registry.add("10.0.0.1", None)
+    registry.workers()[0].connected = True
+    registry.add("10.0.0.2", None)
+    assert [worker.address for worker in registry.workers()] == ["10.0.0.1"]
+    registry.workers()[0].connected = False
+    registry.workers()[0].last_connected_at = 0
+    registry.add("10.0.0.2", None)
+    assert [worker.address for worker in registry.workers()] == ["10.0.0.2"]
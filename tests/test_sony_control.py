@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from camera_control import sony_control
+from camera_control.simulator import SimulatedSony
+from camera_control.sony_control import DescriptorCache, DeviceDescriptor, SonyCameraControl
+
+
+def descriptor(name="ILCE-7M3", fetched_at=None):
+    return DeviceDescriptor(name, "1.0", {"camera": "http://192.168.122.1:8080/sony"},
+                            time.monotonic() if fetched_at is None else fetched_at)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Monotonic and wall clock time of sony_control, advanced by the tests
+    """
+    class Clock:
+        now = 1000.0
+        offset = 1_700_000_000.0
+
+    monkeypatch.setattr(sony_control.time, "monotonic", lambda: Clock.now)
+    monkeypatch.setattr(sony_control.time, "time", lambda: Clock.now + Clock.offset)
+    return Clock
+
+
+def test_get_and_put():
+    cache = DescriptorCache()
+    assert cache.get("http://a/dd.xml") is None
+    cache.put("http://a/dd.xml", descriptor("a"))
+    assert cache.get("http://a/dd.xml").name == "a"
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = DescriptorCache(max_size=2)
+    cache.put("a", descriptor("a"))
+    cache.put("b", descriptor("b"))
+    cache.get("a")
+    cache.put("c", descriptor("c"))
+    assert cache.get("b") is None
+    assert cache.get("a").name == "a"
+    assert cache.get("c").name == "c"
+
+
+def test_entries_expire(clock):
+    cache = DescriptorCache(max_age=60)
+    cache.put("a", descriptor("a"))
+    clock.now += 60
+    assert cache.get("a") is not None
+    clock.now += 1
+    assert cache.get("a") is None
+
+
+def test_evict():
+    cache = DescriptorCache()
+    cache.put("a", descriptor("a"))
+    cache.evict("a")
+    cache.evict("unknown")
+    assert cache.get("a") is None
+
+
+def test_export_and_load(clock):
+    cache = DescriptorCache(max_age=60)
+    cache.put("a", descriptor("a"))
+    exported = cache.export()
+    assert exported["a"]["fetched_at"] == round(clock.now + clock.offset)
+    # e.g. after a restart of the web UI, whose monotonic clock starts anew
+    clock.now = 10.0
+    clock.offset += 1000 - 10 + 30
+    loaded = DescriptorCache(max_age=60)
+    loaded.load(exported)
+    assert loaded.get("a") == descriptor("a", fetched_at=10.0 - 30)
+
+
+def test_load_skips_expired_and_invalid_entries(clock):
+    cache = DescriptorCache(max_age=60)
+    cache.put("a", descriptor("a"))
+    exported = {**cache.export(), "invalid": {"name": "b"}}
+    clock.now += 61
+    loaded = DescriptorCache(max_age=60)
+    loaded.load(exported)
+    assert loaded.get("a") is None
+    assert loaded.get("invalid") is None
+
+
+@pytest.fixture
+def sony():
+    camera = SimulatedSony()
+    camera.long_poll_timeout = 0.2
+    control = SonyCameraControl(camera.address)
+    with control:
+        yield camera, control
+    camera.shutdown()
+
+
+def test_long_poll_without_change(sony):
+    camera, control = sony
+    state = control.get_state()
+    assert control.get_state(wait=True) == state
+
+
+def test_long_poll_error(sony):
+    camera, control = sony
+    control.get_state()
+    camera.long_poll_timeout = 2
+    other = threading.Thread(target=control.get_state, kwargs={"wait": True})
+    other.start()
+    time.sleep(0.2)
+    # the camera only answers one long-poll at a time
+    with pytest.raises(IOError, match="40402"):
+        control.get_state(wait=True)
+    camera.camera.start_recording()
+    other.join()
@@ -0,0 +1,67 @@
+import json
+import threading
+
+from camera_control.state_hub import StateHub, diff_cameras
+
+
+def test_versions_increase_with_changes():
+    hub = StateHub()
+    version = hub.version
+    hub.set_should_record(False)
+    assert hub.version == version
+    hub.set_should_record(True)
+    hub.update_camera("10.0.0.1", "G81", {"rec": True})
+    hub.update_camera("10.0.0.1", "G81", {"rec": True})
+    assert hub.version == version + 2
+
+
+def test_snapshots_are_not_modified():
+    hub = StateHub()
+    hub.update_camera("10.0.0.1", "G81", {"rec": False})
+    snapshot = hub.snapshot()
+    hub.update_camera("10.0.0.1", "G81", {"rec": True})
+    hub.update_camera("10.0.0.2", "GX80", {"rec": True})
+    assert snapshot.cameras == {"G81": {"rec": False}}
+    assert json.loads(snapshot.body) == {"version": snapshot.version, "should_record": False,
+                                         "cameras": {"G81": {"rec": False}}}
+
+
+def test_renamed_and_removed_cameras():
+    hub = StateHub()
+    hub.update_camera("10.0.0.1", "10.0.0.1", {"rec": False})
+    hub.update_camera("10.0.0.1", "G81", {"rec": False})
+    assert hub.snapshot().cameras == {"G81": {"rec": False}}
+    hub.remove_camera("10.0.0.1")
+    hub.remove_camera("10.0.0.1")
+    assert hub.snapshot().cameras == {}
+    assert hub.addresses() == []
+
+
+def test_wait_returns_a_changed_snapshot():
+    hub = StateHub()
+    version = hub.version
+    timer = threading.Timer(0.05, hub.set_should_record, (True,))
+    timer.start()
+    snapshot = hub.wait(version, 5)
+    timer.join()
+    assert snapshot.version == version + 1
+    assert snapshot.should_record
+
+
+def test_wait_returns_at_once_for_an_old_version():
+    hub = StateHub()
+    version = hub.version
+    hub.set_should_record(True)
+    assert hub.wait(version, 0).version == version + 1
+
+
+def test_wait_times_out():
+    hub = StateHub()
+    assert hub.wait(hub.version, 0.01) is None
+
+
+def test_diff_cameras():
+    old = {"G81": {"rec": False, "remaining": 100}, "GX80": {"rec": True}}
+    new = {"G81": {"rec": True, "remaining": 100}, "A7": {"rec": False}}
+    assert diff_cameras(old, new) == {"G81": {"rec": True}, "A7": {"rec": False}, "GX80": None}
+    assert diff_cameras(new, new) == {}
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from video_time_webui import App
+
+
+@pytest.fixture
+def client():
+    # nothing is discovered or persisted, as the background threads are not started
+    return App(interfaces=[])._app.test_client()
+
+
+def test_get_state_etag(client):
+    response = client.get("/get_state")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == f'"{response.get_json()["version"]}"'
+    assert client.get("/get_state", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_get_state_since_times_out(client):
+    version = client.get("/get_state").get_json()["version"]
+    assert client.get(f"/get_state?since={version}&wait=0").status_code == 304
+    assert client.get(f"/get_state?since={version}&wait=-5").status_code == 304
+
+
+def test_get_state_since_an_older_version(client):
+    version = client.get("/get_state").get_json()["version"]
+    response = client.get(f"/get_state?since={version - 1}&wait=30")
+    assert response.status_code == 200
+    assert response.get_json()["version"] == version
+
+
+@pytest.mark.parametrize("query", ["since=x", "since=1&wait=x", "since=1&wait=nan", "since=1&wait=inf"])
+def test_get_state_invalid_arguments(client, query):
+    assert client.get(f"/get_state?{query}").status_code == 400
+
+
+def test_record_at(client):
+    assert client.post(f"/record?at={time.time() + 0.01}", data="true").get_json() == {"late": 0}
+
+
+@pytest.mark.parametrize("at", ["x", "nan", "inf", str(time.time() + 3600)])
+def test_record_at_invalid_times(client, at):
+    assert client.post(f"/record?at={at}", data="true").status_code == 400
+
+
+@pytest.mark.parametrize("body", ['{}', '{"port": "x"}', '{"port": [80]}', '{"url": 80}', '[80]', 'not json'])
+def test_peers_invalid_registration(client, body):
+    assert client.post("/peers", data=body).status_code == 400
+
+
+def test_timeline(client):
+    timeline = client.get("/timeline?start=0&end=10&buckets=5").get_json()
+    assert timeline["step"] == 2
+    assert timeline["cameras"] == {}
+
+
+@pytest.mark.parametrize("query", ["start=x", "start=-inf", "start=nan", "end=inf", "start=1&end=1", "buckets=0"])
+def test_timeline_invalid_arguments(client, query):
+    assert client.get(f"/timeline?{query}").status_code == 400
@@ -0,0 +1,244 @@
+import datetime as dt
+import threading
+import time
+import types
+
+import pytest
+
+from camera_control import CameraControl, CameraState
+from camera_control.worker import (RESTART, RESTART_MARGIN, START, START_GRACE, STOP, STOP_FOR_RESTART,
+                                   CameraControlThread, RestartPolicy)
+
+
+def recording(remaining_seconds, saving=False):
+    return CameraState(True, dt.timedelta(seconds=remaining_seconds), saving=saving)
+
+
+def stopped(remaining_seconds=600):
+    return CameraState(False, dt.timedelta(seconds=remaining_seconds))
+
+
+def record_until(policy, now, remaining_seconds, until):
+    """
+    Observes a recording whose remaining time counts down once per second from now, and returns the time of the last
+    state observed before until
+    """
+    while now < until:
+        policy.observe(recording(remaining_seconds), now)
+        now += 1
+        remaining_seconds -= 1
+    return now - 1
+
+
+def test_start_when_stopped():
+    policy = RestartPolicy()
+    state = stopped()
+    policy.observe(state, 0)
+    assert policy.decide(state, True, 0) == START
+
+
+def test_start_is_not_repeated_within_grace():
+    policy = RestartPolicy()
+    state = stopped()
+    policy.observe(state, 0)
+    policy.on_start_sent(0)
+    assert policy.decide(state, True, START_GRACE / 2) is None
+    assert policy.decide(state, True, START_GRACE) == START
+
+
+def test_start_is_repeated_at_once_if_not_accepted():
+    policy = RestartPolicy()
+    state = stopped()
+    policy.on_start_sent(0, accepted=False)
+    assert policy.decide(state, True, 0.1) == START
+
+
+def test_nothing_to_do_while_recording():
+    policy = RestartPolicy()
+    state = recording(600)
+    policy.observe(state, 0)
+    assert policy.decide(state, True, 0) is None
+
+
+def test_stop_for_restart_close_to_the_limit():
+    policy = RestartPolicy()
+    policy.on_start_sent(0)
+    now = record_until(policy, 0, 30, 15)
+    assert policy.decide(recording(16), True, now) is None
+    now = record_until(policy, now + 1, 15, 30)
+    assert policy.decide(recording(1), True, now) == STOP_FOR_RESTART
+
+
+def test_stop_for_restart_uses_the_predicted_remaining_time():
+    policy = RestartPolicy()
+    policy.on_start_sent(0)
+    now = record_until(policy, 0, 30, 5)
+    # the last reported state is stale, the prediction is not
+    stale = recording(26)
+    runs_out = now + 26 - RESTART_MARGIN.total_seconds()
+    assert policy.decide(stale, True, runs_out - 1) is None
+    assert policy.decide(stale, True, runs_out + 0.5) == STOP_FOR_RESTART
+
+
+def test_no_decision_while_restarting():
+    policy = RestartPolicy()
+    policy.on_start_sent(0)
+    now = record_until(policy, 0, 12, 5)
+    policy.on_stop_sent(now, restart=True)
+    assert policy.restarting
+    # the camera still reports recording until it has stopped
+    assert policy.decide(recording(7), True, now + 0.1) is None
+
+
+def test_requested_restart():
+    policy = RestartPolicy()
+    policy.on_start_sent(0)
+    now = record_until(policy, 0, 600, 5)
+    policy.request_restart()
+    assert policy.decide(recording(595), True, now) == STOP_FOR_RESTART
+    policy.on_stop_sent(now, restart=True)
+    assert not policy.restart_requested
+    assert policy.decide(recording(595), True, now) is None
+
+
+def test_stop_when_recording_is_not_wanted():
+    policy = RestartPolicy()
+    state = recording(600)
+    policy.observe(state, 0)
+    assert policy.decide(state, False, 0) == STOP
+
+
+def test_no_stop_while_saving():
+    policy = RestartPolicy()
+    state = recording(600, saving=True)
+    policy.observe(state, 0)
+    assert policy.decide(state, False, 0) is None
+
+
+def test_restart_cameras_that_do_not_report_recording():
+    policy = RestartPolicy()
+    state = CameraState(None, dt.timedelta(minutes=29))
+    policy.observe(state, 0)
+    assert policy.decide(state, True, 0) == RESTART
+    policy.on_start_sent(0)
+    state = CameraState(None, dt.timedelta(minutes=28))
+    policy.observe(state, 1)
+    assert policy.decide(state, True, 1) is None
+    # the remaining time jumps up once the camera has stopped by itself
+    state = CameraState(None, dt.timedelta(minutes=30))
+    policy.observe(state, 2)
+    assert policy.decide(state, True, 2) == RESTART
+
+
+def test_gap_of_a_restart():
+    gaps = []
+    policy = RestartPolicy(on_gap=gaps.append)
+    policy.on_start_sent(0)
+    now = record_until(policy, 0, 15, 10)
+    policy.on_stop_sent(now + 0.5, restart=True)
+    policy.observe(stopped(), now + 1)
+    assert policy.decide(stopped(), True, now + 1) == START
+    policy.on_start_sent(now + 1)
+    policy.observe(recording(600), now + 2.5)
+    # from the last state seen recording to the first one seen recording again
+    assert gaps == [2.5]
+    assert not policy.restarting
+    assert policy.gap_stats() == {"restarts": 1, "last_gap": 2.5, "mean_gap": 2.5, "max_gap": 2.5}
+
+
+def test_gap_of_a_recording_that_stopped_by_itself():
+    gaps = []
+    policy = RestartPolicy(on_gap=gaps.append)
+    policy.on_start_sent(0)
+    now = record_until(policy, 0, 600, 3)
+    policy.observe(stopped(), now + 1)
+    assert policy.restarting
+    policy.observe(recording(600), now + 3)
+    assert gaps == [3]
+
+
+def test_no_gap_when_recording_is_stopped():
+    gaps = []
+    policy = RestartPolicy(on_gap=gaps.append)
+    policy.on_start_sent(0)
+    now = record_until(policy, 0, 600, 3)
+    policy.on_stop_sent(now, restart=False)
+    policy.observe(stopped(), now + 1)
+    policy.on_start_sent(now + 10)
+    policy.observe(recording(600), now + 11)
+    assert gaps == []
+
+
+def test_same_state_is_observed_once():
+    gaps = []
+    policy = RestartPolicy(on_gap=gaps.append)
+    policy.on_start_sent(0)
+    now = record_until(policy, 0, 600, 3)
+    policy.observe(stopped(), now + 1)
+    state = recording(600)
+    policy.observe(state, now + 2)
+    policy.observe(state, now + 3)
+    assert gaps == [2]
+
+
+class FailingEvents(CameraControl):
+    supports_events = True
+
+    def __init__(self, ip):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def get_state(self, wait=False):
+        self.calls += 1
+        self.release.wait(5)
+        raise IOError("Already polling")
+
+
+def worker_with_events():
+    app = types.SimpleNamespace(use_events=True, history_path=lambda ip: None)
+    return CameraControlThread(app, "10.0.0.1", FailingEvents)
+
+
+def test_listener_error_ends_the_connection():
+    worker = worker_with_events()
+    worker._start_listener()
+    worker._control.release.set()
+    worker._listener.join(5)
+    with pytest.raises(IOError):
+        worker._check_listener()
+    # an error is not retried by the listener itself
+    assert worker._control.calls == 1
+
+
+def test_listener_of_an_old_connection():
+    worker = worker_with_events()
+    worker._start_listener()
+    old_listener = worker._listener
+    while worker._control.calls == 0:
+        time.sleep(0.01)
+    worker._connection += 1
+    worker._start_listener()
+    # the new listener waits for the old one's long-poll to return
+    time.sleep(0.05)
+    assert worker._control.calls == 1
+    worker._control.release.set()
+    old_listener.join(5)
+    worker._listener.join(5)
+    assert worker._control.calls == 2
+    # only the error of the new listener ends the connection
+    assert worker._event_error[0] == worker._connection
+
+
+def test_seen_camera_is_reconnected_at_once():
+    worker = worker_with_events()
+    worker.consecutive_failures = 5
+    worker.on_seen()
+    assert worker.consecutive_failures == 0
+    assert worker._wakeup.is_set()
+
+
+def test_seen_camera_that_is_connected_is_left_alone():
+    worker = worker_with_events()
+    worker.connected = True
+    worker.on_seen()
+    assert not worker._wakeup.is_set()
@@ -1,152 +1,718 @@
 #!/usr/bin/python3
 
-import datetime as dt
+import argparse
+import json
+import math
 import os
 import threading
 import time
-import traceback
 import re
 import logging
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, request
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
 
-from camera_control import CameraState
-from camera_control.lumix_control import LumixCameraControl
-from camera_control.sony_control import SonyCameraControl
+from camera_control import metrics
+from camera_control.discovery import DiscoveryBackoff, SSDPListener, search
+from camera_control.orchestrator import RestartOrchestrator
+from camera_control.drivers import DriverRegistry
+from camera_control.persistence import StateFile
+from camera_control.registry import CameraRegistry
+from camera_control.settings import apply_profile, load_profile, validate_profile
+from camera_control.state_hub import StateHub, diff_cameras
+from camera_control.worker import CameraControlThread
 
-camera_types = [LumixCameraControl, SonyCameraControl]
+# The camera drivers are imported by the discovery threads once the web UI is being served, see
+# camera_control.drivers. Keep imports of this module light, they delay the start of the web UI.
 
 logger = logging.getLogger(__name__)
 
+ENGINES = ["thread", "asyncio"]
+
+REGISTRY_SWEEP_INTERVAL = 10
+
+DEFAULT_STATE_FILE = "~/.local/state/video-time/state.json"
+
+TIMELINE_BUCKETS = 120
+TIMELINE_MAX_BUCKETS = 1000
+
+# interval for keep-alive comments on idle event streams, so that proxies and phones don't drop the connection
+EVENTS_KEEPALIVE_INTERVAL = 15
+# longest time a /get_state?since=<version> request waits for a change
+GET_STATE_MAX_WAIT = 30
+# latest time ahead of now a federated /record?at=<Unix time> may be scheduled for. The primary schedules commands
+# only a network round trip ahead.
+MAX_RECORD_LEAD = 10
+
+# fields of cameras controlled by other processes or instances that are shown in the web UI
+REMOTE_CAMERA_FIELDS = ("connected", "rec", "remaining")
+# worker processes send the full state of their cameras, including statistics, at least this often
+SHARD_STATE_INTERVAL = 1
+
 
 class App:
-    def __init__(self, host="0.0.0.0", port=8000):
+    def __init__(self, host="0.0.0.0", port=8000, engine="thread", expected_cameras=None, discovery_interval=10,
+                 discovery_max_interval=120, use_events=False, evict_after=600, max_cameras=64,
+                 interfaces=None, settings_profile=None, history_dir=None, drivers=None, state_file=None,
+                 peers=None, primary=None, clock=time.time, process_per_interface=False, min_recording=None):
         self.should_record = False
-        self._control_threads = {}
-        self._discover_thread = threading.Thread(target=self._discover, daemon=True)
+        # wall clock used to schedule record commands forwarded between federated instances
+        self._clock = clock
+        self._drivers = drivers if drivers is not None else DriverRegistry()
+        # known cameras and the recording intent, kept across restarts
+        self._state_file = StateFile(state_file) if state_file else None
+        self._saved_state = self._state_file.load() if self._state_file is not None else {}
+        self._history_dir = history_dir
+        # settings applied to every camera when it connects and whenever the profile is changed
+        self.settings_profile = settings_profile
+        self.use_events = use_events
+        self._hub = StateHub()
+        if self._saved_state.get("should_record"):
+            logger.info("continuing to record, as the cameras were recording before the restart")
+            self.should_record = True
+            self._hub.set_should_record(True)
+        self._fan_out_lock = threading.Lock()
+        self._command_skew = None
         self._host = host
         self._port = port
 
-        interface_regex = re.compile(r"^(wlan|ap)\d+$")
-        self._discover_interfaces = [dev for dev in os.listdir("/sys/class/net/") if interface_regex.match(dev)]
+        if interfaces is None:
+            interface_regex = re.compile(r"^(wlan|ap)\d+$")
+            interfaces = [dev for dev in os.listdir("/sys/class/net/") if interface_regex.match(dev)]
+        self._discover_interfaces = interfaces
         logger.info(f"discovering on interfaces: {self._discover_interfaces}")
+        self._discovery_backoff = DiscoveryBackoff(discovery_interval, discovery_max_interval, expected_cameras)
+
+        # with process_per_interface, the cameras of every interface are controlled by a worker process each, and this
+        # process only serves the web UI
+        self._shards = []
+        self._shard_cameras = {}
+        self._shard_lock = threading.Lock()
+        if process_per_interface:
+            from camera_control.shards import ShardProcess
+            for interface in interfaces:
+                shard_kwargs = dict(
+                    engine=engine, discovery_interval=discovery_interval, discovery_max_interval=discovery_max_interval,
+                    use_events=use_events, evict_after=evict_after, max_cameras=max_cameras, interfaces=[interface],
+                    settings_profile=settings_profile, history_dir=history_dir, drivers=self._drivers.names,
+                    state_file=f"{state_file}.{interface}" if state_file else None,
+                    log_level=logging.getLogger().getEffectiveLevel(),
+                )
+                self._shards.append(ShardProcess(interface, _run_shard, (shard_kwargs,), self._on_shard_message,
+                                                 self._on_shard_start, self._on_shard_exit))
+        self._ssdp_listener = SSDPListener(self._drivers, self._discover_interfaces, self.add_camera)
+
+        if engine == "asyncio":
+            # asyncio is only imported when it is used
+            from camera_control.async_engine import AsyncCameraEngine
+            self._engine = AsyncCameraEngine(self, self._drivers, self._discover_interfaces, self._discovery_backoff)
+        elif engine == "thread":
+            self._engine = None
+            self._discover_thread = threading.Thread(target=self._discover, daemon=True)
+        else:
+            raise ValueError(f"unknown engine {engine}, expected one of {ENGINES}")
+        self._registry = CameraRegistry(self._create_worker, evict_after, max_cameras,
+                                        on_evict=self._hub.remove_camera)
+        self._sweep_thread = threading.Thread(target=self._sweep_registry, daemon=True)
+        self._federation = self._create_federation(peers or (), primary) if peers or primary else None
+        self._federation_lock = threading.Lock()
+        self._warm_start_thread = threading.Thread(target=self._warm_start, name="WarmStart", daemon=True)
+        # staggers the restarts of the cameras, so that at least min_recording of them are always recording
+        self._orchestrator = None
+        if min_recording:
+            if process_per_interface:
+                logger.warning("restarts are not staggered across worker processes")
+            else:
+                self._orchestrator = RestartOrchestrator(self._registry.workers, min_recording,
+                                                         lambda: self.should_record)
 
         self._app = Flask(__name__)
         self._app.add_url_rule("/", view_func=self._serve_index)
         self._app.add_url_rule("/get_state", view_func=self._get_state)
+        self._app.add_url_rule("/stats", view_func=self._stats)
+        self._app.add_url_rule("/events", view_func=self._events)
+        self._app.add_url_rule("/metrics", view_func=self._metrics)
+        self._app.add_url_rule("/live/<path:camera>", view_func=self._live)
         self._app.add_url_rule("/record", view_func=self._record, methods=['POST'])
+        self._app.add_url_rule("/settings", view_func=self._settings, methods=['GET', 'POST'])
+        self._app.add_url_rule("/timeline", view_func=self._timeline)
+        self._app.add_url_rule("/clock", view_func=self._clock_time)
+        self._app.add_url_rule("/peers", view_func=self._peers, methods=['GET', 'POST'])
 
     def run(self):
-        self._discover_thread.start()
-        self._app.run(self._host, self._port)
+        # bind the socket before the discovery threads start importing the camera drivers, so that the web UI is
+        # reachable as early as possible
+        server = make_server(self._host, self._port, self._app, threaded=True)
+        logger.info(f"serving the web UI on http://{self._host}:{self._port}")
+        self.start_background()
+        server.serve_forever()
+
+    def start_background(self):
+        """
+        Starts the camera control and the other background threads, everything but serving the web UI
+        """
+        self._sweep_thread.start()
+        if self._federation is not None:
+            self._federation.start()
+        if self._shards:
+            for shard in self._shards:
+                shard.start()
+            return
+        self._warm_start_thread.start()
+        self._ssdp_listener.start()
+        if self._orchestrator is not None:
+            self._orchestrator.start()
+        if self._engine is not None:
+            self._engine.start()
+        else:
+            self._discover_thread.start()
+
+    def serve_shard(self, connection):
+        """
+        Runs in a worker process with process_per_interface: controls the cameras without serving the web UI, sends
+        their state to the front end and executes its commands
+        """
+        from camera_control.shards import ShardConnection
+        connection = ShardConnection(connection)
+        threading.Thread(target=self._receive_shard_commands, args=(connection,), name="ShardCommands",
+                         daemon=True).start()
+        self.start_background()
+        sent = None
+        version = None
+        while True:
+            snapshot = self._hub.wait(version, SHARD_STATE_INTERVAL)
+            if snapshot is not None:
+                version = snapshot.version
+            cameras = self.cameras_state()
+            changes = diff_cameras(sent or {}, cameras)
+            if changes or sent is None:
+                try:
+                    connection.send(("cameras", changes, sent is None))
+                except (OSError, ValueError):
+                    # the front end has exited
+                    os._exit(0)
+                sent = cameras
+
+    def _receive_shard_commands(self, connection):
+        while True:
+            try:
+                message = connection.receive()
+            except (EOFError, OSError):
+                os._exit(0)
+            if message[0] == "record":
+                self._set_should_record(message[1])
+            elif message[0] == "configure":
+                self.settings_profile = message[1]["settings_profile"]
+                if message[1]["should_record"] != self.should_record:
+                    self._set_should_record(message[1]["should_record"])
+            elif message[0] == "call":
+                threading.Thread(target=self._answer_shard_call, args=(connection, *message[1:]), daemon=True).start()
+
+    def _answer_shard_call(self, connection, call_id, method, args):
+        calls = {"settings": self.apply_settings_profile, "timeline": self.timelines}
+        try:
+            result, error = calls[method](*args), None
+        except Exception as e:
+            logger.warning(f"{method} failed", exc_info=True)
+            result, error = None, str(e)
+        try:
+            connection.send(("result", call_id, result, error))
+        except (OSError, ValueError):
+            pass
+
+    def _on_shard_start(self, shard):
+        shard.send(("configure", {"should_record": self.should_record, "settings_profile": self.settings_profile}))
+
+    def _on_shard_message(self, shard, message):
+        _, changes, full = message
+        with self._shard_lock:
+            cameras = self._shard_cameras.setdefault(shard.shard_name, {})
+            if full:
+                # the worker process has been restarted, cameras it does not know anymore are gone
+                for key in [key for key in cameras if key not in changes]:
+                    changes[key] = None
+            for key, fields in changes.items():
+                if fields is None:
+                    cameras.pop(key, None)
+                    self._hub.remove_camera((shard.shard_name, key))
+                else:
+                    cameras[key] = {**cameras.get(key, {}), **fields}
+                    self._publish_remote_camera((shard.shard_name, key), f"{key} @ {shard.shard_name}", cameras[key])
+
+    def _on_shard_exit(self, shard):
+        with self._shard_lock:
+            cameras = self._shard_cameras.get(shard.shard_name, {})
+            for key in cameras:
+                # the state is unknown until the worker process has been restarted
+                cameras[key] = {**cameras[key], "connected": False, "rec": None, "remaining": None}
+                self._publish_remote_camera((shard.shard_name, key), f"{key} @ {shard.shard_name}", cameras[key])
+
+    def _publish_remote_camera(self, address, key, fields):
+        self._hub.update_camera(address, key, {**{name: fields.get(name) for name in REMOTE_CAMERA_FIELDS},
+                                               "liveview": False})
+
+    def _call_shards(self, method, *args):
+        """
+        Calls a method in all worker processes in parallel, and returns their results by shard
+        """
+        def call(shard):
+            try:
+                return shard.call(method, *args)
+            except IOError as e:
+                logger.warning(f"{method} in worker process {shard.shard_name} failed: {e}")
+                return None
+
+        if not self._shards:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(self._shards), thread_name_prefix="shard-call") as executor:
+            return dict(zip(self._shards, executor.map(call, self._shards)))
+
+    def _create_federation(self, peers=(), primary=None):
+        # only imported with peers, as it needs requests
+        from camera_control.federation import Federation
+        return Federation(self._hub, peers, primary, self._port, self._clock)
+
+    def add_camera(self, ip, type):
+        """
+        Starts controlling the camera at the given address, unless it is already known
+        """
+        self._registry.add(ip, type)
+
+    def camera_count(self):
+        return len(self._registry)
+
+    def history_path(self, ip):
+        """
+        Path of the file the camera's state history is spilled to, or None to keep it in memory only
+        """
+        if self._history_dir is None:
+            return None
+        return os.path.join(self._history_dir, re.sub(r"[^A-Za-z0-9.-]+", "_", ip) + ".history")
+
+    def _create_worker(self, ip, type):
+        if self._engine is not None:
+            return self._engine.add_camera(ip, type)
+        worker = CameraControlThread(self, ip, type)
+        worker.start()
+        return worker
+
+    def _sweep_registry(self):
+        while True:
+            time.sleep(REGISTRY_SWEEP_INTERVAL)
+            self._registry.sweep()
+            self._save_state()
+
+    def _warm_start(self):
+        """
+        Reconnects to the cameras known before the restart right away, while discovery only refreshes them in the
+        background. The workers connect in parallel.
+        """
+        cameras = self._saved_state.get("cameras", [])
+        caches = self._saved_state.get("driver_caches", {})
+        for name in self._drivers.names:
+            if name in caches or any(camera.get("driver") == name for camera in cameras):
+                try:
+                    type = self._drivers.load(name)
+                    if name in caches:
+                        type.import_cache(caches[name])
+                except Exception:
+                    logger.error(f"cannot restore cameras of driver {name}", exc_info=True)
+                    continue
+                for camera in cameras:
+                    if camera.get("driver") == name:
+                        logger.info(f"reconnecting to {camera.get('name') or camera['address']}")
+                        self.add_camera(camera["address"], type)
+
+    def _save_state(self):
+        if self._state_file is None:
+            return
+        cameras = []
+        for ip, worker in self._registry.items():
+            name = self._drivers.name_of(worker.camera_type)
+            if name is not None:
+                cameras.append({"address": ip, "driver": name, "name": worker.cam_name})
+        caches = {}
+        for type in self._drivers.loaded():
+            cache = type.export_cache()
+            if cache:
+                caches[self._drivers.name_of(type)] = cache
+        try:
+            self._state_file.save({"should_record": self.should_record, "cameras": cameras, "driver_caches": caches})
+        except OSError:
+            logger.warning(f"cannot save the state to {self._state_file.path}", exc_info=True)
+
+    def publish_camera(self, worker):
+        """
+        Called by the workers whenever their camera's state may have changed
+        """
+        key = worker.cam_name if worker.cam_name is not None else worker.ip
+        self._hub.update_camera(worker.ip, key, worker.public_fields())
 
     def _serve_index(self):
         return self._app.send_static_file("webui.html")
 
     def _get_state(self):
+        """
+        The state shown in the web UI, with its version as ETag. With ?since=<version>, waits until the state differs
+        from that version, for up to ?wait=<seconds> (by default and at most GET_STATE_MAX_WAIT), and answers 304 if it
+        has not changed by then. As the state is only serialized when it changes, polling clients are cheap.
+        """
+        metrics.http_requests_total.inc("get_state")
+        snapshot = self._hub.snapshot()
+        if "since" in request.args:
+            try:
+                since = int(request.args["since"])
+                wait = float(request.args.get("wait", GET_STATE_MAX_WAIT))
+                # waiting for NaN seconds would never time out
+                if not math.isfinite(wait):
+                    raise ValueError(f"wait must be finite, not {wait}")
+            except ValueError:
+                return {"error": "since must be a version and wait a number of seconds"}, 400
+            wait = min(max(wait, 0), GET_STATE_MAX_WAIT)
+            if snapshot.version == since:
+                snapshot = self._hub.wait(since, wait)
+                if snapshot is None:
+                    response = Response(status=304)
+                    response.set_etag(str(since))
+                    return response
+        response = Response(snapshot.body, mimetype="application/json", headers={"Cache-Control": "no-cache"})
+        response.set_etag(str(snapshot.version))
+        return response.make_conditional(request)
+
+    def _stats(self):
+        """
+        Statistics of the camera control, the cameras and everything else the web UI is connected to
+        """
+        metrics.http_requests_total.inc("stats")
         return {
             "should_record": self.should_record,
-            "cameras": {
-                self._control_threads[ip].cam_name if self._control_threads[ip].cam_name is not None else ip: {
-                    "connected": self._control_threads[ip].connected,
-                    "rec": self._control_threads[ip].cam_state.recording if self._control_threads[ip].cam_state is not None else None,
-                    "remaining": self._control_threads[ip].cam_state.remaining.total_seconds() if self._control_threads[ip].cam_state is not None and self._control_threads[ip].cam_state.remaining is not None else None,
-                } for ip in self._control_threads
+            "command_skew": self._command_skew,
+            "registry": self._registry.stats(),
+            "drivers": self._drivers.stats(),
+            "federation": {
+                "peers": self._federation.stats(),
+                "last_record": self._federation.last_record,
+            } if self._federation is not None else None,
+            "shards": {shard.shard_name: shard.stats() for shard in self._shards} if self._shards else None,
+            "orchestrator": self._orchestrator.stats() if self._orchestrator is not None else None,
+            "cameras": self.cameras_state(),
+        }
+
+    def cameras_state(self):
+        """
+        State and statistics of all cameras, including those of federated peers and worker processes
+        """
+        cameras = self._federation.cameras() if self._federation is not None else {}
+        with self._shard_lock:
+            for name, shard_cameras in self._shard_cameras.items():
+                for key, fields in shard_cameras.items():
+                    # the live view is not passed on between processes
+                    cameras[f"{key} @ {name}"] = {**fields, "liveview": False, "shard": name}
+        for ip, worker in self._registry.items():
+            cameras[worker.cam_name if worker.cam_name is not None else ip] = {
+                **worker.public_fields(),
+                "http": worker.connection_stats(),
+                "restart": worker.restart_stats(),
+                "retries": worker.retries,
+                "consecutive_failures": worker.consecutive_failures,
             }
+        return cameras
+
+    def _clock_time(self):
+        """
+        Current time of this instance, for federated instances to estimate the offset of their clocks
+        """
+        return {"time": self._clock()}
+
+    def _peers(self):
+        """
+        GET returns the federated peers. POST registers the sender as a peer, given the port of its web UI or its URL.
+        """
+        metrics.http_requests_total.inc("peers")
+        if request.method == "POST":
+            data = request.get_json(force=True, silent=True)
+            try:
+                url = data.get("url") or (f"http://{request.remote_addr}:{int(data['port'])}"
+                                          if data.get("port") else None)
+            except (AttributeError, ValueError, TypeError):
+                # not a JSON object, or not a port number
+                url = None
+            if not isinstance(url, str):
+                return {"error": "expected the url or port of the peer"}, 400
+            with self._federation_lock:
+                if self._federation is None:
+                    self._federation = self._create_federation()
+                    self._federation.start()
+            self._federation.add_peer(url, registered=True)
+        return self._federation.stats() if self._federation is not None else {}
+
+    def _metrics(self):
+        return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+    def _live(self, camera):
+        """
+        MJPEG stream of a camera's live view. The camera is identified by its key in /get_state.
+        """
+        metrics.http_requests_total.inc("live")
+        worker = next((worker for ip, worker in self._registry.items()
+                       if camera in (ip, worker.cam_name)), None)
+        if worker is None:
+            return "unknown camera", 404
+        liveview = worker.liveview()
+        if liveview is None:
+            return "live view not supported by this camera", 501
+        frames = liveview.frames()
+        if frames is None:
+            return "too many clients watching this camera", 503
+
+        def stream():
+            for frame in frames:
+                # the frame is yielded on its own so that it is not copied for every client
+                yield b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(frame)
+                yield frame
+                yield b"\r\n"
+
+        return Response(stream(), mimetype="multipart/x-mixed-replace; boundary=frame",
+                        headers={"Cache-Control": "no-cache"})
+
+    def _timeline(self):
+        """
+        Downsampled history of all cameras between start and end (Unix timestamps, by default the last hour), split
+        into the given number of buckets. Optionally limited to a single camera.
+        """
+        metrics.http_requests_total.inc("timeline")
+        try:
+            end = float(request.args.get("end", time.time()))
+            start = float(request.args.get("start", end - 3600))
+            buckets = int(request.args.get("buckets", TIMELINE_BUCKETS))
+        except ValueError:
+            return {"error": "start, end and buckets must be numbers"}, 400
+        if not math.isfinite(start) or not math.isfinite(end):
+            return {"error": "start and end must be finite"}, 400
+        if not start < end or not 0 < buckets <= TIMELINE_MAX_BUCKETS:
+            return {"error": f"expected start < end and 0 < buckets <= {TIMELINE_MAX_BUCKETS}"}, 400
+        return {
+            "start": start,
+            "end": end,
+            "step": (end - start) / buckets,
+            "cameras": self.timelines(start, end, buckets, request.args.get("camera")),
+        }
+
+    def timelines(self, start, end, buckets, camera=None):
+        """
+        Downsampled history of all cameras or the given one, see StateHistory.timeline
+        """
+        timelines = {
+            worker.cam_name if worker.cam_name is not None else ip: worker.history.timeline(start, end, buckets)
+            for ip, worker in self._registry.items() if camera is None or camera in (ip, worker.cam_name)
         }
+        for shard, shard_timelines in self._call_shards("timeline", start, end, buckets).items():
+            for key, timeline in (shard_timelines or {}).items():
+                key = f"{key} @ {shard.shard_name}"
+                if camera is None or camera == key:
+                    timelines[key] = timeline
+        return timelines
+
+    def _events(self):
+        """
+        Server-Sent Events stream of the state. The first event contains the full state, the following ones only the
+        fields that have changed.
+        """
+        metrics.http_requests_total.inc("events")
+        def stream():
+            sent = self._hub.snapshot()
+            yield f"data: {sent.body}\n\n"
+            while True:
+                snapshot = self._hub.wait(sent.version, EVENTS_KEEPALIVE_INTERVAL)
+                if snapshot is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                update = {}
+                if snapshot.should_record != sent.should_record:
+                    update["should_record"] = snapshot.should_record
+                changes = diff_cameras(sent.cameras, snapshot.cameras)
+                if changes:
+                    update["cameras"] = changes
+                sent = snapshot
+                if update:
+                    yield f"data: {json.dumps(update)}\n\n"
+
+        return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
     def _record(self):
+        """
+        Starts or stops recording. With ?at=<Unix time>, as sent by a federation primary, the command is executed at
+        that time. Without, it is forwarded to the federated peers, to be executed at the same time on all instances.
+        """
         data = request.data
-        if data == b'true':
-            self.should_record = True
-        elif data == b'false':
-            self.should_record = False
-        return ""
+        should_record = {b'true': True, b'false': False}.get(data, self.should_record)
+        try:
+            at = float(request.args["at"]) if "at" in request.args else None
+            if at is not None and not (math.isfinite(at) and at - self._clock() <= MAX_RECORD_LEAD):
+                raise ValueError(f"at must be at most {MAX_RECORD_LEAD} s ahead, not {at}")
+        except ValueError:
+            return {"error": f"at must be a Unix timestamp at most {MAX_RECORD_LEAD} s ahead"}, 400
+        if at is None and self._federation is not None:
+            at = self._federation.broadcast_record(should_record)
+        if at is None:
+            self._set_should_record(should_record)
+            return ""
+        late = max(self._clock() - at, 0)
+        threading.Thread(target=self._record_at, args=(should_record, at), daemon=True).start()
+        return {"late": late}
 
-    def _discover(self):
-        while True:
-            for type in camera_types:
-                for interface in self._discover_interfaces:
-                    try:
-                        cam_ips = type.discover(iface=interface)
-                        for cam_ip in cam_ips:
-                            if cam_ip not in self._control_threads:
-                                thread = CameraControlThread(self, cam_ip, type)
-                                thread.start()
-                                self._control_threads[cam_ip] = thread
-                    except:
-                        traceback.print_exc()
+    def _record_at(self, should_record, at):
+        time.sleep(max(at - self._clock(), 0))
+        self._set_should_record(should_record)
 
-            time.sleep(10)
+    def _set_should_record(self, should_record):
+        self.should_record = should_record
+        self._hub.set_should_record(should_record)
+        threading.Thread(target=self._fan_out_record, daemon=True).start()
+        for shard in self._shards:
+            shard.send(("record", should_record))
+        # the recording intent is saved right away, the cameras with the next registry sweep
+        self._save_state()
 
+    def _fan_out_record(self):
+        """
+        Sends the start/stop commands to all connected cameras at the same time, instead of waiting for each worker to
+        notice the change on its next poll
+        """
+        with self._fan_out_lock:
+            should_record = self.should_record
+            workers = [worker for worker in self._registry.workers() if worker.connected]
+            if not workers:
+                return
+            # release all commands together once every thread is ready
+            barrier = threading.Barrier(len(workers), timeout=1)
 
-class CameraControlThread(threading.Thread):
-    def __init__(self, app, ip, type):
-        self.ip = ip
-        self._control = type(ip)
+            def command(worker):
+                try:
+                    barrier.wait()
+                except threading.BrokenBarrierError:
+                    pass
+                try:
+                    return worker.apply_record(should_record)
+                except Exception:
+                    logger.warning(f"sending record command to {worker.ip} failed", exc_info=True)
+                    return None
 
-        self.connected = False
-        self.cam_state: Optional[CameraState] = None
-        self.cam_name = None
-        self._app = app
+            with ThreadPoolExecutor(max_workers=len(workers), thread_name_prefix="record") as executor:
+                timings = [timing for timing in executor.map(command, workers) if timing is not None]
+            if timings:
+                sent = [timing[0] for timing in timings]
+                acked = [timing[1] for timing in timings]
+                # spread between the cameras of the time the command was sent and the time it was acknowledged
+                self._command_skew = {
+                    "cameras": len(timings),
+                    "sent": max(sent) - min(sent),
+                    "acknowledged": max(acked) - min(acked),
+                }
+                logger.info(f"record command skew: {self._command_skew}")
 
-        super().__init__(name=f"{type.__name__}({ip})", daemon=True)
+    def _settings(self):
+        """
+        GET returns the settings profile. POST sets a new profile and applies it to all connected cameras in parallel,
+        returning the changed settings per camera. With ?refresh=1, the cameras' current values are read again instead
+        of relying on the cached ones.
+        """
+        metrics.http_requests_total.inc("settings")
+        if request.method == "GET":
+            return {"profile": self.settings_profile}
+        try:
+            profile = validate_profile(request.get_json(force=True), self._drivers.load_all())
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        results = self.apply_settings_profile(profile, refresh=request.args.get("refresh") == "1")
+        return {"profile": profile, "cameras": results}
 
-    def run(self):
-        logger.info(f"Camera control starting for {self.ip}")
-        while True:
-            self.connected = False
-            try:
-                with self._control:
-                    self.connected = True
-                    self.cam_name = self._control.name
-                    logger.debug(f"Camera {self.cam_name} connected")
-
-                    self._control.prepare()
-
-                    prev_remaining = dt.timedelta(hours=99)
-                    started = False
-                    while True:
-                        self.cam_state = self._control.get_state()
-                        logger.debug(f"Camera {self.cam_name} state is {self.cam_state}")
-
-                        should_record = self._app.should_record
-                        if should_record:
-                            should_restart = False
-                            if self.cam_state.recording is not None:
-                                # restart if recording has stopped or less than 10s remaining
-                                should_restart = not self.cam_state.recording or self.cam_state.remaining is not None and self.cam_state.remaining < dt.timedelta(seconds=10)
-                            elif self.cam_state.remaining is not None:
-                                # restart if recording has not yet been started or remaining time has increased significantly
-                                should_restart = self.cam_state.remaining > prev_remaining + dt.timedelta(
-                                    minutes=1) or not started
-
-                            if should_restart:
-                                logger.info('restarting recording for {}'.format(self.ip))
-                                try:
-                                    self._control.video_record_stop()
-                                except:
-                                    pass
-
-                                self._control.video_record_start()
-                                started = True
-                        else:
-                            if self.cam_state.recording or started:
-                                logger.info('stopping recording for {}'.format(self.ip))
-                                try:
-                                    self._control.video_record_stop()
-                                except:
-                                    pass
-                                started = False
-                        prev_remaining = self.cam_state.remaining
-                        time.sleep(1)
-            except:
-                logger.debug(f"Camera {self.cam_name} disconnected")
-                traceback.print_exc()
-                time.sleep(5)
-                pass
+    def apply_settings_profile(self, profile, refresh=False):
+        """
+        Sets a new settings profile and applies it to all connected cameras in parallel, see apply_profile
+        """
+        self.settings_profile = profile
+        workers = [worker for worker in self._registry.workers() if worker.connected]
+        results = apply_profile(workers, profile, refresh)
+        for shard, shard_results in self._call_shards("settings", profile, refresh).items():
+            results.update(shard_results or {})
+        return results
+
+    def _discover(self):
+        camera_types = self._drivers.load_all()
+        with ThreadPoolExecutor(max_workers=max(len(camera_types) * len(self._discover_interfaces), 1),
+                                thread_name_prefix="discover") as executor:
+            while True:
+                for type, cam_ip in search(camera_types, self._discover_interfaces, executor):
+                    self.add_camera(cam_ip, type)
+
+                time.sleep(self._discovery_backoff.next_interval(self.camera_count()))
+
+
+def _run_shard(connection, kwargs):
+    """
+    Entry point of the worker processes with process_per_interface
+    """
+    logging.basicConfig(level=kwargs.pop("log_level"))
+    App(drivers=DriverRegistry(kwargs.pop("drivers")), **kwargs).serve_shard(connection)
 
 
 if __name__ == '__main__':
-    App().run()
+    parser = argparse.ArgumentParser(description="Web UI to automatically restart camera video recordings")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--engine", choices=ENGINES, default="thread",
+                        help="run one thread per camera, or supervise all cameras from a single asyncio event loop")
+    parser.add_argument("--expected-cameras", type=int,
+                        help="back off active discovery once this many cameras have been found")
+    parser.add_argument("--discovery-interval", type=float, default=10,
+                        help="seconds between active SSDP searches")
+    parser.add_argument("--discovery-max-interval", type=float, default=120,
+                        help="maximum seconds between active SSDP searches after backing off")
+    parser.add_argument("--events", action="store_true",
+                        help="react to state change events from cameras that support them (Sony) instead of polling")
+    parser.add_argument("--evict-after", type=float, default=600,
+                        help="forget cameras that have been unreachable and not discovered for this many seconds")
+    parser.add_argument("--max-cameras", type=int, default=64,
+                        help="maximum number of cameras to control at the same time")
+    parser.add_argument("--interfaces", nargs="+",
+                        help="network interfaces to discover cameras on, by default all wlan* and ap* interfaces")
+    parser.add_argument("--drivers", nargs="+",
+                        help="camera drivers to enable, by default lumix and sony. Drivers of other packages are "
+                             "given by their entry point name or as module:class")
+    parser.add_argument("--profile", help="JSON file with camera settings to apply to every camera")
+    parser.add_argument("--history-dir",
+                        help="directory to keep the state history of the cameras in, in addition to memory")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FILE,
+                        help="file to keep the known cameras and whether to record in, to reconnect and continue "
+                             "recording right away after a restart. An empty string disables it.")
+    parser.add_argument("--peers", nargs="+", metavar="URL",
+                        help="web UIs on other hosts to show the cameras of and to forward record commands to, "
+                             "e.g. http://raspi2:8000")
+    parser.add_argument("--primary", metavar="URL",
+                        help="web UI to register this one at as a peer, so that it can be controlled from there")
+    parser.add_argument("--process-per-interface", action="store_true",
+                        help="control the cameras of every interface in a separate worker process, so that a hanging "
+                             "camera or driver cannot delay the others")
+    parser.add_argument("--min-recording", type=int, metavar="N",
+                        help="stagger the restarts of the cameras, restarting some of them early, so that at least N "
+                             "cameras are recording at any time")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    try:
+        drivers = DriverRegistry(args.drivers)
+    except ValueError as e:
+        parser.error(str(e))
+    # validating a profile needs the drivers, so they are imported before the web UI starts in this case
+    settings_profile = load_profile(args.profile, drivers.load_all()) if args.profile else None
+    App(args.host, args.port, engine=args.engine, expected_cameras=args.expected_cameras,
+        discovery_interval=args.discovery_interval, discovery_max_interval=args.discovery_max_interval,
+        use_events=args.events, evict_after=args.evict_after, max_cameras=args.max_cameras,
+        interfaces=args.interfaces, settings_profile=settings_profile, history_dir=args.history_dir,
+        drivers=drivers, state_file=os.path.expanduser(args.state_file), peers=args.peers,
+        primary=args.primary, process_per_interface=args.process_per_interface,
+        min_recording=args.min_recording).run()